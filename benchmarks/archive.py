@@ -0,0 +1,207 @@
+#!/usr/bin/env python2
+#
+# Throughput benchmarks for archive partitioning.
+#
+# Synthesizes a Maven-shaped repository (many small POMs, some large jars,
+# deep groupId paths), then measures create_partitioned_zips_from_dir and
+# create_partitioned_zips_from_zip (buffered and mmap) for wall time, peak
+# RSS, bytes/sec and read/write syscalls. Each case runs in a fresh child
+# process so peak RSS is not polluted by earlier cases. Results are emitted
+# as JSON so they can be tracked across releases.
+#
+# Usage: python benchmarks/archive.py [--artifacts N] [--output results.json]
+
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import Queue
+import random
+import resource
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+import zipfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from rcm_nexus import archive
+
+POM_TEMPLATE = """<?xml version="1.0" encoding="UTF-8"?>
+<project>
+  <modelVersion>4.0.0</modelVersion>
+  <groupId>%(group_id)s</groupId>
+  <artifactId>%(artifact_id)s</artifactId>
+  <version>%(version)s</version>
+</project>
+"""
+
+CASES = {
+    'dir': lambda src, out: archive.create_partitioned_zips_from_dir(src['dir'], out),
+    'zip': lambda src, out: archive.create_partitioned_zips_from_zip(src['zip'], out),
+    'zip-mmap': lambda src, out: archive.create_partitioned_zips_from_zip(src['zip'], out, use_mmap=True),
+    'dir-checksums': lambda src, out: archive.create_partitioned_zips_from_dir(src['dir'], out, checksums=archive.CHECKSUM_ALGORITHMS),
+}
+
+
+def synthesize_repo(root, artifacts, jar_ratio, jar_size, group_depth, seed):
+    """Write a Maven repository layout under root, returning (file_count, total_bytes).
+       Every artifact gets a POM; roughly jar_ratio of them also get a jar of jar_size bytes.
+    """
+    rnd = random.Random(seed)
+    jar_payload = os.urandom(jar_size)
+    count = 0
+    total = 0
+    for i in range(artifacts):
+        group_parts = ['org'] + ["g%d" % rnd.randint(0, 9) for d in range(group_depth - 1)]
+        artifact_id = "artifact-%d" % i
+        version = "1.%d.0" % rnd.randint(0, 20)
+        gav_dir = os.path.join(root, *(group_parts + [artifact_id, version]))
+        os.makedirs(gav_dir)
+
+        base = os.path.join(gav_dir, "%s-%s" % (artifact_id, version))
+        pom = POM_TEMPLATE % {'group_id': '.'.join(group_parts), 'artifact_id': artifact_id, 'version': version}
+        with open(base + '.pom', 'w') as f:
+            f.write(pom)
+        count += 1
+        total += len(pom)
+
+        if rnd.random() < jar_ratio:
+            with open(base + '.jar', 'wb') as f:
+                f.write(jar_payload)
+            count += 1
+            total += jar_size
+
+    return (count, total)
+
+def zip_repo(root, zip_path):
+    zf = zipfile.ZipFile(zip_path, mode='w')
+    for (dirpath, dirnames, filenames) in os.walk(root):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            zf.write(path, os.path.relpath(path, root))
+    zf.close()
+
+def _io_counters():
+    """Return the read/write syscall counters for this process, or None if unavailable (non-Linux)."""
+    counters = {}
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                counters[key.strip()] = int(value)
+    except IOError:
+        return None
+    return counters
+
+def _run_case(name, sources, result_queue):
+    out_dir = tempfile.mkdtemp(prefix='rcm-nexus-bench')
+    try:
+        before = _io_counters()
+        start = time.time()
+        zips = CASES[name](sources, out_dir)
+        elapsed = time.time() - start
+        after = _io_counters()
+
+        result = {
+            'wall_seconds': elapsed,
+            # ru_maxrss is reported in kilobytes on Linux.
+            'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            'parts': len(zips),
+            'read_syscalls': None,
+            'write_syscalls': None,
+        }
+        if before is not None and after is not None:
+            result['read_syscalls'] = after['syscr'] - before['syscr']
+            result['write_syscalls'] = after['syscw'] - before['syscw']
+        result_queue.put(result)
+    except Exception:
+        # Report the failure; otherwise the parent waits for a result forever.
+        result_queue.put({'error': traceback.format_exc()})
+    finally:
+        shutil.rmtree(out_dir)
+
+def run_case(name, sources, rounds):
+    """Run a case rounds times, each in a fresh process; return the fastest round."""
+    best = None
+    for i in range(rounds):
+        result_queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(target=_run_case, args=(name, sources, result_queue))
+        proc.start()
+        result = None
+        try:
+            while result is None:
+                # Checked before the get, so anything a dead process sent is already readable.
+                alive = proc.is_alive()
+                try:
+                    result = result_queue.get(timeout=1)
+                except Queue.Empty:
+                    if not alive:
+                        raise Exception("Case %s exited with code %s without a result" % (name, proc.exitcode))
+        finally:
+            proc.join()
+        if 'error' in result:
+            raise Exception("Case %s failed:\n%s" % (name, result['error']))
+        if best is None or result['wall_seconds'] < best['wall_seconds']:
+            best = result
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark archive partitioning throughput.')
+    parser.add_argument('--artifacts', type=int, default=2000, help='Number of GAVs to synthesize')
+    parser.add_argument('--jar-ratio', type=float, default=0.2, help='Fraction of GAVs that also have a jar')
+    parser.add_argument('--jar-size', type=int, default=512 * 1024, help='Size of each synthesized jar, in bytes')
+    parser.add_argument('--group-depth', type=int, default=6, help='Number of groupId path segments')
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--case', action='append', choices=sorted(CASES.keys()), help='Run only this case (repeatable)')
+    parser.add_argument('--output', '-o', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='rcm-nexus-bench')
+    try:
+        sources = {
+            'dir': os.path.join(work_dir, 'repository'),
+            'zip': os.path.join(work_dir, 'repository.zip'),
+        }
+        file_count, total_bytes = synthesize_repo(sources['dir'], args.artifacts, args.jar_ratio,
+                                                  args.jar_size, args.group_depth, args.seed)
+        zip_repo(sources['dir'], sources['zip'])
+
+        results = {}
+        for name in (args.case or sorted(CASES.keys())):
+            result = run_case(name, sources, args.rounds)
+            result['bytes_per_second'] = total_bytes / result['wall_seconds']
+            results[name] = result
+            print >>sys.stderr, "%-10s %8.3fs  %8.1f MB/s  peak RSS %d KB" % (
+                name, result['wall_seconds'], result['bytes_per_second'] / 1000000, result['peak_rss_kb'])
+
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'params': {
+                'artifacts': args.artifacts,
+                'jar_ratio': args.jar_ratio,
+                'jar_size': args.jar_size,
+                'group_depth': args.group_depth,
+                'rounds': args.rounds,
+                'seed': args.seed,
+            },
+            'input': {'files': file_count, 'bytes': total_bytes},
+            'results': results,
+        }
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        else:
+            print json.dumps(report, indent=2, sort_keys=True)
+    finally:
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python2
+#
+# Microbenchmark for saving a large group: the render-to-compare, pretty-printed
+# PUT and full response re-parse Group.save used to do, against the dirty flag,
+# compact PUT and (optionally) skipped reload it does now. The session is a
+# stub that echoes the request body, so only client-side XML work is timed.
+#
+# Usage: python benchmarks/group_save.py [--members 3000]
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lxml import objectify
+from rcm_nexus import group
+from rcm_nexus.session import python_boolean
+
+MEMBER_XML = ("<repo-group-member><id>product-%d</id><name>product-%d</name>"
+              "<resourceURI>http://localhost:8081/nexus/service/local/repo_groups/public/product-%d</resourceURI>"
+              "</repo-group-member>")
+
+
+class EchoSession(object):
+    debug = False
+
+    def __init__(self):
+        self.bytes_out = 0
+
+    def put(self, path, body):
+        self.bytes_out += len(body)
+        return (None, body)
+
+    post = put
+
+
+def group_xml(members):
+    return ("<repo-group><data>"
+            "<contentResourceURI>http://localhost:8081/nexus/content/groups/public</contentResourceURI>"
+            "<id>public</id><name>Public Repositories</name><provider>maven2</provider><format>maven2</format>"
+            "<repoType>group</repoType><exposed>true</exposed><repositories>%s</repositories>"
+            "</data></repo-group>") % ''.join(MEMBER_XML % (i, i, i) for i in range(members))
+
+def change(g):
+    g.set_exposed(not python_boolean(g.data.exposed))
+
+def old_save(g, session):
+    # The baseline render done on load, then the comparison render.
+    baseline = g.render()
+    change(g)
+    if g.render() == baseline:
+        return
+    _response, xml = session.put(group.NAMED_GROUP_PATH.format(key=g.data.id), g.render())
+    g.xml = objectify.fromstring(xml)
+    g.data = g.xml.data
+    g.render()
+
+def new_save(g, session, reload):
+    change(g)
+    g.save(session, reload=reload)
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark saving a large group.')
+    parser.add_argument('--members', type=int, default=3000)
+    parser.add_argument('--number', type=int, default=20, help='Saves per timing run')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    xml = group_xml(args.members)
+    cases = [
+        ('render+pretty+reparse', old_save),
+        ('dirty flag, reload', lambda g, s: new_save(g, s, True)),
+        ('dirty flag, no reload', lambda g, s: new_save(g, s, False)),
+    ]
+    for (name, func) in cases:
+        session = EchoSession()
+        g = group.Group(objectify.fromstring(xml))
+        best = min(timeit.repeat(lambda: func(g, session), number=args.number, repeat=args.repeat))
+        print "%-24s %8.2f ms/save %10d B/save" % (name, best / args.number * 1000,
+                                                    session.bytes_out / (args.number * args.repeat))
+
+if __name__ == '__main__':
+    main()
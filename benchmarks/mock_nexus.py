@@ -0,0 +1,436 @@
+#!/usr/bin/env python2
+#
+# A local stand-in for the Nexus REST endpoints used by rcm-nexus, for
+# reproducible latency benchmarks. It keeps all state in memory and
+# implements just enough of the API for the nexus-push flow:
+#
+#   POST /service/local/staging/profiles/{id}/start
+#   POST /service/local/staging/profiles/{id}/finish
+#   GET  /service/local/repositories[/{id}], DELETE /service/local/repositories/{id}
+#   GET  /service/local/repo_groups[/{id}], PUT /service/local/repo_groups/{id}
+#   POST /service/local/repositories/{id}/content-compressed
+#   GET  /service/local/staging/repository/{id}[/activity]
+#   GET  /service/local/staging/profile_repositories[/{id}]
+#   GET, HEAD /service/local/repositories/{id}/content/{path}
+#
+# Latency (per request), bandwidth (bytes/sec, applied to request and
+# response bodies) and error injection (probability of a 500, optionally
+# limited to paths matching a regex) are configurable, as is how long a
+# staging repository takes to close and whether the close fails a rule.
+# Like a Nexus behind a compressing proxy, responses are gzipped for clients
+# that accept it, and gzipped request bodies are accepted. Group definitions
+# carry an ETag, and conditional GETs of unchanged groups get a 304.
+#
+# Usage: python benchmarks/mock_nexus.py [--port 8081] [--latency 0.05] [--bandwidth 10000000]
+
+import argparse
+import hashlib
+import random
+import re
+import socket
+import threading
+import time
+import zipfile
+import zlib
+import BaseHTTPServer
+import SocketServer
+from StringIO import StringIO
+from xml.sax.saxutils import (escape, unescape)
+
+CONTEXT_PATH = '/nexus'
+DEFAULT_GROUPS = ['product-ga', 'product-techpreview', 'product-earlyaccess']
+# Response bodies at least this large are gzipped for clients that accept it.
+GZIP_MIN_SIZE = 1024
+
+STAGE_RE = re.compile(r'^/service/local/staging/profiles/([^/]+)/(start|finish)$')
+REPOS_RE = re.compile(r'^/service/local/repositories/?$')
+REPO_RE = re.compile(r'^/service/local/repositories/([^/]+)$')
+CONTENT_RE = re.compile(r'^/service/local/repositories/([^/]+)/content-compressed$')
+GROUPS_RE = re.compile(r'^/service/local/repo_groups/?$')
+GROUP_RE = re.compile(r'^/service/local/repo_groups/([^/]+)$')
+STAGED_RE = re.compile(r'^/service/local/staging/repository/([^/]+)(/activity)?$')
+REPO_CONTENT_RE = re.compile(r'^/service/local/repositories/([^/]+)/content/(.+)$')
+PROFILE_REPOS_RE = re.compile(r'^/service/local/staging/profile_repositories(?:/([^/]+))?$')
+DESCRIPTION_RE = re.compile(r'<description>(.*?)</description>', re.S)
+STAGED_ID_RE = re.compile(r'<stagedRepositoryId>(.*?)</stagedRepositoryId>')
+
+REPO_DATA_XML = """
+    <contentResourceURI>%(base)s/content/repositories/%(id)s</contentResourceURI>
+    <id>%(id)s</id>
+    <name>%(name)s</name>
+    <provider>maven2</provider>
+    <providerRole>org.sonatype.nexus.proxy.repository.Repository</providerRole>
+    <format>maven2</format>
+    <repoType>hosted</repoType>
+    <exposed>true</exposed>
+    <writePolicy>ALLOW_WRITE_ONCE</writePolicy>
+    <browseable>true</browseable>
+    <indexable>true</indexable>
+    <notFoundCacheTTL>1440</notFoundCacheTTL>
+    <repoPolicy>RELEASE</repoPolicy>
+    <downloadRemoteIndexes>false</downloadRemoteIndexes>
+"""
+
+GROUP_XML = """<repo-group>
+  <data>
+    <contentResourceURI>%(base)s/content/groups/%(id)s</contentResourceURI>
+    <id>%(id)s</id>
+    <name>%(id)s</name>
+    <provider>maven2</provider>
+    <format>maven2</format>
+    <repoType>group</repoType>
+    <exposed>true</exposed>
+    <repositories/>
+  </data>
+</repo-group>
+"""
+
+PROMOTE_REQUEST_XML = """<promoteRequest>
+  <data>
+    <stagedRepositoryId>%(id)s</stagedRepositoryId>
+    <description>%(description)s</description>
+  </data>
+</promoteRequest>
+"""
+
+STAGED_REPO_XML = """<stagingProfileRepository>
+  <repositoryId>%(id)s</repositoryId>
+  <type>%(type)s</type>
+  <transitioning>%(transitioning)s</transitioning>
+</stagingProfileRepository>
+"""
+
+PROFILE_REPO_XML = """<stagingProfileRepository>
+  <profileId>%(profile_id)s</profileId>
+  <repositoryId>%(id)s</repositoryId>
+  <type>%(type)s</type>
+  <description>%(description)s</description>
+  <createdTimestamp>%(created)d</createdTimestamp>
+</stagingProfileRepository>
+"""
+
+CLOSE_FAILED_ACTIVITY_XML = """<list>
+  <stagingActivity>
+    <name>close</name>
+    <events>
+      <stagingActivityEvent>
+        <name>ruleFailed</name>
+        <properties>
+          <stagingProperty>
+            <name>failureMessage</name>
+            <value>%(message)s</value>
+          </stagingProperty>
+        </properties>
+      </stagingActivityEvent>
+    </events>
+  </stagingActivity>
+</list>
+"""
+
+
+class NexusState(object):
+    """In-memory repositories, groups and staging counters, shared by all request handlers."""
+
+    def __init__(self, base_url, group_names=DEFAULT_GROUPS, close_delay=0.0, close_failure=None):
+        self.base_url = base_url
+        self.close_delay = close_delay
+        self.close_failure = close_failure
+        self.lock = threading.Lock()
+        self.repos = {}
+        self.content = {}
+        self.created = {}
+        self.finished = {}
+        self.groups = {}
+        self.staging_counter = 1000
+        self.uploaded_bytes = 0
+        for group_id in group_names:
+            self.groups[group_id] = GROUP_XML % {'base': base_url, 'id': group_id}
+
+    def start_staging(self, profile_id, description):
+        with self.lock:
+            self.staging_counter += 1
+            repo_id = "%s-%d" % (profile_id, self.staging_counter)
+            self.repos[repo_id] = description
+            self.created[repo_id] = int(time.time() * 1000)
+        return repo_id
+
+    def finish_staging(self, repo_id):
+        with self.lock:
+            self.finished[repo_id] = time.time()
+
+    def staging_state(self, repo_id):
+        """Return (type, transitioning) for a staging repository, closing it close_delay after finish."""
+        finished = self.finished.get(repo_id)
+        if finished is None:
+            return ('open', False)
+        if time.time() - finished < self.close_delay:
+            return ('open', True)
+        return ('open', False) if self.close_failure else ('closed', False)
+
+    def profile_repos(self, profile_id=None):
+        """Render the staging repositories opened in profile_id (default: any profile), as a
+           stagingRepositories list.
+        """
+        items = []
+        for repo_id in sorted(r for r in self.repos if profile_id is None or r.startswith(profile_id + '-')):
+            items.append(PROFILE_REPO_XML % {'profile_id': repo_id.rsplit('-', 1)[0], 'id': repo_id, 'type': self.staging_state(repo_id)[0],
+                                             'description': escape(self.repos[repo_id]), 'created': self.created[repo_id]})
+        return '<stagingRepositories><data>%s</data></stagingRepositories>' % ''.join(items)
+
+    def repo_data(self, repo_id):
+        return REPO_DATA_XML % {'base': self.base_url, 'id': repo_id, 'name': escape(self.repos[repo_id])}
+
+
+class MockNexusHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(self, format, *args)
+
+    def _throttle(self, size):
+        if self.server.bandwidth:
+            time.sleep(float(size) / self.server.bandwidth)
+
+    def _read_body(self):
+        length = int(self.headers.getheader('Content-Length') or 0)
+        remaining = length
+        chunks = []
+        while remaining > 0:
+            chunk = self.rfile.read(min(remaining, 65536))
+            if not chunk:
+                break
+            self._throttle(len(chunk))
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        body = ''.join(chunks)
+        if (self.headers.getheader('Content-Encoding') or '').lower() == 'gzip':
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+        return body
+
+    def _respond(self, status, body='', send_body=True, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/xml')
+        for (name, value) in (headers or {}).items():
+            self.send_header(name, value)
+        if len(body) >= GZIP_MIN_SIZE and 'gzip' in (self.headers.getheader('Accept-Encoding') or ''):
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            body = compressor.compress(body) + compressor.flush()
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body and body:
+            self._throttle(len(body))
+            self.wfile.write(body)
+
+    def _path(self):
+        path = self.path.split('?', 1)[0]
+        if path.startswith(CONTEXT_PATH):
+            path = path[len(CONTEXT_PATH):]
+        return path
+
+    def _inject(self, path):
+        """Apply configured latency; return True if this request should fail with a 500."""
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if self.server.error_rate and (self.server.error_path is None or self.server.error_path.search(path)):
+            with self.server.state.lock:
+                return self.server.random.random() < self.server.error_rate
+        return False
+
+    def _get(self, send_body):
+        path = self._path()
+        if self._inject(path):
+            return self._respond(500, 'Injected failure', send_body)
+
+        state = self.server.state
+        match = REPO_RE.match(path)
+        if match:
+            if match.group(1) not in state.repos:
+                return self._respond(404, '', send_body)
+            return self._respond(200, '<repository><data>%s</data></repository>' % state.repo_data(match.group(1)), send_body)
+
+        if REPOS_RE.match(path):
+            items = ''.join('<repositories-item>%s</repositories-item>' % state.repo_data(repo_id) for repo_id in sorted(state.repos))
+            return self._respond(200, '<repositories><data>%s</data></repositories>' % items, send_body)
+
+        if GROUPS_RE.match(path):
+            items = ''.join('<repo-groups-item><id>%s</id><name>%s</name></repo-groups-item>' % (key, key)
+                            for key in sorted(state.groups))
+            return self._respond(200, '<repo-groups><data>%s</data></repo-groups>' % items, send_body)
+
+        match = GROUP_RE.match(path)
+        if match:
+            body = state.groups.get(match.group(1))
+            if body is None:
+                return self._respond(404, '', send_body)
+            etag = '"%s"' % hashlib.sha1(body).hexdigest()
+            if self.headers.getheader('If-None-Match') == etag:
+                return self._respond(304, '', send_body, {'ETag': etag})
+            return self._respond(200, body, send_body, {'ETag': etag})
+
+        match = PROFILE_REPOS_RE.match(path)
+        if match:
+            return self._respond(200, state.profile_repos(match.group(1)), send_body)
+
+        match = REPO_CONTENT_RE.match(path)
+        if match:
+            found = match.group(2) in state.content.get(match.group(1), ())
+            return self._respond(200 if found else 404, '', send_body)
+
+        match = STAGED_RE.match(path)
+        if match and match.group(1) in state.repos:
+            (repo_type, transitioning) = state.staging_state(match.group(1))
+            if match.group(2):
+                failed = repo_type == 'open' and not transitioning and match.group(1) in state.finished
+                body = CLOSE_FAILED_ACTIVITY_XML % {'message': escape(state.close_failure)} if failed else '<list/>'
+            else:
+                body = STAGED_REPO_XML % {'id': match.group(1), 'type': repo_type, 'transitioning': str(transitioning).lower()}
+            return self._respond(200, body, send_body)
+
+        self._respond(404, '', send_body)
+
+    def do_GET(self):
+        self._get(True)
+
+    def do_HEAD(self):
+        self._get(False)
+
+    def do_POST(self):
+        path = self._path()
+        body = self._read_body()
+        if self._inject(path):
+            return self._respond(500, 'Injected failure')
+
+        state = self.server.state
+        match = STAGE_RE.match(path)
+        if match:
+            profile_id, action = match.groups()
+            description = DESCRIPTION_RE.search(body)
+            description = unescape(description.group(1)) if description else ''
+            if action == 'start':
+                repo_id = state.start_staging(profile_id, description)
+                return self._respond(201, PROMOTE_REQUEST_XML % {'id': repo_id, 'description': escape(description)})
+
+            repo_id = STAGED_ID_RE.search(body)
+            if repo_id:
+                state.finish_staging(repo_id.group(1))
+            return self._respond(201)
+
+        match = CONTENT_RE.match(path)
+        if match:
+            if match.group(1) not in state.repos:
+                return self._respond(404)
+            names = zipfile.ZipFile(StringIO(body)).namelist()
+            with state.lock:
+                state.uploaded_bytes += len(body)
+                state.content.setdefault(match.group(1), set()).update(names)
+            return self._respond(201)
+
+        self._respond(404)
+
+    def do_PUT(self):
+        path = self._path()
+        body = self._read_body()
+        if self._inject(path):
+            return self._respond(500, 'Injected failure')
+
+        state = self.server.state
+        match = GROUP_RE.match(path)
+        if match and match.group(1) in state.groups:
+            with state.lock:
+                state.groups[match.group(1)] = body
+            return self._respond(200, body)
+
+        self._respond(404)
+
+    def do_DELETE(self):
+        path = self._path()
+        if self._inject(path):
+            return self._respond(500, 'Injected failure')
+
+        state = self.server.state
+        match = REPO_RE.match(path)
+        if match and match.group(1) in state.repos:
+            with state.lock:
+                for repo_state in (state.repos, state.content, state.created, state.finished):
+                    repo_state.pop(match.group(1), None)
+            return self._respond(204)
+
+        self._respond(404)
+
+
+class MockNexusServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port=0, latency=0.0, bandwidth=None, error_rate=0.0, error_path=None, seed=None, verbose=False,
+                 close_delay=0.0, close_failure=None):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), MockNexusHandler)
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.error_path = re.compile(error_path) if error_path else None
+        self.random = random.Random(seed)
+        self.verbose = verbose
+        self.state = NexusState(self.url, close_delay=close_delay, close_failure=close_failure)
+        self._connections = set()
+        self._connections_lock = threading.Lock()
+
+    def process_request(self, request, client_address):
+        with self._connections_lock:
+            self._connections.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request, client_address)
+
+    def shutdown_request(self, request):
+        with self._connections_lock:
+            self._connections.discard(request)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    @property
+    def url(self):
+        return "http://%s:%d%s" % (self.server_address[0], self.server_address[1], CONTEXT_PATH)
+
+    def start(self):
+        """Serve requests from a daemon thread; return self for chaining."""
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and drop any idle keep-alive connections."""
+        self.shutdown()
+        with self._connections_lock:
+            connections = list(self._connections)
+        for request in connections:
+            try:
+                request.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a mock Nexus server for rcm-nexus benchmarks.')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help='Added latency per request, in seconds')
+    parser.add_argument('--bandwidth', type=int, help='Body transfer rate limit, in bytes/sec')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Probability of answering with a 500')
+    parser.add_argument('--error-path', help='Only inject errors for paths matching this regex')
+    parser.add_argument('--close-delay', type=float, default=0.0, help='Seconds a staging repository takes to close')
+    parser.add_argument('--close-failure', help='Fail every staging close with this rule failure message')
+    parser.add_argument('--seed', type=int)
+    parser.add_argument('--verbose', '-v', action='store_true')
+    args = parser.parse_args()
+
+    server = MockNexusServer(args.port, args.latency, args.bandwidth, args.error_rate, args.error_path,
+                             args.seed, args.verbose, args.close_delay, args.close_failure)
+    print "Mock Nexus listening on: %s" % server.url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+#!/usr/bin/env python2
+#
+# End-to-end nexus-push benchmark against the local mock Nexus server.
+#
+# Synthesizes a Maven repository, starts benchmarks/mock_nexus.py in-process
+# with the requested latency/bandwidth/error settings, writes a throwaway
+# rcm-nexus configuration pointing at it, and runs the full command.push
+# flow. Reports per-phase timings (zip, start, upload, finish, close wait,
+# group update)
+# as JSON.
+#
+# Usage: python benchmarks/push.py [--artifacts N] [--latency 0.05] [--bandwidth 10000000]
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import yaml
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+from rcm_nexus import (command, config, metrics)
+from archive import synthesize_repo
+from mock_nexus import MockNexusServer
+
+PROFILE_ID = '0123456789'
+PRODUCT = 'bench'
+
+
+def write_config(conf_dir, urls):
+    """Write a config with one environment per mock server URL; return (config path, environment names)."""
+    environments = ["bench%d" % i for i in range(len(urls))]
+    conf_path = os.path.join(conf_dir, 'config.yaml')
+    with open(conf_path, 'w') as f:
+        yaml.safe_dump(dict((env, {config.URL: url}) for (env, url) in zip(environments, urls)), f)
+    for env in environments:
+        with open(os.path.join(conf_dir, '%s.yaml' % env), 'w') as f:
+            yaml.safe_dump({PRODUCT: {config.GA_PROFILE: PROFILE_ID, config.EA_PROFILE: PROFILE_ID}}, f)
+    return conf_path, environments
+
+def run_push(repo_dir, environments, ga, metrics_path, verify=False):
+    """Run command.push, returning (wall seconds, phase durations, request totals by endpoint)."""
+    args = [repo_dir, '--product', PRODUCT, '--version', '1.0', '--metrics', 'jsonl:%s' % metrics_path]
+    for env in environments:
+        args.extend(['--environment', env])
+    if ga:
+        args.append('--ga')
+    if verify:
+        args.append('--verify')
+
+    # Keep stdout clean for the JSON report.
+    stdout = sys.stdout
+    sys.stdout = sys.stderr
+    start = time.time()
+    try:
+        command.push.main(args=args, standalone_mode=False)
+    finally:
+        sys.stdout = stdout
+    elapsed = time.time() - start
+
+    return (elapsed,) + read_metrics(metrics_path)
+
+def read_metrics(metrics_path):
+    phases = {}
+    endpoints = {}
+    if not os.path.exists(metrics_path):
+        return phases, endpoints
+
+    with open(metrics_path) as f:
+        for line in f:
+            event = json.loads(line)
+            if event['event'] == metrics.SPAN_EVENT:
+                # With several environments, phases overlap; report the slowest environment.
+                phases[event['name']] = max(phases.get(event['name'], 0.0), event['duration'])
+            elif event['event'] == metrics.REQUEST_EVENT:
+                key = "%s %s" % (event['method'], event['path'])
+                e = endpoints.setdefault(key, {'count': 0, 'latency': 0.0, 'bytes_out': 0, 'bytes_in': 0, 'bytes_saved': 0})
+                e['count'] += 1
+                e['latency'] += event['latency']
+                e['bytes_out'] += event['bytes_out']
+                e['bytes_in'] += event['bytes_in']
+                e['bytes_saved'] += event['bytes_saved']
+    return phases, endpoints
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark nexus-push against a mock Nexus server.')
+    parser.add_argument('--artifacts', type=int, default=500, help='Number of GAVs to synthesize')
+    parser.add_argument('--jar-ratio', type=float, default=0.2)
+    parser.add_argument('--jar-size', type=int, default=256 * 1024)
+    parser.add_argument('--group-depth', type=int, default=6)
+    parser.add_argument('--latency', type=float, default=0.0, help='Mock server latency per request, in seconds')
+    parser.add_argument('--bandwidth', type=int, help='Mock server transfer rate, in bytes/sec')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--error-path')
+    parser.add_argument('--close-delay', type=float, default=0.0, help='Seconds the mock server takes to close a staging repository')
+    parser.add_argument('--close-failure', help='Make every staging close fail with this rule failure message')
+    parser.add_argument('--environments', type=int, default=1, help='Number of mock environments to push to concurrently')
+    parser.add_argument('--ga', action='store_true', help='Push to the GA groups instead of earlyaccess')
+    parser.add_argument('--verify', action='store_true', help='Verify every uploaded file before closing (nexus-push --verify)')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', '-o', help='Write JSON results to this file instead of stdout')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='rcm-nexus-bench')
+    old_environ = os.environ.copy()
+    servers = [MockNexusServer(latency=args.latency, bandwidth=args.bandwidth, error_rate=args.error_rate,
+                               error_path=args.error_path, seed=args.seed, close_delay=args.close_delay,
+                               close_failure=args.close_failure).start()
+               for i in range(args.environments)]
+    try:
+        repo_dir = os.path.join(work_dir, 'repository')
+        file_count, total_bytes = synthesize_repo(repo_dir, args.artifacts, args.jar_ratio,
+                                                  args.jar_size, args.group_depth, args.seed)
+        conf_path, environments = write_config(work_dir, [server.url for server in servers])
+        os.environ[config.RCM_NEXUS_YAML] = conf_path
+
+        metrics_path = os.path.join(work_dir, 'metrics.jsonl')
+        error = None
+        try:
+            elapsed, phases, endpoints = run_push(repo_dir, environments, args.ga, metrics_path, args.verify)
+        except Exception as e:
+            elapsed = None
+            phases, endpoints = read_metrics(metrics_path)
+            error = str(e)
+
+        report = {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'params': {
+                'artifacts': args.artifacts,
+                'latency': args.latency,
+                'bandwidth': args.bandwidth,
+                'error_rate': args.error_rate,
+                'error_path': args.error_path,
+                'close_delay': args.close_delay,
+                'environments': args.environments,
+                'ga': args.ga,
+            },
+            'input': {'files': file_count, 'bytes': total_bytes},
+            'uploaded_bytes': sum(server.state.uploaded_bytes for server in servers),
+            'wall_seconds': elapsed,
+            'phases': phases,
+            'requests': endpoints,
+            'error': error,
+        }
+
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2, sort_keys=True)
+        else:
+            print json.dumps(report, indent=2, sort_keys=True)
+    finally:
+        for server in servers:
+            server.stop()
+        os.environ.clear()
+        os.environ.update(old_environ)
+        shutil.rmtree(work_dir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+#!/usr/bin/env python2
+#
+# Microbenchmarks for the staging promoteRequest codec: the element-tree
+# build + pretty-print + full parse/XPath approach staging.py used to take,
+# against the template/precompiled-XPath XML codec and the JSON codec.
+#
+# Usage: python benchmarks/staging_codec.py [--number 20000]
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from lxml import etree
+from rcm_nexus import staging
+
+DESCRIPTION = 'eap, ver 7.1.0 (to GA)'
+REPO_ID = 'eap-1001'
+RESPONSE_XML = ("<promoteRequest><data><stagedRepositoryId>%s</stagedRepositoryId>"
+                "<description>%s</description></data></promoteRequest>") % (REPO_ID, DESCRIPTION)
+RESPONSE_JSON = '{"data": {"stagedRepositoryId": "%s", "description": "%s"}}' % (REPO_ID, DESCRIPTION)
+
+
+def tree_encode():
+    request_data = etree.Element('promoteRequest')
+    data = etree.SubElement(request_data, 'data')
+    etree.SubElement(data, 'description').text = DESCRIPTION
+    etree.SubElement(data, 'stagedRepositoryId').text = REPO_ID
+    return etree.tostring(request_data, xml_declaration=True, pretty_print=True, encoding='UTF-8')
+
+def tree_decode():
+    return etree.fromstring(RESPONSE_XML).xpath('/promoteRequest/data/stagedRepositoryId/text()')[0]
+
+CASES = [
+    ('encode tree+pretty', tree_encode),
+    ('encode xml template', lambda: staging.encode_promote_request(DESCRIPTION, REPO_ID)),
+    ('encode json', lambda: staging.encode_promote_request(DESCRIPTION, REPO_ID, staging.JSON_FORMAT)),
+    ('decode parse+xpath', tree_decode),
+    ('decode compiled xpath', lambda: staging.decode_staged_repo_id(RESPONSE_XML)),
+    ('decode json', lambda: staging.decode_staged_repo_id(RESPONSE_JSON, staging.JSON_FORMAT)),
+]
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the staging promoteRequest codec.')
+    parser.add_argument('--number', type=int, default=20000, help='Calls per timing run')
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    for (name, func) in CASES:
+        best = min(timeit.repeat(func, number=args.number, repeat=args.repeat))
+        print "%-24s %8.2f us/call" % (name, best / args.number * 1000000)
+
+if __name__ == '__main__':
+    main()
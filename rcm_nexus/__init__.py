@@ -1,7 +1,12 @@
-from command import push, rollback, init
+from command import push, rollback, init, bulk_push, diff, reorder, group_index, prune
 
 __all__ = [
+    'bulk_push',
+    'diff',
+    'group_index',
     'init',
+    'prune',
     'push',
+    'reorder',
     'rollback'
 ]
\ No newline at end of file
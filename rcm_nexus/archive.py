@@ -1,52 +1,462 @@
 import zipfile
+import fnmatch
+import hashlib
+import mmap
+import re
+import stat
+import struct
+import threading
+import zlib
 import os
 
+from rcm_nexus.workers import (imap, imap_unordered)
+
+# os.scandir is only in the stdlib from Python 3.5; use the scandir backport if it's
+# installed, and plain listdir + lstat otherwise.
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
 
 MAX_COUNT = 1000
 MAX_SIZE = 1000000000 #1GB
 OUT_ZIP_FORMAT = "part-%03d.zip"
 
-def create_partitioned_zips(src, out_dir, max_count=MAX_COUNT, max_size=MAX_SIZE):
+# Directories listed concurrently by scan_tree(); listing is latency-bound on NFS.
+SCAN_WORKERS = 8
+
+# Bookkeeping files Maven and its resolver leave in local repositories. Nexus either
+# rejects them or stores them as junk, so they are excluded unless asked otherwise.
+DEFAULT_EXCLUDES = [
+    '*.lastUpdated',
+    '_remote.repositories',
+    '_maven.repositories',
+    'maven-metadata-local.xml*',
+    'resolver-status.properties',
+    '*.part',
+    '*.lock',
+]
+REGEX_PREFIX = 're:'
+
+# Checksum sidecars that can be generated for artifacts missing them.
+CHECKSUM_ALGORITHMS = ('sha1', 'md5', 'sha256', 'sha512')
+CHECKSUM_EXTENSIONS = tuple('.' + algorithm for algorithm in CHECKSUM_ALGORITHMS)
+CHECKSUM_SIZES = dict((algorithm, hashlib.new(algorithm).digest_size * 2) for algorithm in CHECKSUM_ALGORITHMS)
+
+# Entries read and hashed concurrently when generating checksums. hashlib and zlib
+# release the GIL on large buffers, so this scales with cores.
+DIGEST_WORKERS = 4
+
+# Local file header layout, from the zip APPNOTE (section 4.3.7).
+LOCAL_HEADER_FORMAT = '<4s2B4HL2L2H'
+LOCAL_HEADER_SIZE = struct.calcsize(LOCAL_HEADER_FORMAT)
+LOCAL_HEADER_SIGNATURE = 'PK\003\004'
+# Compressed data fed to zlib at a time when inflating an entry out of a mapped archive.
+MAPPED_INFLATE_CHUNK = 1024 * 1024
+
+def create_partitioned_zips(src, out_dir, max_count=MAX_COUNT, max_size=MAX_SIZE, use_mmap=False, digests=None, path_filter=None,
+                            checksums=None):
     if os.path.isdir(src) is True:
-        return create_partitioned_zips_from_dir(src, out_dir, max_count, max_size)
+        return create_partitioned_zips_from_dir(src, out_dir, max_count, max_size, digests=digests, path_filter=path_filter,
+                                                checksums=checksums)
     elif src.endswith('.zip') and os.path.exists(src):
-        return create_partitioned_zips_from_zip(src, out_dir, max_count, max_size)
+        return create_partitioned_zips_from_zip(src, out_dir, max_count, max_size, use_mmap=use_mmap, digests=digests,
+                                                path_filter=path_filter, checksums=checksums)
     else:
         raise Exception("Invalid input: %s" % src)
 
-def create_partitioned_zips_from_dir(src, out_dir, max_count=MAX_COUNT, max_size=MAX_SIZE):
-    zips = Zipper(out_dir, max_count, max_size)
-
-    for (dirpath, dirnames, filenames) in os.walk(src):
-        dir_skip = len(src)
-        dirname = dirpath[dir_skip:]
-        if dirname.startswith('/'):
-            dirname = dirname[1:]
+def create_partitioned_zips_from_dir(src, out_dir, max_count=MAX_COUNT, max_size=MAX_SIZE, digests=None, path_filter=None,
+                                     checksums=None):
+    zips = Zipper(out_dir, max_count, max_size, digests, path_filter)
 
-        for filename in filenames:
-            path = os.path.join(dirpath, filename)
-            entry_name = os.path.join(dirname, filename)
-            # print "Path: %s (uncompressed size: %s)" % (os.path.join(dirname, filename), os.path.getsize(path))
-            with open(path, 'rb') as f:
-                zips.append(entry_name, os.path.getsize(path), lambda: f.read())
+    entries = []
+    for (entry_name, size, mtime) in scan_tree(src):
+        # print "Path: %s (uncompressed size: %s)" % (entry_name, size)
+        entries.append((entry_name, size, _file_reader(os.path.join(src, entry_name))))
 
+    _append_all(zips, entries, checksums)
+    zips.close()
     return zips.list()
 
-def create_partitioned_zips_from_zip(src, out_dir, max_count=MAX_COUNT, max_size=MAX_SIZE):
-    zips = Zipper(out_dir, max_count, max_size)
+def _file_reader(path):
+    def read():
+        with open(path, 'rb') as f:
+            return f.read()
+    return read
+
+def _serialized_reader(lock, func, *args):
+    """Return a reader calling func(*args) under lock, for sources (like a ZipFile) that
+       can't be read from several threads at once.
+    """
+    def read():
+        with lock:
+            return func(*args)
+    return read
+
+def _append_all(zips, entries, checksums=None, max_workers=DIGEST_WORKERS):
+    """Append (filename, size, read function) entries to zips.
+
+       Entries are grouped by directory (in a Maven repository, one groupId/artifactId/version)
+       into units, and the units are laid out over the parts by plan_parts(), so a unit is
+       never split across parts.
+
+       If checksums names any CHECKSUM_ALGORITHMS, generate the missing checksum sidecars
+       (e.g. foo.jar.sha1) for each entry that isn't itself a checksum. Each entry is read
+       once; when hashing, entries are read and hashed on up to max_workers threads while
+       the parts are written.
+    """
+    accepted = []
+    for (filename, size, read) in entries:
+        name = zips.accept(filename, size)
+        if name is not None:
+            accepted.append((name, size, read))
+    existing = set(name for (name, size, read) in accepted)
+
+    units = {}
+    for (name, size, read) in accepted:
+        missing = []
+        # Directory entries (as in zip -r archives) get no sidecars.
+        if checksums and not name.endswith('/') and not name.endswith(CHECKSUM_EXTENSIONS):
+            missing = [algorithm for algorithm in checksums if "%s.%s" % (name, algorithm) not in existing]
+        dirname = name.rsplit('/', 1)[0] if '/' in name else ''
+        units.setdefault(dirname, []).append((name, size, read, missing))
+
+    dirnames = sorted(units)
+    unit_sizes = []
+    for dirname in dirnames:
+        unit = units[dirname]
+        unit.sort(key=lambda entry: entry[0])
+        unit_sizes.append((sum(1 + len(missing) for (name, size, read, missing) in unit),
+                           sum(size + sum(CHECKSUM_SIZES[algorithm] for algorithm in missing)
+                               for (name, size, read, missing) in unit)))
+
+    planned = []
+    for (part, unit_indexes) in enumerate(plan_parts(unit_sizes, zips.max_count, zips.max_size)):
+        entries = sorted((entry for i in unit_indexes for entry in units[dirnames[i]]), key=lambda entry: entry[0])
+        planned.extend((part, entry) for entry in entries)
+
+    def digest(planned_entry):
+        (name, size, read, missing) = planned_entry[1]
+        data = read()
+        algorithms = set(missing)
+        if zips.digests is not None:
+            algorithms.add('sha1')
+        hexdigests = dict((algorithm, hashlib.new(algorithm, data).hexdigest()) for algorithm in algorithms)
+
+        sidecars = [("%s.%s" % (name, algorithm), hexdigests[algorithm]) for algorithm in missing]
+        return (data, sidecars, hexdigests.get('sha1'))
+
+    if checksums:
+        results = imap(digest, planned, max_workers)
+    else:
+        results = ((planned_entry, (planned_entry[1][2](), [], None), None) for planned_entry in planned)
+
+    current_part = None
+    for ((part, (name, size, read, missing)), result, error) in results:
+        if error is not None:
+            raise error[0], error[1], error[2]
+        if part != current_part:
+            zips.new_part()
+            current_part = part
+        (data, sidecars, sha1) = result
+        zips.write(name, size, data, sidecars, sha1, rollover=False)
+
+def plan_parts(units, max_count=MAX_COUNT, max_size=MAX_SIZE):
+    """Lay out units, given as (file count, total size) pairs, over as few balanced parts as
+       possible. Return a list of parts, each a sorted list of unit indexes.
+
+       Units are taken largest first, and each goes into the least-loaded part it fits in
+       (at most max_count files, and less than max_size bytes), starting from the fewest
+       parts that could hold everything; a new part is opened when none fits. A unit that
+       can't fit in any part gets a part of its own.
+    """
+    total_count = sum(count for (count, size) in units)
+    total_size = sum(size for (count, size) in units)
+    part_count = max(1, -(-total_count // max_count), -(-total_size // max_size))
+
+    # [file count, size, unit indexes]
+    parts = [[0, 0, []] for i in range(part_count)]
+    oversized = []
+    for i in sorted(range(len(units)), key=lambda i: (-units[i][1], -units[i][0], i)):
+        (count, size) = units[i]
+        if count > max_count or size >= max_size:
+            oversized.append([count, size, [i]])
+            continue
+
+        for part in sorted(parts, key=lambda part: (part[1], part[0])):
+            if part[0] + count <= max_count and part[1] + size < max_size:
+                break
+        else:
+            part = [0, 0, []]
+            parts.append(part)
+
+        part[0] += count
+        part[1] += size
+        part[2].append(i)
+
+    return sorted(sorted(part[2]) for part in parts + oversized if part[2])
+
+def scan_tree(src, max_workers=SCAN_WORKERS):
+    """Return a sorted manifest of (relative path, size, mtime) for every file under src.
+       Relative paths use '/' separators. Like os.walk(), symlinked directories are not
+       followed; symlinked files are included with the size of their target.
+
+       Each file is stat'ed once (reusing the scandir() result where available), and
+       the directories at each depth are listed concurrently on up to max_workers threads.
+    """
+    manifest = []
+    level = ['']
+    while level:
+        subdirs = []
+        results = imap_unordered(lambda d: _scan_dir(src, d), level, min(max_workers, len(level)))
+        for (dirname, result, error) in results:
+            if error is not None:
+                raise error[0], error[1], error[2]
+            manifest.extend(result[0])
+            subdirs.extend(result[1])
+        level = subdirs
+
+    manifest.sort()
+    return manifest
+
+def _scan_dir(src, dirname):
+    """List one directory (relative to src); return ([(path, size, mtime)...], [subdir...])."""
+    path = os.path.join(src, dirname) if dirname else src
+    prefix = dirname + '/' if dirname else ''
+    files = []
+    subdirs = []
+
+    if scandir is not None:
+        for entry in scandir(path):
+            if entry.is_dir():
+                if not entry.is_symlink():
+                    subdirs.append(prefix + entry.name)
+            else:
+                st = entry.stat()
+                files.append((prefix + entry.name, st.st_size, st.st_mtime))
+        return (files, subdirs)
+
+    for name in os.listdir(path):
+        entry_path = os.path.join(path, name)
+        st = os.lstat(entry_path)
+        if stat.S_ISLNK(st.st_mode):
+            st = os.stat(entry_path)
+            if stat.S_ISDIR(st.st_mode):
+                continue
+        if stat.S_ISDIR(st.st_mode):
+            subdirs.append(prefix + name)
+        else:
+            files.append((prefix + name, st.st_size, st.st_mtime))
+    return (files, subdirs)
+
+def create_partitioned_zips_from_zip(src, out_dir, max_count=MAX_COUNT, max_size=MAX_SIZE, use_mmap=False, digests=None,
+                                     path_filter=None, checksums=None):
+    """Repartition the entries of the zip archive src into zips in out_dir.
+       If use_mmap is True, the input archive is memory-mapped and entry data is
+       sliced out of the mapping instead of being read through buffered file I/O.
+       If a digests dict is given, it is filled with the sha1 hex digest of each
+       (normalized) entry name, for use with fingerprint(). Entries rejected by
+       path_filter (a PathFilter) are skipped without being read. checksums lists
+       the sidecar checksums to generate where missing (see CHECKSUM_ALGORITHMS).
+    """
+    if use_mmap is True:
+        return _create_partitioned_zips_from_mmap(src, out_dir, max_count, max_size, digests, path_filter, checksums)
+
+    zips = Zipper(out_dir, max_count, max_size, digests, path_filter)
     zf = zipfile.ZipFile(src)
+    lock = threading.Lock()
+    entries = []
     for info in zf.infolist():
 
         # print "Path: %s (uncompressed size: %s)" % (info.filename, info.file_size)
-        zips.append(info.filename, info.file_size, lambda: zf.read(info.filename) )
+        entries.append((info.filename, info.file_size, _serialized_reader(lock, zf.read, info.filename)))
 
+    _append_all(zips, entries, checksums)
+    zips.close()
     return zips.list()
 
+def _create_partitioned_zips_from_mmap(src, out_dir, max_count=MAX_COUNT, max_size=MAX_SIZE, digests=None, path_filter=None,
+                                       checksums=None):
+    zips = Zipper(out_dir, max_count, max_size, digests, path_filter)
+    with open(src, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            # ZipFile only parses the central directory here; entry data comes from the mapping.
+            zf = zipfile.ZipFile(f)
+            lock = threading.Lock()
+            entries = []
+            for info in zf.infolist():
+                entries.append((info.filename, info.file_size, _serialized_reader(lock, _read_mapped_entry, mapped, zf, info)))
+
+            _append_all(zips, entries, checksums)
+            zf.close()
+        finally:
+            mapped.close()
+
+    zips.close()
+    return zips.list()
+
+def _read_mapped_entry(mapped, zf, info):
+    """Return the uncompressed data for info, read directly out of the mapped archive.
+       Deflated entries are inflated from buffer() views of the mapping, without copying
+       the compressed data; stored entries are sliced, which copies them once, as the
+       result. Entries that are encrypted or use another compression method fall back
+       to ZipFile.read().
+    """
+    if info.flag_bits & 0x1 or info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+        return zf.read(info.filename)
+
+    offset = info.header_offset
+    header = struct.unpack(LOCAL_HEADER_FORMAT, mapped[offset:offset + LOCAL_HEADER_SIZE])
+    if header[0] != LOCAL_HEADER_SIGNATURE:
+        raise zipfile.BadZipfile("Bad local file header for: %s" % info.filename)
+
+    start = offset + LOCAL_HEADER_SIZE + header[-2] + header[-1]
+    end = start + info.compress_size
+    if end > len(mapped):
+        raise zipfile.BadZipfile("Truncated data for file: %s" % info.filename)
+
+    if info.compress_type == zipfile.ZIP_DEFLATED:
+        inflater = zlib.decompressobj(-15)
+        parts = []
+        for chunk_start in xrange(start, end, MAPPED_INFLATE_CHUNK):
+            parts.append(inflater.decompress(buffer(mapped, chunk_start, min(MAPPED_INFLATE_CHUNK, end - chunk_start))))
+        parts.append(inflater.flush())
+        data = ''.join(parts)
+    else:
+        data = mapped[start:end]
+
+    if zlib.crc32(data) & 0xffffffff != info.CRC:
+        raise zipfile.BadZipfile("Bad CRC-32 for file: %s" % info.filename)
+
+    return data
+
+def fingerprint(digests):
+    """Return a Merkle root hash over the (entry name, digest) pairs in digests, as
+       filled in by the create_partitioned_zips* functions. The result identifies the
+       repository content independently of entry order and partitioning.
+    """
+    level = [hashlib.sha1("%s\0%s" % (name.encode('utf-8') if isinstance(name, unicode) else name, digests[name])).digest()
+             for name in sorted(digests)]
+    if not level:
+        return hashlib.sha1('').hexdigest()
+
+    while len(level) > 1:
+        if len(level) % 2:
+            level.append(level[-1])
+        level = [hashlib.sha1(level[i] + level[i + 1]).digest() for i in range(0, len(level), 2)]
+
+    return level[0].encode('hex')
+
+
+def normalize_entry_name(filename):
+    """Strip a leading 'maven-repository/'-style directory from an entry name."""
+    if '/' in filename:
+        filename_parts = filename.split('/')
+
+        if 'maven' in filename_parts[0]:
+            if len(filename_parts) > 1:
+                filename = '/'.join(filename_parts[1:])
+            else:
+                filename = ''
+
+    return filename
+
+def digest_content(src, path_filter=None, max_workers=DIGEST_WORKERS):
+    """Return {normalized entry name: (size, sha1 hex digest)} for the files in a repository
+       directory or zip archive, as they would be pushed, without writing any archives.
+       Entries are read and hashed on up to max_workers threads.
+    """
+    if os.path.isdir(src):
+        entries = [(name, size, _file_reader(os.path.join(src, name))) for (name, size, mtime) in scan_tree(src)]
+    else:
+        zf = zipfile.ZipFile(src)
+        lock = threading.Lock()
+        entries = [(info.filename, info.file_size, _serialized_reader(lock, zf.read, info.filename))
+                   for info in zf.infolist() if not info.filename.endswith('/')]
+
+    accepted = []
+    for (filename, size, read) in entries:
+        name = normalize_entry_name(filename)
+        if path_filter is None or path_filter.accept(name, size):
+            accepted.append((name, size, read))
+
+    content = {}
+    for ((name, size, read), sha1, error) in imap_unordered(lambda entry: hashlib.sha1(entry[2]()).hexdigest(), accepted, max_workers):
+        if error is not None:
+            raise error[0], error[1], error[2]
+        content[name] = (size, sha1)
+    return content
+
+
+class PathFilter(object):
+    """Decides which repository entries are zipped, by normalized entry name, and counts
+       the files and bytes it skips.
+
+       Patterns are globs, or regular expressions if prefixed with 're:'. A glob with no
+       '/' is matched against the file name alone; otherwise against the whole path.
+       Regular expressions are searched for anywhere in the path. An entry is accepted if
+       it matches some include pattern (or there are none) and no exclude pattern.
+       DEFAULT_EXCLUDES are added to the excludes unless default_excludes is False.
+    """
+
+    def __init__(self, includes=None, excludes=None, default_excludes=True):
+        excludes = list(excludes or [])
+        if default_excludes:
+            excludes.extend(DEFAULT_EXCLUDES)
+
+        self._includes = _compile_patterns(includes) if includes else None
+        self._excludes = _compile_patterns(excludes)
+        self.skipped_files = 0
+        self.skipped_bytes = 0
+
+    def accept(self, path, size=0):
+        """Return True if path should be included; otherwise count it as skipped."""
+        name = path.rsplit('/', 1)[-1]
+        included = self._includes is None or _matches(self._includes, path, name)
+        if included and not _matches(self._excludes, path, name):
+            return True
+
+        self.skipped_files += 1
+        self.skipped_bytes += size
+        return False
+
+def _compile_patterns(patterns):
+    """Compile patterns into (file name regex, path glob regex, path regex), any of which
+       may be None.
+    """
+    name_globs = []
+    path_globs = []
+    path_regexes = []
+    for pattern in patterns:
+        if pattern.startswith(REGEX_PREFIX):
+            path_regexes.append(pattern[len(REGEX_PREFIX):])
+        elif '/' in pattern:
+            path_globs.append(fnmatch.translate(pattern.lstrip('/')))
+        else:
+            name_globs.append(fnmatch.translate(pattern))
+
+    return tuple(re.compile('|'.join('(?:%s)' % p for p in group)) if group else None
+                 for group in (name_globs, path_globs, path_regexes))
+
+def _matches(compiled, path, name):
+    (name_re, path_glob_re, path_re) = compiled
+    # Globs match the whole name or path; regular expressions may match anywhere in the path.
+    return bool((name_re is not None and name_re.match(name)) or
+                (path_glob_re is not None and path_glob_re.match(path)) or
+                (path_re is not None and path_re.search(path)))
+
 
 class Zipper(object):
 
-    def __init__(self, out_dir, max_count=MAX_COUNT, max_size=MAX_SIZE):
+    def __init__(self, out_dir, max_count=MAX_COUNT, max_size=MAX_SIZE, digests=None, path_filter=None):
         self.out_dir = out_dir
+        self.digests = digests
+        self.path_filter = path_filter
         self.max_count = max_count
         self.max_size = max_size
         self.file_count = 0
@@ -55,25 +465,49 @@ class Zipper(object):
         self.zip = None
 
     def append(self, filename, size, stream_func):
-        if self.zip is None or self.file_count >= self.max_count or self.file_size + size >= self.max_size:
-            if self.zip is not None:
-                self.zip.close()
-                self.counter+=1
+        filename = self.accept(filename, size)
+
+        # Skipped entries are never read.
+        if filename is not None:
+            self.write(filename, size, stream_func())
 
-            self.zip = zipfile.ZipFile(os.path.join(self.out_dir, OUT_ZIP_FORMAT % self.counter), mode='w')
+    def accept(self, filename, size):
+        """Return the normalized entry name for filename, or None if the path filter rejects it."""
+        filename = normalize_entry_name(filename)
+        if self.path_filter is not None and not self.path_filter.accept(filename, size):
+            return None
+        return filename
 
-        if '/' in filename:
-            filename_parts = filename.split('/')
+    def write(self, filename, size, data, sidecars=None, sha1=None, rollover=True):
+        """Write an accepted entry, and any (name, content) sidecars, into the same part.
+           sha1 is the entry's sha1 hex digest, if already known. If rollover is True, start a
+           new part first when the entries won't fit in the current one; otherwise the caller
+           manages parts with new_part().
+        """
+        sidecars = sidecars or []
+        count = 1 + len(sidecars)
+        unit_size = size + sum(len(content) for (name, content) in sidecars)
+        if self.zip is None or (rollover and (self.file_count + count > self.max_count or self.file_size + unit_size >= self.max_size)):
+            self.new_part()
 
-            if 'maven' in filename_parts[0]:
-                if len(filename_parts) > 1:
-                    filename = '/'.join(filename_parts[1:])
-                else:
-                    filename = ''
+        for (name, content, digest) in [(filename, data, sha1)] + [(name, content, None) for (name, content) in sidecars]:
+            # Directory entries (as in zip -r archives) are left out, so the fingerprint only
+            # depends on the files.
+            if self.digests is not None and not name.endswith('/'):
+                self.digests[name] = digest or hashlib.sha1(content).hexdigest()
+            self.zip.writestr(name, content)
 
-        self.zip.writestr(filename, stream_func())
-        self.file_count+=1
-        self.file_size+=size
+        self.file_count+=count
+        self.file_size+=unit_size
+
+    def new_part(self):
+        if self.zip is not None:
+            self.zip.close()
+            self.counter+=1
+
+        self.zip = zipfile.ZipFile(os.path.join(self.out_dir, OUT_ZIP_FORMAT % self.counter), mode='w')
+        self.file_count = 0
+        self.file_size = 0
 
     def close(self):
         if self.zip is not None:
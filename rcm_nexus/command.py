@@ -1,15 +1,20 @@
+# NOTE: Modules that pull in lxml, requests or yaml (session, repo, group, staging
+# and the yaml-backed parts of config) are imported inside the commands that use
+# them, so that --help and nexus-init don't pay for them at startup.
 import time
-from rcm_nexus.session import Session
+import contextlib
 import rcm_nexus.config as config
-import rcm_nexus.repo as repos
-import rcm_nexus.group as groups
 import rcm_nexus.archive as archive
-import rcm_nexus.staging as staging
+import rcm_nexus.metrics as metrics
 import os.path
 import sys
 import re
 import click
+import json
+import shutil
 import tempfile
+import threading
+import zipfile
 
 RELEASE_GROUP_NAME = 'product-ga'
 TECHPREVIEW_GROUP_NAME = 'product-techpreview'
@@ -40,94 +45,669 @@ def init():
 
 @click.command()
 @click.argument('repo', type=click.Path(exists=True))
-@click.option('--environment', '-e', help='The target Nexus environment (from ~/.config/rcm-nexus/config.yaml)')
+@click.option('--environment', '-e', 'environments', multiple=True, help='The target Nexus environment (from ~/.config/rcm-nexus/config.yaml). Repeat to push the same content to several environments concurrently')
 @click.option('--product', '-p', help='The product key, used to lookup profileId from the configuration')
 @click.option('--version', '-v', help='The product version, used in repository definition metadata')
 @click.option('--ga', '-g', is_flag=True, default=False, help='Push content to the GA group (as opposed to earlyaccess)')
+@click.option('--mmap', 'use_mmap', is_flag=True, default=False, help='Memory-map the input zip archive instead of using buffered reads')
+@click.option('--wait/--no-wait', default=True, help='Wait for Nexus to close (verify) the staging repository before adding it to groups')
+@click.option('--close-timeout', type=int, help='Seconds to wait for the staging repository to close (default: 600)')
+@click.option('--dedup', is_flag=True, default=False, help='Reuse an existing closed staging repository with identical content instead of uploading again')
+@click.option('--verify', is_flag=True, default=False, help='Check that every uploaded file is in the staging repository before closing it')
+@click.option('--include', '-i', 'includes', multiple=True, help='Only push files matching this glob (or re:<regex>) (repeatable)')
+@click.option('--exclude', '-x', 'excludes', multiple=True, help='Don\'t push files matching this glob (or re:<regex>) (repeatable)')
+@click.option('--no-default-excludes', 'default_excludes', flag_value=False, default=True, help='Also push Maven local-repository bookkeeping files (*.lastUpdated, _remote.repositories, ...)')
+@click.option('--checksum', '-k', 'checksums', multiple=True, type=click.Choice(archive.CHECKSUM_ALGORITHMS), help='Generate this checksum file for artifacts that lack one (repeatable)')
+@click.option('--metrics', '-m', 'metrics_sinks', multiple=True, help='Report request and phase timings to: stderr, jsonl:<path> or prom:<path> (repeatable)')
 @click.option('--debug', '-D', is_flag=True, default=False)
-def push(repo, environment, product, version, ga=False, debug=False):
+def push(repo, environments, product, version, ga=False, use_mmap=False, wait=True, close_timeout=None, dedup=False, verify=False,
+         includes=None, excludes=None, default_excludes=True, checksums=None, metrics_sinks=None, debug=False):
     """Push Apache Maven repository content to a Nexus staging repository, 
     then add the staging repository to appropriate content groups.
 
+    When several environments are given, the content is zipped once and pushed
+    to all of them concurrently.
+
+    A fingerprint of the content is recorded in the staging repository description.
+    With --dedup, if a closed staging repository for the same product profile already
+    has that fingerprint, it is added to the groups instead of uploading the content again.
+
+    Maven local-repository bookkeeping files (*.lastUpdated, _remote.repositories and
+    the like) are never pushed, unless --no-default-excludes is given. Use --include and
+    --exclude to select content further.
+
     More Information: https://mojo.redhat.com/docs/DOC-1132234
     """
+    if not environments:
+        raise click.UsageError("At least one --environment is required")
 
-    nexus_config = config.load(environment, debug)
-
-    if release:
-        groups = [RELEASE_GROUP_NAME, TECHPREVIEW_GROUP_NAME]
-    else:
-        groups = [PRERELEASE_GROUP_NAME]
+    # Load every configuration up front, so a bad environment fails before any work is done.
+    nexus_configs = [(environment, config.load(environment, debug=debug)) for environment in environments]
 
-    session = Session(nexus_config, debug=debug)
-    
+    recorder = metrics.Recorder(metrics.sinks_from_specs(metrics_sinks))
     try:
-        print "Pushing: %s content to: %s" % (repo, environment)
+        print "Pushing: %s content to: %s" % (repo, ', '.join(environments))
         
         # produce a set of clean repository zips for PUT upload.
         zips_dir = tempfile.mkdtemp()
-        print "Creating ZIP archives in: %s" % zips_dir
+        path_filter = archive.PathFilter(includes, excludes, default_excludes)
+        (zip_paths, fingerprint) = _create_zips(repo, zips_dir, recorder, use_mmap, path_filter, checksums)
+
+        if len(nexus_configs) == 1:
+            (environment, nexus_config) = nexus_configs[0]
+            with recorder.tag(repo=repo):
+                _push_to_environment(nexus_config, zip_paths, product, version, ga, recorder, wait, close_timeout, debug,
+                                     fingerprint=fingerprint, dedup=dedup, verify=verify)
+            return
+
+        from rcm_nexus.workers import imap_unordered
+
+        def push_one(env_config):
+            with recorder.tag(repo=repo):
+                return _push_to_environment(env_config[1], zip_paths, product, version, ga, recorder, wait, close_timeout,
+                                            debug, fingerprint=fingerprint, dedup=dedup, verify=verify)
+
+        results = {}
+        for (env_config, staging_repo_id, error) in imap_unordered(push_one, nexus_configs, len(nexus_configs)):
+            results[env_config[0]] = (staging_repo_id, error)
+
+        print "\nPush results:"
+        failed = []
+        for environment in environments:
+            (staging_repo_id, error) = results[environment]
+            if error is None:
+                print "  %s: OK (staging repository: %s)" % (environment, staging_repo_id)
+            else:
+                print "  %s: FAILED: %s" % (environment, error[1])
+                failed.append(environment)
+
+        if failed:
+            raise Exception("Push failed for environment(s): %s" % ', '.join(failed))
+    finally:
+        recorder.flush()
+
+def _create_zips(repo, zips_dir, recorder, use_mmap=False, path_filter=None, checksums=None):
+    """Produce a set of clean, partitioned repository zips for upload in zips_dir, leaving
+       out anything path_filter rejects and adding any missing checksums files listed.
+       Return (zip paths, content fingerprint).
+    """
+    print "Creating ZIP archives in: %s" % zips_dir
+    digests = {}
+    with recorder.span('zip', repo=repo) as span:
         if os.path.isdir(repo):
             print "Processing repository directory: %s" % repo
 
             # Walk the directory tree, and create a zip.
-            zip_paths = archive.create_partitioned_zips_from_dir(repo, zips_dir)
+            zip_paths = archive.create_partitioned_zips_from_dir(repo, zips_dir, digests=digests, path_filter=path_filter,
+                                                                 checksums=checksums)
         else:
             print "Processing repository zip archive: %s" % repo
 
             # Open the zip, walk the entries and normalize the structure to clean zip (if necessary)
-            zip_paths = archive.create_partitioned_zips_from_zip(repo, zips_dir)
+            zip_paths = archive.create_partitioned_zips_from_zip(repo, zips_dir, use_mmap=use_mmap, digests=digests,
+                                                                 path_filter=path_filter, checksums=checksums)
 
-        
-        # Open new staging repository with description
-        staging_repo_id = staging.start_staging_repo(session, nexus_config, product, version, ga)
+        if path_filter is not None:
+            span.update(skipped_files=path_filter.skipped_files, skipped_bytes=path_filter.skipped_bytes)
+            if path_filter.skipped_files:
+                print "Skipped %d files (%d bytes) in: %s" % (path_filter.skipped_files, path_filter.skipped_bytes, repo)
+
+    if not zip_paths:
+        raise Exception("No content to push in: %s" % repo)
+
+    return (zip_paths, archive.fingerprint(digests))
+
+def _release_group_names(ga):
+    """Return the names of the content groups a GA (or early-access) release is added to."""
+    if ga:
+        return [RELEASE_GROUP_NAME, TECHPREVIEW_GROUP_NAME]
+    return [PRERELEASE_GROUP_NAME]
+
+def _push_to_environment(nexus_config, zip_paths, product, version, ga, recorder, wait=True, close_timeout=None, debug=False,
+                         session=None, rate_limiter=None, group_lock=None, fingerprint=None, dedup=False, verify=False,
+                         snapshot=True):
+    """Stage the already-partitioned zip_paths in one environment, then add the staging
+       repository to the content groups. If wait is True, don't touch the groups until Nexus
+       has closed the staging repository. Return the staging repository id.
+
+       The content fingerprint, if given, is recorded in the staging repository description.
+       If dedup is True and a closed staging repository with the same fingerprint exists,
+       nothing is uploaded and that repository is added to the groups instead. If verify is
+       True, check every uploaded file landed before closing the staging repository.
+
+       If snapshot is True, the groups' memberships are snapshotted before they are changed
+       (see group.save_snapshot()). A shared session may be passed in (it is left open); otherwise
+       one is created for this push. Uploads are throttled by rate_limiter, if given, and group updates are
+       serialized on group_lock, if given, so concurrent pushes don't overwrite each
+       other's group membership changes.
+    """
+    from rcm_nexus.session import Session
+    import rcm_nexus.group as groups
+    import rcm_nexus.staging as staging
+
+    environment = nexus_config.name
+    group_names = _release_group_names(ga)
+
+    own_session = session is None
+    if own_session:
+        session = Session(nexus_config, debug=debug, recorder=recorder)
+    if group_lock is None:
+        group_lock = threading.Lock()
+    
+    try:
+        staging_repo_id = None
+        if dedup and fingerprint is not None:
+            with recorder.span('dedup', environment=environment):
+                staging_repo_id = staging.find_staged_repo(session, nexus_config, product, ga, fingerprint)
+            if staging_repo_id is not None:
+                print "Identical content already staged in: %s (%s). Skipping upload." % (staging_repo_id, environment)
+
+        if staging_repo_id is None:
+            staging_repo_id = _stage(session, nexus_config, zip_paths, product, version, ga, recorder,
+                                     wait, close_timeout, rate_limiter, fingerprint, verify)
+
+        with group_lock, recorder.span('group_update', environment=environment):
+            loaded = []
+            for group_name in group_names:
+                group = groups.load(session, group_name, ignore_missing=True)
+                if group is None:
+                    print "No such group: %s (%s)" % (group_name, environment)
+                    raise Exception("No such group: %s" % group_name)
+                loaded.append(group)
+
+            if snapshot:
+                # Record the memberships before changing them, for nexus-rollback --restore.
+                snapshot_path = groups.snapshot_path(environment, staging_repo_id)
+                groups.save_snapshot(snapshot_path, environment, dict((g.id(), g.member_list()) for g in loaded))
+                print "Saved group snapshot: %s (%s)" % (snapshot_path, environment)
+
+            for group in loaded:
+                print "Adding %s to group: %s (%s)" % (staging_repo_id, group.id(), environment)
+                group.append_member(session, staging_repo_id).save(session, reload=False)
+
+        return staging_repo_id
+    finally:
+        if own_session:
+            session.close()
 
-        # HTTP PUT clean repository zips to Nexus.
+def _stage(session, nexus_config, zip_paths, product, version, ga, recorder, wait=True, close_timeout=None,
+           rate_limiter=None, fingerprint=None, verify=False):
+    """Open a staging repository, upload zip_paths into it and finish (close) it, waiting for
+       the close if wait is True. If verify is True, check that every uploaded file is in the
+       staging repository before finishing it. Return the staging repository id.
+    """
+    import rcm_nexus.repo as repos
+    import rcm_nexus.staging as staging
+    import rcm_nexus.content as content
+
+    environment = nexus_config.name
+
+    # Open new staging repository with description
+    with recorder.span('start', environment=environment):
+        staging_repo_id = staging.start_staging_repo(session, nexus_config, product, version, ga, fingerprint)
+
+    # HTTP PUT clean repository zips to Nexus.
+    with recorder.span('upload', environment=environment, parts=len(zip_paths)):
         delete_first = True
-        for zipfile in zip_paths:
-            repo.push_zip(session, staging_repo_id, zipfile, delete_first)
+        for zip_path in zip_paths:
+            repos.push_zip(session, staging_repo_id, zip_path, delete_first, rate_limiter=rate_limiter)
             delete_first = False
 
-        # Close staging repository
-        staging.finish_staging_repo(session, nexus_config, staging_repo_id, product, version, ga)
+    if verify:
+        # Only the zip central directories are read here, not the content.
+        paths = []
+        for zip_path in zip_paths:
+            with contextlib.closing(zipfile.ZipFile(zip_path)) as zf:
+                paths.extend(name for name in zf.namelist() if not name.endswith('/'))
+        with recorder.span('verify', environment=environment, files=len(paths)):
+            for (path, exists) in session.exists_many((content.content_path(staging_repo_id, name) for name in paths),
+                                                      stop_on_missing=True):
+                if not exists:
+                    raise Exception("Uploaded file missing from staging repository %s: %s (%s). The repository was left open." % (
+                        staging_repo_id, path, environment))
+        print "Verified %d files in staging repository %s (%s)" % (len(paths), staging_repo_id, environment)
 
-        for group_id in groups:
-            group = groups.load(session, group_id, ignore_missing=True)
-            if group is not None:
-                print "Adding %s to group: %s" % (staging_repo_id, group_id)
+    # Close staging repository
+    with recorder.span('finish', environment=environment):
+        staging.finish_staging_repo(session, nexus_config, staging_repo_id, product, version, ga, fingerprint)
+
+    if wait:
+        with recorder.span('close_wait', environment=environment):
+            timeout = staging.CLOSE_TIMEOUT if close_timeout is None else close_timeout
+            elapsed = staging.wait_for_close(session, staging_repo_id, timeout=timeout)
+        print "Staging repository %s closed after %.1fs (%s)" % (staging_repo_id, elapsed, environment)
+
+    return staging_repo_id
+
+REORDER_POLICIES = ('newest', 'hits')
+
+MANIFEST_KEYS = ('repo', 'product', 'version', 'ga', 'environment')
+RATE_SUFFIXES = {'K': 1000, 'M': 1000 ** 2, 'G': 1000 ** 3}
 
-                group.append_member(session, staging_repo_id).save(session)
+def _parse_rate(value):
+    """Parse a byte rate such as '500000', '20M' or '1G' into bytes/sec."""
+    value = value.strip().upper()
+    multiplier = RATE_SUFFIXES.get(value[-1:])
+    if multiplier is not None:
+        value = value[:-1]
+    try:
+        return int(float(value) * (multiplier or 1))
+    except ValueError:
+        raise click.BadParameter("Invalid rate: '%s' (expected e.g. 500000, 20M or 1G)" % value)
+
+def _load_manifest(manifest, default_environment):
+    """Load a bulk-push manifest: a YAML or JSON list of pushes, each with repo, product,
+       version, and optionally ga (default false) and environment (default: --environment).
+       The list may also be given under a top-level 'pushes' key.
+    """
+    import yaml
+
+    with open(manifest) as f:
+        data = yaml.safe_load(f)
+    if isinstance(data, dict):
+        data = data.get('pushes')
+    if not isinstance(data, list):
+        raise click.UsageError("Manifest %s must contain a list of pushes" % manifest)
+
+    base_dir = os.path.dirname(os.path.abspath(manifest))
+    entries = []
+    for i, item in enumerate(data):
+        entry = dict(item)
+        unknown = set(entry.keys()) - set(MANIFEST_KEYS)
+        missing = [key for key in ('repo', 'product', 'version') if not entry.get(key)]
+        if unknown or missing:
+            raise click.UsageError("Invalid manifest entry #%d in %s (missing: %s, unknown: %s)" % (
+                i + 1, manifest, ', '.join(missing) or 'none', ', '.join(sorted(unknown)) or 'none'))
+
+        entry['version'] = str(entry['version'])
+        entry['ga'] = entry.get('ga') is True
+        entry['environment'] = entry.get('environment') or default_environment
+        if entry['environment'] is None:
+            raise click.UsageError("Manifest entry #%d in %s names no environment, and no --environment was given" % (i + 1, manifest))
+        # Relative repo paths are relative to the manifest.
+        entry['repo'] = os.path.join(base_dir, entry['repo'])
+        if not os.path.exists(entry['repo']):
+            raise click.UsageError("Manifest entry #%d in %s: no such repository: %s" % (i + 1, manifest, entry['repo']))
+        entries.append(entry)
+
+    return entries
+
+@click.command()
+@click.argument('manifest', type=click.Path(exists=True))
+@click.option('--environment', '-e', help='The target Nexus environment for manifest entries that don\'t name one')
+@click.option('--concurrency', '-c', type=int, default=4, help='Maximum number of pushes to run at once (default: 4)')
+@click.option('--rate-limit', '-r', help='Combined upload rate budget for all pushes, in bytes/sec (K, M and G suffixes allowed)')
+@click.option('--wait/--no-wait', default=True, help='Wait for Nexus to close (verify) each staging repository before adding it to groups')
+@click.option('--close-timeout', type=int, help='Seconds to wait for each staging repository to close (default: 600)')
+@click.option('--dedup', is_flag=True, default=False, help='Reuse existing closed staging repositories with identical content instead of uploading again')
+@click.option('--verify', is_flag=True, default=False, help='Check that every uploaded file is in its staging repository before closing it')
+@click.option('--include', '-i', 'includes', multiple=True, help='Only push files matching this glob (or re:<regex>) (repeatable)')
+@click.option('--exclude', '-x', 'excludes', multiple=True, help='Don\'t push files matching this glob (or re:<regex>) (repeatable)')
+@click.option('--no-default-excludes', 'default_excludes', flag_value=False, default=True, help='Also push Maven local-repository bookkeeping files (*.lastUpdated, _remote.repositories, ...)')
+@click.option('--checksum', '-k', 'checksums', multiple=True, type=click.Choice(archive.CHECKSUM_ALGORITHMS), help='Generate this checksum file for artifacts that lack one (repeatable)')
+@click.option('--report', type=click.Path(), help='Also write the consolidated report to this file, as JSON')
+@click.option('--metrics', '-m', 'metrics_sinks', multiple=True, help='Report request and phase timings to: stderr, jsonl:<path> or prom:<path> (repeatable)')
+@click.option('--debug', '-D', is_flag=True, default=False)
+def bulk_push(manifest, environment=None, concurrency=4, rate_limit=None, wait=True, close_timeout=None, dedup=False, verify=False,
+              includes=None, excludes=None, default_excludes=True, checksums=None, report=None, metrics_sinks=None, debug=False):
+    """Push many repositories, listed in a YAML or JSON manifest, to Nexus staging
+    repositories and content groups in a single run.
+
+    Each manifest entry gives repo, product, version, and optionally ga and environment.
+    All pushes to an environment share one configuration and one pooled connection
+    session; --concurrency bounds how many run at once, and --rate-limit caps their
+    combined upload rate.
+
+    Before any push starts, the memberships of every group the manifest touches are
+    saved in one snapshot per environment, for nexus-rollback --restore.
+
+    More Information: https://mojo.redhat.com/docs/DOC-1132234
+    """
+    from rcm_nexus.session import Session
+    from rcm_nexus.workers import (imap_unordered, RateLimiter)
+    import rcm_nexus.group as groups
+
+    entries = _load_manifest(manifest, environment)
+    rate_limiter = RateLimiter(_parse_rate(rate_limit)) if rate_limit else None
+    recorder = metrics.Recorder(metrics.sinks_from_specs(metrics_sinks))
+
+    sessions = {}
+    group_locks = {}
+    try:
+        for env in sorted(set(entry['environment'] for entry in entries)):
+            sessions[env] = Session(config.load(env, debug=debug), debug=debug, recorder=recorder, pool_size=concurrency)
+            group_locks[env] = threading.Lock()
+
+            # One snapshot holds the whole release's previous state, so it can be rolled back at once.
+            group_names = set(name for entry in entries if entry['environment'] == env for name in _release_group_names(entry['ga']))
+            memberships = {}
+            for group_name in sorted(group_names):
+                group = groups.load(sessions[env], group_name, ignore_missing=True)
+                if group is not None:
+                    memberships[group.id()] = group.member_list()
+            snapshot_path = groups.snapshot_path(env, 'bulk')
+            groups.save_snapshot(snapshot_path, env, memberships)
+            print "Saved group snapshot: %s (%s)" % (snapshot_path, env)
+
+        def push_one(indexed_entry):
+            entry = indexed_entry[1]
+            start = time.time()
+            session = sessions[entry['environment']]
+            zips_dir = tempfile.mkdtemp()
+            try:
+                # Tell each entry's spans apart in the metrics.
+                with recorder.tag(repo=entry['repo'], environment=entry['environment']):
+                    path_filter = archive.PathFilter(includes, excludes, default_excludes)
+                    (zip_paths, fingerprint) = _create_zips(entry['repo'], zips_dir, recorder, path_filter=path_filter,
+                                                            checksums=checksums)
+                    staging_repo_id = _push_to_environment(session.config, zip_paths, entry['product'], entry['version'],
+                                                           entry['ga'], recorder, wait, close_timeout, debug,
+                                                           session=session, rate_limiter=rate_limiter,
+                                                           group_lock=group_locks[entry['environment']],
+                                                           fingerprint=fingerprint, dedup=dedup, verify=verify,
+                                                           snapshot=False)
+            finally:
+                shutil.rmtree(zips_dir, ignore_errors=True)
+            return (staging_repo_id, time.time() - start)
+
+        print "Pushing %d repositories (concurrency: %d)" % (len(entries), concurrency)
+        started = time.time()
+        results = []
+        for ((i, entry), result, error) in imap_unordered(push_one, enumerate(entries), concurrency):
+            result_entry = dict(entry, index=i)
+            if error is None:
+                result_entry.update(staging_repo_id=result[0], seconds=result[1], error=None)
             else:
-                print "No such group: %s" % group_id
-                raise Exception("No such group: %s" % group_id)
+                result_entry.update(staging_repo_id=None, seconds=None, error=str(error[1]))
+            results.append(result_entry)
+        elapsed = time.time() - started
     finally:
-        if session is not None:
+        for session in sessions.values():
             session.close()
+        recorder.flush()
+
+    results.sort(key=lambda r: r.pop('index'))
+    failed = [r for r in results if r['error'] is not None]
+
+    print "\nBulk push results:"
+    for r in results:
+        label = "%s %s (%s, %s)" % (r['product'], r['version'], 'GA' if r['ga'] else 'EA', r['environment'])
+        if r['error'] is None:
+            print "  %-50s OK      %-30s %8.1fs" % (label, r['staging_repo_id'], r['seconds'])
+        else:
+            print "  %-50s FAILED  %s" % (label, r['error'])
+    print "%d pushed, %d failed, in %.1fs" % (len(results) - len(failed), len(failed), elapsed)
+
+    if report:
+        with open(report, 'w') as f:
+            json.dump({'seconds': elapsed, 'pushes': results}, f, indent=2, sort_keys=True)
+
+    if failed:
+        raise Exception("%d of %d pushes failed" % (len(failed), len(results)))
     
 @click.command()
-@click.argument('staging_repo_name')
+@click.argument('repo', type=click.Path(exists=True))
+@click.argument('remote')
 @click.option('--environment', '-e', help='The target Nexus environment (from ~/.config/rcm-nexus/config.yaml)')
+@click.option('--group', '-G', 'is_group', is_flag=True, default=False, help='REMOTE is a repository group, not a repository')
+@click.option('--include', '-i', 'includes', multiple=True, help='Only compare files matching this glob (or re:<regex>) (repeatable)')
+@click.option('--exclude', '-x', 'excludes', multiple=True, help='Don\'t compare files matching this glob (or re:<regex>) (repeatable)')
+@click.option('--no-default-excludes', 'default_excludes', flag_value=False, default=True, help='Also compare Maven local-repository bookkeeping files')
+@click.option('--concurrency', '-c', type=int, default=8, help='Maximum number of concurrent requests to Nexus (default: 8)')
+@click.option('--refresh', is_flag=True, default=False, help='Ignore any cached listing of the remote content')
+@click.option('--cache-ttl', type=int, default=3600, help='Seconds a cached remote listing stays valid (default: 3600)')
 @click.option('--debug', '-D', is_flag=True, default=False)
-def rollback(args, config, session, delete_log=None, debug=False):
-    """Remove the given staging repository from all release groups
+def diff(repo, remote, environment, is_group=False, includes=None, excludes=None, default_excludes=True, concurrency=8,
+         refresh=False, cache_ttl=3600, debug=False):
+    """Compare Apache Maven repository content (a directory or zip) with a Nexus repository
+    or group, and list the files a push would add (+) or change (M), and the files only
+    present remotely (-).
+
+    Files are compared by sha1, using the remote .sha1 files where they exist, and by size
+    otherwise. Remote listings are cached (see --cache-ttl and --refresh), along with the
+    checksums fetched for them.
 
     More Information: https://mojo.redhat.com/docs/DOC-1132234
     """
+    from rcm_nexus.session import Session
+    import rcm_nexus.content as content
 
-    nexus_config = config.load(environment, debug)
+    nexus_config = config.load(environment, debug=debug)
+    path_filter = archive.PathFilter(includes, excludes, default_excludes)
 
-    groups = [RELEASE_GROUP_NAME, TECHPREVIEW_GROUP_NAME, PRERELEASE_GROUP_NAME]
+    print "Reading: %s" % repo
+    local = archive.digest_content(repo, path_filter)
 
-    session = Session(config.base_url, user, debug=debug, disable_ssl_validation=config.permissive_ssl, preemptive_auth=config.preemptive_auth)
-    
+    session = Session(nexus_config, debug=debug, pool_size=concurrency)
+    try:
+        print "Listing %s: %s (%s)" % ('group' if is_group else 'repository', remote, environment)
+        listing = content.load_listing(session, remote, is_group, max_age=cache_ttl, refresh=refresh, max_workers=concurrency)
+        remote_files = listing['files']
+
+        common = [path for path in local if path in remote_files]
+        content.fetch_checksums(session, remote, remote_files, common, is_group, concurrency)
+        content.save_listing(session, remote, listing, is_group)
+    finally:
+        session.close()
+
+    (added, removed, changed) = content.diff_content(local, remote_files)
+    for (marker, paths) in (('+', added), ('M', changed), ('-', removed)):
+        for path in paths:
+            print "%s %s" % (marker, path)
+
+    print "%d added, %d changed, %d only in %s" % (len(added), len(changed), len(removed), remote)
+
+@click.command()
+@click.argument('staging_repo_name', required=False)
+@click.option('--environment', '-e', help='The target Nexus environment (from ~/.config/rcm-nexus/config.yaml)')
+@click.option('--restore', '-r', type=click.Path(exists=True, dir_okay=False), help='Restore the group memberships recorded in this snapshot (written by nexus-push) instead')
+@click.option('--debug', '-D', is_flag=True, default=False)
+def rollback(staging_repo_name=None, environment=None, restore=None, debug=False):
+    """Remove the given staging repository from all release groups
+
+    With --restore, put every group recorded in a snapshot taken by nexus-push back
+    to its previous membership instead, with one update per group. The environment
+    defaults to the one the snapshot was taken in. Only the last 50 snapshots of each
+    environment are kept.
+
+    More Information: https://mojo.redhat.com/docs/DOC-1132234
+    """
+    from rcm_nexus.session import Session
+    import rcm_nexus.group as groups
+
+    snapshot = None
+    if restore is not None:
+        snapshot = groups.load_snapshot(restore)
+        if environment is not None and environment != snapshot['environment']:
+            raise click.UsageError("Snapshot %s was taken in environment: %s" % (restore, snapshot['environment']))
+        environment = snapshot['environment']
+    elif staging_repo_name is None:
+        raise click.UsageError("Either STAGING_REPO_NAME or --restore is required")
+
+    nexus_config = config.load(environment, debug=debug)
+    session = Session(nexus_config, debug=debug, pool_size=groups.INDEX_WORKERS)
     try:
+        if snapshot is not None:
+            print "Restoring group memberships from: %s (%s)" % (restore, environment)
+            for (group_name, changed) in groups.restore_snapshot(session, snapshot):
+                if changed:
+                    print "Restored group: %s (%d members)" % (group_name, len(snapshot['groups'][group_name]))
+                else:
+                    print "Group unchanged: %s" % group_name
+            return
+
         print "Removing content of: %s" % staging_repo_name
-        
-        for group_name in groups:
+
+        # Only the release groups that actually contain the repository are loaded and saved.
+        member_of = set(groups.load_index(session).get(staging_repo_name, []))
+        group_names = [group_name for group_name in [RELEASE_GROUP_NAME, TECHPREVIEW_GROUP_NAME, PRERELEASE_GROUP_NAME]
+                       if group_name in member_of]
+        if not group_names:
+            print "%s is not a member of any release group" % staging_repo_name
+
+        for group_name in group_names:
             group = groups.load(session, group_name, True)
             if group is not None:
                 print "Removing %s from group %s" % (staging_repo_name, group_name)
-                group.remove_member(session, staging_repo_name).save(session)
+                group.remove_member(session, staging_repo_name).save(session, reload=False)
     finally:
-        if session is not None:
-            session.close()
+        session.close()
+
+
+@click.command()
+@click.argument('repo_ids', nargs=-1)
+@click.option('--environment', '-e', required=True, help='The target Nexus environment (from ~/.config/rcm-nexus/config.yaml)')
+@click.option('--concurrency', '-c', type=int, default=8, help='How many group definitions to fetch at once')
+@click.option('--refresh', is_flag=True, default=False, help='Fetch every group definition again, ignoring the cached index')
+@click.option('--debug', '-D', is_flag=True, default=False)
+def group_index(repo_ids, environment, concurrency=8, refresh=False, debug=False):
+    """Show which groups each of the given repositories is a member of (or, with no
+    repositories given, the groups of every repository that is in any group).
+
+    Group definitions are fetched concurrently and cached; later runs only download
+    the groups that have changed since.
+
+    More Information: https://mojo.redhat.com/docs/DOC-1132234
+    """
+    from rcm_nexus.session import Session
+    import rcm_nexus.group as groups
+
+    nexus_config = config.load(environment, debug=debug)
+    session = Session(nexus_config, debug=debug, pool_size=concurrency)
+    try:
+        index = groups.load_index(session, max_workers=concurrency, refresh=refresh)
+    finally:
+        session.close()
+
+    for repo_id in repo_ids or sorted(index):
+        print "%s: %s" % (repo_id, ', '.join(index.get(repo_id, [])) or '(none)')
+
+def _load_hits(hits_file):
+    """Load per-repository hit counts: one '<repository id> <hits>' pair per line (whitespace or
+       comma separated), as exported from access logs. Blank lines and '#' comments are ignored.
+    """
+    hits = {}
+    with open(hits_file) as f:
+        for (i, line) in enumerate(f):
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            parts = line.replace(',', ' ').split()
+            try:
+                (repo_id, count) = parts
+                hits[repo_id] = hits.get(repo_id, 0) + int(count)
+            except ValueError:
+                raise click.UsageError("Invalid line %d in %s (expected: <repository id> <hits>)" % (i + 1, hits_file))
+    return hits
+
+@click.command()
+@click.argument('group_names', nargs=-1, required=True)
+@click.option('--environment', '-e', required=True, help='The target Nexus environment (from ~/.config/rcm-nexus/config.yaml)')
+@click.option('--policy', '-P', type=click.Choice(REORDER_POLICIES), default='newest', help='newest: most recently created staging repositories first; hits: most requested first (needs --hits)')
+@click.option('--hits', 'hits_file', type=click.Path(exists=True, dir_okay=False), help='File of \'<repository id> <hits>\' lines, for --policy hits')
+@click.option('--dry-run', '-n', is_flag=True, default=False, help='Print the new order without saving it')
+@click.option('--debug', '-D', is_flag=True, default=False)
+def reorder(group_names, environment, policy='newest', hits_file=None, dry_run=False, debug=False):
+    """Reorder the members of the given groups, so that Nexus finds content in the
+    repositories most likely to have it first.
+
+    Nexus searches group members in order, and nexus-push appends new staging
+    repositories at the end. With --policy newest, staging repositories are ordered
+    newest first; with --policy hits, members are ordered by the hit counts in the
+    --hits file. Members the policy knows nothing about (e.g. ones that aren't staging
+    repositories) go last, in their current order.
+
+    Each group is saved once, after a snapshot of its current membership is taken
+    (see nexus-rollback --restore).
+
+    More Information: https://mojo.redhat.com/docs/DOC-1132234
+    """
+    from rcm_nexus.session import Session
+    import rcm_nexus.group as groups
+    import rcm_nexus.staging as staging
+
+    if policy == 'hits' and hits_file is None:
+        raise click.UsageError("--policy hits needs a --hits file")
+
+    nexus_config = config.load(environment, debug=debug)
+    session = Session(nexus_config, debug=debug)
+    try:
+        if policy == 'hits':
+            scores = _load_hits(hits_file)
+        else:
+            scores = dict((repo_id, created) for (repo_id, (repo_type, created, description))
+                          in staging.list_staged_repos(session).iteritems() if created is not None)
+
+        reordered = []
+        previous = {}
+        for group_name in group_names:
+            group = groups.load(session, group_name, ignore_missing=False)
+            members = group.member_list()
+            if group.reorder_members(scores):
+                reordered.append(group)
+                previous[group_name] = members
+            else:
+                print "Already in order: %s" % group_name
+
+        if dry_run:
+            for group in reordered:
+                print "New order of group: %s" % group.id()
+                for (repo_id, name, resource_uri) in group.member_list():
+                    print "  %s" % repo_id
+            return
+
+        if reordered:
+            snapshot_path = groups.snapshot_path(environment, 'reorder')
+            groups.save_snapshot(snapshot_path, environment, previous)
+            print "Saved group snapshot: %s" % snapshot_path
+
+        for group in reordered:
+            group.save(session, reload=False)
+            print "Reordered group: %s (%d members)" % (group.id(), len(group.member_list()))
+    finally:
+        session.close()
+
+@click.command()
+@click.option('--environment', '-e', required=True, help='The target Nexus environment (from ~/.config/rcm-nexus/config.yaml)')
+@click.option('--older-than', '-o', 'max_age_days', type=float, required=True, help='Only prune staging repositories created more than this many days ago')
+@click.option('--name-pattern', '-N', help='Only prune repositories whose name matches this regex')
+@click.option('--concurrency', '-c', type=int, default=4, help='Maximum number of concurrent deletions (default: 4)')
+@click.option('--rate', '-r', type=float, default=5.0, help='Maximum deletions started per second; 0 for no limit (default: 5)')
+@click.option('--dry-run', '-n', is_flag=True, default=False, help='Only report the repositories that would be deleted')
+@click.option('--debug', '-D', is_flag=True, default=False)
+def prune(environment, max_age_days, name_pattern=None, concurrency=4, rate=5.0, dry_run=False, debug=False):
+    """Delete stale staging repositories: those that aren't a member of any group and
+    were created more than --older-than days ago.
+
+    Only staging repositories are considered. Group membership comes from the cached
+    group index (see nexus-groups), revalidated against the server first.
+
+    More Information: https://mojo.redhat.com/docs/DOC-1132234
+    """
+    from rcm_nexus.session import Session
+    import rcm_nexus.group as groups
+    import rcm_nexus.pruning as pruning
+
+    nexus_config = config.load(environment, debug=debug)
+    session = Session(nexus_config, debug=debug, pool_size=max(concurrency, groups.INDEX_WORKERS))
+    try:
+        orphans = pruning.find_orphans(session, max_age_days, name_pattern)
+
+        now = time.time()
+        for (repo_id, name, created) in orphans:
+            print "%s %s: %s (%d days old)" % ('Would delete' if dry_run else 'Deleting', repo_id, name, (now - created) / pruning.DAY)
+        print "%d orphaned staging repositories older than %g days (%s)" % (len(orphans), max_age_days, environment)
+        if dry_run or not orphans:
+            return
+
+        failed = []
+        for (repo_id, error) in pruning.delete_repos(session, [orphan[0] for orphan in orphans], concurrency, rate or None):
+            if error is not None:
+                print "Failed to delete %s: %s" % (repo_id, error[1])
+                failed.append(repo_id)
+
+        print "Deleted %d repositories (%s)" % (len(orphans) - len(failed), environment)
+        if failed:
+            raise Exception("Failed to delete %d repositories: %s" % (len(failed), ', '.join(sorted(failed))))
+    finally:
+        session.close()
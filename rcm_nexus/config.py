@@ -1,8 +1,13 @@
-import yaml
 import getpass
 import subprocess
+import hashlib
+import json
+import marshal
 import os
 import sys
+import tempfile
+import threading
+import time
 
 RCM_NEXUS_YAML = 'RCM_NEXUS_YAML'
 
@@ -12,24 +17,33 @@ PASSWORD = 'password'
 SSL_VERIFY = 'ssl-verify'
 PREEMPTIVE_AUTH = 'preemptive-auth'
 INTERACTIVE = 'interactive'
+PASSWORD_CACHE_TTL = 'password-cache-ttl'
+STAGING_FORMAT = 'staging-format'
+GZIP_REQUESTS = 'gzip-requests'
 
 GA_PROFILE = 'ga'
 EA_PROFILE = 'ea'
 
 class NexusConfig(object):
-    def __init__(self, name, data, profile_data):
+    def __init__(self, name, data, profile_data, debug=False):
         self.name = name
+        self.debug = debug
         self.url = data[URL]
         self.ssl_verify = data.get(SSL_VERIFY, True)
         self.preemptive_auth = data.get(PREEMPTIVE_AUTH, False)
         self.username = data.get(USERNAME, None)
         self.password = data.get(PASSWORD, None)
         self.interactive = data.get(INTERACTIVE, True)
+        self.password_cache_ttl = data.get(PASSWORD_CACHE_TTL, 0)
+        # Body format for staging start/finish requests: 'xml' (default) or 'json'.
+        self.staging_format = data.get(STAGING_FORMAT, 'xml')
+        # Gzip large request bodies; only for servers (or proxies) that accept Content-Encoding: gzip.
+        self.gzip_requests = data.get(GZIP_REQUESTS, False)
         self.profile_map = profile_data
 
     def get_password(self):
         if self.password and self.password.startswith("@oracle:"):
-            return eval_password(self.username, oracle=self.password, interactive=self.interactive)
+            return resolve_password(self.username, self.password, self.interactive, self.password_cache_ttl, self.debug)
         return self.password
 
     def get_profile_id(self, product, is_ga):
@@ -42,7 +56,7 @@ class NexusConfig(object):
         if profile_id is None:
             raise Exception( 
                 "ProfileID not configured for quality level: %s in 'profile-maps' of configuration: %s for the product: '%s' (case-sensitive)" % 
-                (quality_level, config.name, product) )
+                (quality_level, self.name, product) )
 
         return profile_id
 
@@ -70,13 +84,14 @@ def load(environment, cli_overrides=None, debug=False):
 
     if debug is True:
         print "Loading main config: %s" % config_path
-    with open(config_path) as f:
-        dataMap = yaml.safe_load(f)
-        data=dataMap.get(environment)
+    dataMap = load_yaml(config_path, debug=debug)
+    data = dataMap.get(environment)
 
     if data is None:
         die("Missing configuration for environment: %s (config file: %s)" % (environment, config_path))
 
+    # Parsed files are cached and shared; don't let overrides leak into the cache.
+    data = dict(data)
     if cli_overrides is not None:
         data.update(cli_overrides)
 
@@ -86,17 +101,95 @@ def load(environment, cli_overrides=None, debug=False):
         print "Loading staging profiles: %s" % profiles
     profile_data = {}
     if os.path.exists(profiles):
-        with open(profiles) as f:
-            profile_data = yaml.safe_load(f)
+        profile_data = load_yaml(profiles, debug=debug) or {}
         if debug is True:
             print "Loaded %d product profiles for: %s" % (len(profile_data.keys()), environment)
     elif debug is True:
         print "WARNING: No profile mappings found in: %s" % profiles
 
-    return NexusConfig(environment, data, profile_data)
+    return NexusConfig(environment, data, profile_data, debug=debug)
 
 
+#############################################################################
+# Parsed YAML is cached, keyed by the file's path, mtime, size and inode:
+# in memory for the life of the process, and on disk (as marshal data, which
+# loads far faster than re-parsing large profile maps) in the rcm-nexus cache
+# directory across invocations. Any change to the file invalidates its entry.
+#
+_yaml_cache = {}
+
+def load_yaml(path, debug=False):
+    """Return the parsed contents of the YAML file at path, using the parsed-config cache."""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = (path, st.st_mtime, st.st_size, st.st_ino)
+
+    cached = _yaml_cache.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    cache_path = os.path.join(get_cache_dir(), 'config', "%s.marshal" % hashlib.sha1(path).hexdigest())
+    data = _read_yaml_cache(cache_path, key)
+    if data is None:
+        if debug is True:
+            print "Parsing: %s" % path
+        data = _parse_yaml(path)
+        _write_yaml_cache(cache_path, key, data)
+    elif debug is True:
+        print "Using cached parse of: %s" % path
+
+    _yaml_cache[path] = (key, data)
+    return data
+
+def clear_yaml_cache():
+    """Forget any YAML files parsed in this process. The on-disk cache is left alone."""
+    _yaml_cache.clear()
+
+def _parse_yaml(path):
+    import yaml
+
+    # Prefer the libyaml-backed loader; it's an order of magnitude faster.
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with open(path) as f:
+        return yaml.load(f, Loader=loader)
+
+def _read_yaml_cache(cache_path, key):
+    try:
+        with open(cache_path, 'rb') as f:
+            (cached_key, data) = marshal.load(f)
+    except (IOError, EOFError, ValueError, TypeError):
+        return None
+
+    if tuple(cached_key) != key:
+        return None
+    return data
+
+def _write_yaml_cache(cache_path, key, data):
+    try:
+        payload = marshal.dumps((key, data))
+    except ValueError:
+        # Not every YAML value (e.g. timestamps) can be marshalled; just don't cache those files.
+        return
+
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0700)
+        (fd, tmp_path) = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(payload)
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError):
+        pass
+
+def get_cache_dir():
+    """Return the rcm-nexus cache directory: $XDG_CACHE_HOME/rcm-nexus, or ~/.cache/rcm-nexus."""
+    xdg_cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(xdg_cache_home, 'rcm-nexus')
+
 def init_config():
+    import yaml
+
     conf_path = get_config_path()
     if os.path.exists(conf_path):
         die("%s already exists!" % conf_path)
@@ -141,6 +234,97 @@ def init_config():
 
     return conf_path
 
+#############################################################################
+# Password oracle results are memoized for the life of the process, so that
+# each oracle (e.g. a `pass` invocation behind a GPG agent prompt) runs at
+# most once no matter how many Sessions are created. If the environment sets
+# password-cache-ttl (seconds), the result is also shared across invocations
+# via the system keyring (the optional 'keyring' package) until it expires.
+# A keyring that is missing, locked or broken only loses the cross-invocation
+# cache; the in-process memo still applies.
+#
+KEYRING_SERVICE = 'rcm-nexus'
+
+_password_cache = {}
+_password_lock = threading.Lock()
+
+def resolve_password(username, oracle, interactive=False, cache_ttl=0, debug=False):
+    """
+    Resolve the password for the given oracle, running the oracle at most once
+    per process. With a positive cache_ttl, consult (and populate) the keyring
+    cache shared across invocations before running the oracle.
+    """
+    key = (username, oracle)
+    with _password_lock:
+        password = _password_cache.get(key)
+        if password is not None:
+            return password
+
+        if cache_ttl:
+            password = _keyring_get(username, oracle, debug)
+
+        if password is None:
+            password = eval_password(username, oracle=oracle, interactive=interactive)
+            if cache_ttl:
+                _keyring_set(username, oracle, password, cache_ttl, debug)
+
+        _password_cache[key] = password
+        return password
+
+def clear_password_cache():
+    """Forget any passwords memoized in this process. The keyring cache is left alone."""
+    with _password_lock:
+        _password_cache.clear()
+
+def _keyring_entry(username, oracle):
+    # The oracle command itself is hashed, so it's not stored in the keyring in the clear.
+    return "%s@%s" % (username, hashlib.sha256(oracle.encode('utf-8')).hexdigest())
+
+def _keyring_errors():
+    try:
+        from keyring.errors import KeyringError
+    except ImportError:
+        return (RuntimeError,)
+    return (KeyringError, RuntimeError)
+
+def _keyring_get(username, oracle, debug=False):
+    try:
+        import keyring
+    except ImportError:
+        return None
+
+    entry = _keyring_entry(username, oracle)
+    try:
+        stored = keyring.get_password(KEYRING_SERVICE, entry)
+        if stored is None:
+            return None
+
+        try:
+            cached = json.loads(stored)
+            if cached['expires'] > time.time():
+                return cached['password']
+        except (ValueError, KeyError, TypeError):
+            pass
+
+        keyring.delete_password(KEYRING_SERVICE, entry)
+    except _keyring_errors() as e:
+        if debug is True:
+            print "WARNING: Cannot read password cache from keyring: %s" % e
+    return None
+
+def _keyring_set(username, oracle, password, ttl, debug=False):
+    try:
+        import keyring
+    except ImportError:
+        return
+
+    stored = json.dumps({'password': password, 'expires': time.time() + ttl})
+    try:
+        keyring.set_password(KEYRING_SERVICE, _keyring_entry(username, oracle), stored)
+    except _keyring_errors() as e:
+        if debug is True:
+            print "WARNING: Cannot write password cache to keyring: %s" % e
+
 #############################################################################
 # Shamelessly ripped off and modified from bugwarrior:
 #     https://github.com/ralphbean/bugwarrior
@@ -0,0 +1,170 @@
+# Copyright (c) 2014 Red Hat, Inc..
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# Remote repository (and group) content listings, and comparison of local
+# repository content against them. Listings are fetched by walking the Nexus
+# content API one directory level at a time, with the directories of each
+# level listed concurrently, and are cached under the rcm-nexus cache dir.
+
+from lxml import etree
+from rcm_nexus.archive import CHECKSUM_EXTENSIONS
+from rcm_nexus.config import get_cache_dir
+from rcm_nexus.workers import imap_unordered
+import hashlib
+import json
+import os
+import tempfile
+import time
+import urllib
+
+REPO_CONTENT_PATH = '/service/local/repositories/{key}/content/{path}'
+GROUP_CONTENT_PATH = '/service/local/repo_groups/{key}/content/{path}'
+
+LIST_WORKERS = 8
+LISTING_CACHE_TTL = 3600
+LISTING_CACHE_DIR = 'listings'
+
+# Checksum files are fetched as-is, not as XML.
+RAW_HEADERS = {'Accept': '*/*'}
+
+def content_path(key, path, is_group=False):
+    path_format = GROUP_CONTENT_PATH if is_group else REPO_CONTENT_PATH
+    return path_format.format(key=key, path=urllib.quote(path))
+
+def list_content(session, key, is_group=False, max_workers=LIST_WORKERS):
+    """Return {path: [size, last modified, None]} for every file in the repository (or group).
+       The last slot holds the file's sha1, once known; see fetch_checksums().
+    """
+    files = {}
+    level = ['']
+    while level:
+        subdirs = []
+        results = imap_unordered(lambda path: _list_dir(session, key, path, is_group), level, max_workers)
+        for (path, result, error) in results:
+            if error is not None:
+                raise error[0], error[1], error[2]
+            for (file_path, size, last_modified) in result[0]:
+                files[file_path] = [size, last_modified, None]
+            subdirs.extend(result[1])
+        level = subdirs
+
+    return files
+
+def _list_dir(session, key, path, is_group):
+    """List one directory; return ([(path, size, last modified)...], [subdirectory path...])."""
+    response, text = session.get(content_path(key, path, is_group))
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    doc = etree.fromstring(text)
+
+    files = []
+    subdirs = []
+    for item in doc.iter('content-item'):
+        item_path = _utf8(item.findtext('relativePath').lstrip('/'))
+        if item.findtext('leaf') == 'true':
+            files.append((item_path, int(item.findtext('sizeOnDisk') or -1), item.findtext('lastModified')))
+        else:
+            subdirs.append(item_path if item_path.endswith('/') else item_path + '/')
+    return (files, subdirs)
+
+def fetch_checksums(session, key, files, paths, is_group=False, max_workers=LIST_WORKERS):
+    """Fill in the sha1 of each of paths in files (a listing from list_content()) from its
+       .sha1 file, where the repository has one. Return the number of checksums fetched.
+    """
+    wanted = [path for path in paths if files[path][2] is None and path + '.sha1' in files]
+
+    def fetch(path):
+        response, text = session.get(content_path(key, path + '.sha1', is_group), headers=RAW_HEADERS, ignore_404=True)
+        if response.status_code == 404 or not text.strip():
+            return None
+        # Some tools write 'digest  filename'.
+        return text.split()[0].lower()
+
+    fetched = 0
+    for (path, sha1, error) in imap_unordered(fetch, wanted, max_workers):
+        if error is not None:
+            raise error[0], error[1], error[2]
+        if sha1 is not None:
+            files[path][2] = sha1
+            fetched += 1
+    return fetched
+
+def load_listing(session, key, is_group=False, max_age=LISTING_CACHE_TTL, refresh=False, max_workers=LIST_WORKERS):
+    """Return the content listing of the repository (or group), as {'created': time, 'files':
+       list_content() result}, from the cache if it was made less than max_age seconds ago
+       (unless refresh is True). A fresh listing keeps the cached checksums of files whose
+       size and modification time haven't changed.
+    """
+    cache_path = _listing_cache_path(session.config, key, is_group)
+    cached = _read_listing_cache(cache_path)
+    if cached is not None and not refresh and time.time() - cached['created'] < max_age:
+        return cached
+
+    listing = {'created': time.time(), 'files': list_content(session, key, is_group, max_workers)}
+    if cached is not None:
+        for (path, entry) in listing['files'].iteritems():
+            old = cached['files'].get(path)
+            if old is not None and old[:2] == entry[:2]:
+                entry[2] = old[2]
+    return listing
+
+def save_listing(session, key, listing, is_group=False):
+    """Cache a listing from load_listing() (with any checksums fetched since)."""
+    _write_listing_cache(_listing_cache_path(session.config, key, is_group), listing)
+
+def diff_content(local, remote):
+    """Compare local content ({path: (size, sha1)}, see archive.digest_content()) with a remote
+       listing. Checksum files themselves are left out. Files are compared by sha1 where the
+       remote checksum is known, and by size otherwise.
+
+       Return sorted lists (added, removed, changed) of paths.
+    """
+    local_paths = set(path for path in local if not path.endswith(CHECKSUM_EXTENSIONS))
+    remote_paths = set(path for path in remote if not path.endswith(CHECKSUM_EXTENSIONS))
+
+    changed = []
+    for path in local_paths & remote_paths:
+        (size, sha1) = local[path]
+        (remote_size, last_modified, remote_sha1) = remote[path]
+        if remote_sha1 is not None:
+            if remote_sha1 != sha1:
+                changed.append(path)
+        elif remote_size >= 0 and remote_size != size:
+            changed.append(path)
+
+    return (sorted(local_paths - remote_paths), sorted(remote_paths - local_paths), sorted(changed))
+
+def _listing_cache_path(config, key, is_group):
+    name = hashlib.sha1("%s|%s|%s" % (config.url, 'group' if is_group else 'repository', key)).hexdigest()
+    return os.path.join(get_cache_dir(), LISTING_CACHE_DIR, name + '.json')
+
+def _read_listing_cache(cache_path):
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+    except (IOError, ValueError):
+        return None
+
+    if not isinstance(cached, dict) or 'created' not in cached or 'files' not in cached:
+        return None
+    cached['files'] = dict((_utf8(path), entry) for (path, entry) in cached['files'].iteritems())
+    return cached
+
+def _utf8(text):
+    """Paths are kept as UTF-8 byte strings, matching local entry names."""
+    return text.encode('utf-8') if isinstance(text, unicode) else text
+
+def _write_listing_cache(cache_path, data):
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0700)
+        (fd, tmp_path) = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError):
+        pass
@@ -12,16 +12,30 @@
 #    John Casey (jcasey@redhat.com)
 
 from lxml import (objectify,etree)
+from rcm_nexus.config import get_cache_dir
 from rcm_nexus.session import python_boolean
+from rcm_nexus.workers import imap_unordered
 import rcm_nexus.repo as repos
+import hashlib
+import json
 import os
 import re
+import tempfile
+import time
 
 GROUP_CONTENT_URI_RE = '(.+)/content/groups/.+'
 
 GROUPS_PATH = '/service/local/repo_groups'
 NAMED_GROUP_PATH = GROUPS_PATH + '/{key}'
 
+SNAPSHOT_DIR = 'snapshots'
+# Snapshots kept per environment; older ones are removed as new ones are saved.
+SNAPSHOT_KEEP = 50
+SNAPSHOT_NAME_RE = r'^%s-\d{8}T\d{6}(\.\d{6}-\d+)?-.+\.json$'
+
+INDEX_CACHE_DIR = 'group-index'
+INDEX_WORKERS = 8
+
 def group_exists(session, group_key):
     return session.exists( NAMED_GROUP_PATH.format(key=group_key) )
 
@@ -39,6 +53,157 @@ def load(session, group_key, ignore_missing=True):
     doc = objectify.fromstring(group_xml)
     return Group(doc)
 
+def list_groups(session):
+    """Return the ids of all groups."""
+    response, xml = session.get(GROUPS_PATH)
+    doc = etree.fromstring(_utf8(xml))
+    return [item.findtext('id') for item in doc.iter('repo-groups-item')]
+
+def load_index(session, max_workers=INDEX_WORKERS, refresh=False):
+    """Return {repository id: [ids of the groups it's a member of]} for the whole environment.
+
+       All group definitions are fetched concurrently (on up to max_workers threads, so the
+       session's pool should be at least that large). The member lists are cached under the
+       rcm-nexus cache dir along with each group's ETag (and Last-Modified), and are only
+       downloaded again for groups the server reports have changed. refresh ignores the cache.
+    """
+    cache_path = _index_cache_path(session.config)
+    cached = {} if refresh else _read_index_cache(cache_path)
+
+    def fetch(key):
+        entry = cached.get(key)
+        headers = {}
+        if entry is not None:
+            if entry.get('etag'):
+                headers['If-None-Match'] = entry['etag']
+            if entry.get('last_modified'):
+                headers['If-Modified-Since'] = entry['last_modified']
+
+        response, xml = session.get(NAMED_GROUP_PATH.format(key=key), headers=headers or None,
+                                    expect_status=(200, 304), ignore_404=True)
+        if response.status_code == 304 and entry is not None:
+            return entry
+        if response.status_code == 404:
+            # Deleted since it was listed.
+            return None
+
+        doc = etree.fromstring(_utf8(xml))
+        return {
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'members': [member.findtext('id') for member in doc.iter('repo-group-member')],
+        }
+
+    entries = {}
+    for (key, entry, error) in imap_unordered(fetch, list_groups(session), max_workers):
+        if error is not None:
+            raise error[0], error[1], error[2]
+        if entry is not None:
+            entries[key] = entry
+    _write_index_cache(cache_path, entries)
+
+    index = {}
+    for key in sorted(entries):
+        for repo_id in entries[key]['members']:
+            index.setdefault(repo_id, []).append(key)
+    return index
+
+def _utf8(text):
+    return text.encode('utf-8') if isinstance(text, unicode) else text
+
+def _index_cache_path(config):
+    return os.path.join(get_cache_dir(), INDEX_CACHE_DIR, hashlib.sha1(config.url).hexdigest() + '.json')
+
+def _read_index_cache(cache_path):
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    return cached if isinstance(cached, dict) else {}
+
+def _write_index_cache(cache_path, entries):
+    cache_dir = os.path.dirname(cache_path)
+    try:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, 0700)
+        (fd, tmp_path) = tempfile.mkstemp(dir=cache_dir)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.rename(tmp_path, cache_path)
+    except (IOError, OSError):
+        pass
+
+def snapshot_path(environment, label):
+    """Return a new snapshot file path under the rcm-nexus cache dir, e.g. for the staging
+       repository (label) a push is about to add to groups. Names carry the time to the
+       microsecond and the process id, so they are unique and sort by time.
+    """
+    now = time.time()
+    name = "%s-%s.%06d-%d-%s.json" % (environment, time.strftime('%Y%m%dT%H%M%S', time.localtime(now)),
+                                      int(now % 1 * 1000000), os.getpid(), label)
+    return os.path.join(get_cache_dir(), SNAPSHOT_DIR, name)
+
+def save_snapshot(path, environment, memberships, keep=SNAPSHOT_KEEP):
+    """Write memberships, {group id: ordered Group.member_list()}, to path as JSON:
+       {'environment', 'created', 'groups': {group id: [[id, name, resource URI]...]}}.
+       Then remove all but the newest keep snapshot_path() snapshots of environment in the
+       same directory.
+    """
+    snapshot = {
+        'environment': environment,
+        'created': time.time(),
+        'groups': dict((str(key), members) for (key, members) in memberships.iteritems()),
+    }
+
+    snapshot_dir = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(snapshot_dir):
+        os.makedirs(snapshot_dir, 0700)
+    (fd, tmp_path) = tempfile.mkstemp(dir=snapshot_dir)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(snapshot, f)
+    os.rename(tmp_path, path)
+    prune_snapshots(snapshot_dir, environment, keep)
+    return snapshot
+
+def prune_snapshots(snapshot_dir, environment, keep=SNAPSHOT_KEEP):
+    """Remove all but the newest keep snapshots of environment in snapshot_dir. Return the
+       removed paths.
+    """
+    name_re = re.compile(SNAPSHOT_NAME_RE % re.escape(environment))
+    # Names sort by the timestamp after the environment.
+    names = sorted(name for name in os.listdir(snapshot_dir) if name_re.match(name))
+    removed = []
+    for name in names[:max(len(names) - keep, 0)]:
+        path = os.path.join(snapshot_dir, name)
+        try:
+            os.remove(path)
+            removed.append(path)
+        except OSError:
+            pass
+    return removed
+
+def load_snapshot(path):
+    with open(path) as f:
+        snapshot = json.load(f)
+    if not isinstance(snapshot, dict) or 'environment' not in snapshot or not isinstance(snapshot.get('groups'), dict):
+        raise Exception("Invalid group snapshot: %s" % path)
+    return snapshot
+
+def restore_snapshot(session, snapshot):
+    """Put each group in snapshot (from load_snapshot()) back to its recorded membership, with
+       one PUT per group whose membership has changed since. Return [(group id, changed)...].
+    """
+    results = []
+    for (group_key, members) in sorted(snapshot['groups'].iteritems()):
+        group = load(session, group_key, ignore_missing=False)
+        members = [tuple(member) for member in members]
+        changed = group.member_list() != members
+        if changed:
+            group.set_members(members).save(session, reload=False)
+        results.append((group_key, changed))
+    return results
+
 class Group(object):
     """Convenience wrapper class around group xml document (via objectify.fromstring(..)).
        Provides methods for accessing data without knowledge of the xml document structure.
@@ -60,6 +225,7 @@ class Group(object):
             self.data.format='maven2'
             self.data.repoType = 'group'
             self.data.exposed = True
+            self._dirty = set()
     
     def exposed(self):
         exposed = self.data.exposed
@@ -70,25 +236,25 @@ class Group(object):
     
     def set_exposed(self, exposed):
         self.data.exposed = exposed
+        self._dirty.add('exposed')
         return self
     
     def _set_xml_string(self, xml):
-        self.xml = objectify.fromstring(xml)
-        self.data = self.xml.data
-        self.new=False
-        
-        #re-render to baseline using the objectify formatting engine, not whatever nexus sends back.
-        self._backup_xml = self.render()
-        return self
+        return self._set_xml_obj(objectify.fromstring(xml))
     
     def _set_xml_obj(self, xml):
         self.xml = xml
         self.data = self.xml.data
         self.new=False
         
-        self._backup_xml = self.render()
+        # Names of the settings changed since loading; rendering waits until save().
+        self._dirty = set()
         return self
     
+    def changes(self):
+        """Return the sorted names of the settings changed since this group was loaded or saved."""
+        return sorted(self._dirty)
+    
     def name(self):
         return self.data.name
     
@@ -100,6 +266,7 @@ class Group(object):
     
     def set_name(self, name):
         self.data.name = name
+        self._dirty.add('name')
         return self
     
     def append_member(self, session, repo_key):
@@ -138,12 +305,58 @@ class Group(object):
             resource_uri = "%s%s/%s" % (base_url, NAMED_GROUP_PATH.format(key=self.id()), repo_id)
 
             member.resourceURI = resource_uri
+            self._dirty.add('repositories')
             
             if session.debug:
                 print "Added member: %s" % repo_key
         
         return self
     
+    def member_list(self):
+        """Return the ordered [(id, name, resource URI)...] of this group's members."""
+        repositories = self.data.find('repositories')
+        if repositories is None:
+            return []
+        return [(m.findtext('id'), m.findtext('name'), m.findtext('resourceURI'))
+                for m in repositories.iterchildren('repo-group-member')]
+    
+    def set_members(self, members):
+        """Replace the membership of this group with members, an ordered list of (id, name, resource URI),
+           as returned by member_list(). Unlike append_member(), the repositories aren't looked up.
+        """
+        old = self.data.find('repositories')
+        repositories = etree.SubElement(self.data, 'repositories')
+        for (repo_id, name, resource_uri) in members:
+            member = etree.SubElement(repositories, 'repo-group-member')
+            member.id = repo_id
+            member.name = name
+            member.resourceURI = resource_uri
+        
+        if old is not None:
+            # Keep the element where it was.
+            self.data.replace(old, repositories)
+        self._dirty.add('repositories')
+        return self
+    
+    def reorder_members(self, scores):
+        """Order the members by descending scores[member id] (0 for members not in scores),
+           keeping the current order among members with equal scores. Only the local document
+           changes; save() applies the new order. Return True if the order changed.
+        """
+        repositories = self.data.find('repositories')
+        if repositories is None:
+            return False
+        
+        members = list(repositories.iterchildren('repo-group-member'))
+        ordered = sorted(members, key=lambda member: -scores.get(member.findtext('id'), 0))
+        if ordered == members:
+            return False
+        
+        for member in ordered:
+            repositories.append(member)
+        self._dirty.add('repositories')
+        return True
+    
     def remove_member(self, session, repo_key):
         """Remove the specified repository (key) from the membership of this group.
         """
@@ -151,6 +364,7 @@ class Group(object):
             for member in self.data.repositories["repo-group-member"]:
                 if member.id == repo_key:
                     self.data.repositories.remove(member)
+                    self._dirty.add('repositories')
             
                     if session.debug:
                         print "Removed member: %s" % repo_key
@@ -168,19 +382,27 @@ class Group(object):
         else:
             return 0
     
-    def save(self, session):
+    def save(self, session, reload=True):
         """Create (POST) or store (PUT) this group, then set self.new = False and update the embedded xml document/object tree.
+           If reload is False, keep the local document instead of parsing the server's response; that's
+           enough for callers that only save, and saves a parse of the whole group.
         """
-        xml = self.render()
-        if hasattr(self, '_backup_xml') and xml == self._backup_xml:
+        if not self.new and not self._dirty:
             if session.debug:
                 print "No changes to group: %s. Skipping save." % self.data.id
             return self
         
+        if session.debug:
+            print "Saving group: %s (changed: %s)" % (self.data.id, ', '.join(self.changes()))
+        xml = self.render(pretty_print=False)
         if self.new:
-            _response, xml = session.post(GROUPS_PATH, self.render())
+            _response, xml = session.post(GROUPS_PATH, xml)
         else:
-            _response, xml = session.put(NAMED_GROUP_PATH.format(key=self.data.id), self.render())
+            _response, xml = session.put(NAMED_GROUP_PATH.format(key=self.data.id), xml)
         
-        self._set_xml_string(xml)
+        if reload:
+            self._set_xml_string(xml)
+        else:
+            self.new = False
+            self._dirty = set()
         return self
@@ -0,0 +1,251 @@
+# Copyright (c) 2014 Red Hat, Inc..
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# Instrumentation for rcm-nexus. A Recorder collects one event per HTTP call
+# made through Session (method, path template, status, bytes on the wire,
+# bytes saved by gzip compression, latency, retries) and one event per named phase span (e.g. the zip, start, upload,
+# finish and group_update phases of nexus-push). Events are handed to
+# pluggable sinks when the recorder is flushed:
+#
+#   stderr        human-readable summary on stderr
+#   jsonl:<path>  one JSON object per event, appended to <path>
+#   prom:<path>   Prometheus textfile (for the node exporter textfile collector)
+
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+REQUEST_EVENT = 'request'
+SPAN_EVENT = 'span'
+
+# Path segments that carry an identifier, rewritten to a placeholder so that
+# per-request metrics can be aggregated by endpoint.
+PATH_TEMPLATE_RULES = [
+    (re.compile(r'^(/service/local/staging/profiles)/[^/]+'), r'\1/{profile_id}'),
+    (re.compile(r'^(/service/local/repositories)/[^/]+'), r'\1/{key}'),
+    (re.compile(r'^(/service/local/repo_groups)/[^/]+'), r'\1/{key}'),
+    (re.compile(r'^(/service/local/(?:repositories|repo_groups)/\{key\}/content)/.*'), r'\1/{path}'),
+    (re.compile(r'^(/service/local/staging/repository)/[^/]+'), r'\1/{repo_id}'),
+    (re.compile(r'^(/service/local/staging/profile_repositories)/[^/]+'), r'\1/{profile_id}'),
+]
+
+def path_template(path):
+    """Reduce a request path to its endpoint template, dropping the query string
+       and replacing repository/group/profile identifiers and content paths with placeholders.
+    """
+    path = path.split('?', 1)[0]
+    for (pattern, replacement) in PATH_TEMPLATE_RULES:
+        path = pattern.sub(replacement, path, count=1)
+    return path
+
+
+class Recorder(object):
+    """Collects request and span events, and hands them to sinks on flush()."""
+
+    def __init__(self, sinks=None):
+        self.sinks = sinks or []
+        self.events = []
+        self._lock = threading.Lock()
+        self._tags = threading.local()
+
+    def _add(self, event):
+        event['timestamp'] = time.time()
+        with self._lock:
+            self.events.append(event)
+
+    def record_request(self, method, path, status, bytes_out, bytes_in, latency, retries=0, bytes_saved=0):
+        """Record one HTTP call. bytes_out and bytes_in are body bytes as sent and received;
+           bytes_saved is how many fewer that was (in both directions) thanks to compression.
+        """
+        self._add({
+            'event': REQUEST_EVENT,
+            'method': method,
+            'path': path_template(path),
+            'status': status,
+            'bytes_out': bytes_out,
+            'bytes_in': bytes_in,
+            'latency': latency,
+            'retries': retries,
+            'bytes_saved': bytes_saved,
+        })
+
+    @contextmanager
+    def span(self, name, **attributes):
+        """Time the enclosed block as the named phase. The span is recorded even if the
+           block raises, with ok=False. The attributes dict is yielded, so the block can
+           add to it.
+        """
+        start = time.time()
+        ok = False
+        try:
+            yield attributes
+            ok = True
+        finally:
+            event = {'event': SPAN_EVENT, 'name': name, 'duration': time.time() - start, 'ok': ok}
+            event.update(getattr(self._tags, 'attributes', {}))
+            event.update(attributes)
+            self._add(event)
+
+    @contextmanager
+    def tag(self, **attributes):
+        """Add attributes (e.g. the repo being pushed) to every span this thread records in the
+           enclosed block.
+        """
+        previous = getattr(self._tags, 'attributes', {})
+        self._tags.attributes = dict(previous, **attributes)
+        try:
+            yield
+        finally:
+            self._tags.attributes = previous
+
+    def requests(self):
+        return [e for e in self.events if e['event'] == REQUEST_EVENT]
+
+    def spans(self):
+        return [e for e in self.events if e['event'] == SPAN_EVENT]
+
+    def flush(self):
+        for sink in self.sinks:
+            sink.write(self)
+
+
+class JsonLinesSink(object):
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, recorder):
+        with open(self.path, 'a') as f:
+            for event in recorder.events:
+                f.write(json.dumps(event, sort_keys=True))
+                f.write('\n')
+
+
+class StderrSummarySink(object):
+    def __init__(self, stream=None):
+        self.stream = stream
+
+    def write(self, recorder):
+        stream = self.stream or sys.stderr
+        spans = recorder.spans()
+        if spans:
+            print >>stream, "Phases:"
+            for span in spans:
+                print >>stream, "  %-20s %9.3fs%s" % (span['name'], span['duration'], '' if span['ok'] else '  (failed)')
+
+        totals = _request_totals(recorder)
+        if totals:
+            print >>stream, "HTTP requests:"
+            for (method, path) in sorted(totals.keys()):
+                t = totals[(method, path)]
+                print >>stream, "  %-6s %-55s %4d calls %9.3fs  out %d B  in %d B%s" % (
+                    method, path, t['count'], t['latency'], t['bytes_out'], t['bytes_in'],
+                    "  (gzip saved %d B)" % t['bytes_saved'] if t['bytes_saved'] else '')
+
+
+class PrometheusTextfileSink(object):
+    def __init__(self, path):
+        self.path = path
+
+    def write(self, recorder):
+        lines = [
+            '# HELP rcm_nexus_http_requests_total HTTP requests made to Nexus.',
+            '# TYPE rcm_nexus_http_requests_total counter',
+        ]
+        statuses = {}
+        for event in recorder.requests():
+            key = (event['method'], event['path'], event['status'])
+            statuses[key] = statuses.get(key, 0) + 1
+        for (method, path, status) in sorted(statuses.keys()):
+            lines.append('rcm_nexus_http_requests_total{method="%s",path="%s",status="%s"} %d' % (
+                method, _escape_label(path), status, statuses[(method, path, status)]))
+
+        totals = _request_totals(recorder)
+        for (name, field, help_text) in (
+                ('rcm_nexus_http_request_seconds_total', 'latency', 'Time spent in HTTP requests to Nexus.'),
+                ('rcm_nexus_http_retries_total', 'retries', 'HTTP request retries.'),
+                ('rcm_nexus_http_sent_bytes_total', 'bytes_out', 'Request body bytes sent to Nexus.'),
+                ('rcm_nexus_http_received_bytes_total', 'bytes_in', 'Response body bytes received from Nexus.'),
+                ('rcm_nexus_http_saved_bytes_total', 'bytes_saved', 'Body bytes saved by gzip compression.')):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s counter' % name)
+            for (method, path) in sorted(totals.keys()):
+                lines.append('%s{method="%s",path="%s"} %s' % (
+                    name, method, _escape_label(path), totals[(method, path)][field]))
+
+        # A push to several environments runs each phase once per environment, and a bulk push
+        # once per repository as well. The gauge keeps the last run of each, as the textfile
+        # collector rejects duplicate series; the counters add up all runs.
+        last_runs = {}
+        phase_totals = {}
+        for span in recorder.spans():
+            environment = span.get('environment') or ''
+            last_runs[(span['name'], environment, span.get('repo') or '')] = span['duration']
+            t = phase_totals.setdefault((span['name'], environment), {'count': 0, 'duration': 0.0})
+            t['count'] += 1
+            t['duration'] += span['duration']
+
+        lines.append('# HELP rcm_nexus_phase_seconds Duration of the last run of each phase.')
+        lines.append('# TYPE rcm_nexus_phase_seconds gauge')
+        for (phase, environment, repo) in sorted(last_runs.keys()):
+            lines.append('rcm_nexus_phase_seconds{phase="%s",environment="%s",repo="%s"} %s' % (
+                _escape_label(phase), _escape_label(environment), _escape_label(repo), last_runs[(phase, environment, repo)]))
+
+        for (name, field, help_text) in (
+                ('rcm_nexus_phase_runs_total', 'count', 'Runs of each phase.'),
+                ('rcm_nexus_phase_seconds_total', 'duration', 'Time spent in each phase, over all runs.')):
+            lines.append('# HELP %s %s' % (name, help_text))
+            lines.append('# TYPE %s counter' % name)
+            for (phase, environment) in sorted(phase_totals.keys()):
+                lines.append('%s{phase="%s",environment="%s"} %s' % (
+                    name, _escape_label(phase), _escape_label(environment), phase_totals[(phase, environment)][field]))
+
+        # Write then rename, so the node exporter never reads a partial file.
+        out_dir = os.path.dirname(os.path.abspath(self.path))
+        (fd, tmp_path) = tempfile.mkstemp(dir=out_dir, prefix='.rcm-nexus', suffix='.prom')
+        with os.fdopen(fd, 'w') as f:
+            f.write('\n'.join(lines))
+            f.write('\n')
+        os.rename(tmp_path, self.path)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _request_totals(recorder):
+    totals = {}
+    for event in recorder.requests():
+        t = totals.setdefault((event['method'], event['path']),
+                              {'count': 0, 'latency': 0.0, 'retries': 0, 'bytes_out': 0, 'bytes_in': 0, 'bytes_saved': 0})
+        t['count'] += 1
+        t['latency'] += event['latency']
+        t['retries'] += event['retries']
+        t['bytes_out'] += event['bytes_out']
+        t['bytes_in'] += event['bytes_in']
+        t['bytes_saved'] += event['bytes_saved']
+    return totals
+
+def sink_from_spec(spec):
+    """Build a sink from a CLI spec: 'stderr', 'jsonl:<path>' or 'prom:<path>'."""
+    if spec == 'stderr':
+        return StderrSummarySink()
+
+    kind, _, path = spec.partition(':')
+    if not path:
+        raise Exception("Invalid metrics sink: '%s' (expected stderr, jsonl:<path> or prom:<path>)" % spec)
+    if kind == 'jsonl':
+        return JsonLinesSink(path)
+    elif kind == 'prom':
+        return PrometheusTextfileSink(path)
+    else:
+        raise Exception("Invalid metrics sink: '%s' (expected stderr, jsonl:<path> or prom:<path>)" % spec)
+
+def sinks_from_specs(specs):
+    return [sink_from_spec(spec) for spec in specs or []]
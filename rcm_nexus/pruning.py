@@ -0,0 +1,63 @@
+# Copyright (c) 2014 Red Hat, Inc..
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# Pruning of stale staging repositories: ones that aren't a member of any
+# group, and were created more than a given number of days ago. Deletions
+# run with bounded concurrency, and can be throttled to a request rate.
+
+from rcm_nexus.workers import (imap_unordered, RateLimiter)
+import rcm_nexus.group as groups
+import rcm_nexus.repo as repos
+import rcm_nexus.staging as staging
+import time
+
+DELETE_WORKERS = 4
+# Deletions per second.
+DELETE_RATE = 5.0
+
+DAY = 24 * 60 * 60
+
+def find_orphans(session, max_age_days, name_pattern=None, max_workers=groups.INDEX_WORKERS, now=None):
+    """Return [(repository id, name, created time)...], oldest first, for the staging repositories
+       (whose names match name_pattern, if given; see repo.load_all()) that aren't a member of any
+       group and were created more than max_age_days ago. Repositories that aren't staging
+       repositories, or whose creation time is unknown, are never returned.
+    """
+    staged = staging.list_staged_repos(session)
+    index = groups.load_index(session, max_workers=max_workers)
+    cutoff = (now or time.time()) - max_age_days * DAY
+
+    orphans = []
+    for repository in repos.load_all(session, name_pattern):
+        repo_id = repository.id()
+        if repo_id not in staged or repo_id in index:
+            continue
+
+        created = staged[repo_id][1]
+        if created is None:
+            continue
+
+        # Nexus timestamps are in milliseconds.
+        created = created / 1000.0
+        if created < cutoff:
+            orphans.append((repo_id, repository.name(), created))
+
+    return sorted(orphans, key=lambda orphan: orphan[2])
+
+def delete_repos(session, repo_ids, max_workers=DELETE_WORKERS, rate=DELETE_RATE):
+    """Delete repo_ids on up to max_workers threads, starting no more than rate deletions per
+       second (None for no limit). Yield (repository id, error) as deletions complete; error
+       is None on success, or the exc_info tuple of the failure.
+    """
+    rate_limiter = RateLimiter(rate) if rate else None
+
+    def delete(repo_id):
+        if rate_limiter is not None:
+            rate_limiter.consume(1)
+        repos.delete(session, repo_id)
+
+    for (repo_id, _result, error) in imap_unordered(delete, repo_ids, max_workers):
+        yield (repo_id, error)
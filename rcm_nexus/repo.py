@@ -27,8 +27,28 @@ REPOS_PATH = '/service/local/repositories'
 NAMED_REPO_PATH = REPOS_PATH + '/{key}'
 COMPRESSED_CONTENT_PATH = NAMED_REPO_PATH + "/content-compressed{delete}"
 
-def push_zip(session, repo_key, zip_file, delete_first=False):
-    with open(zip_file, 'r') as f:
+class _ThrottledReader(object):
+    """File wrapper that charges every read against a workers.RateLimiter."""
+
+    def __init__(self, f, rate_limiter):
+        self._f = f
+        self._rate_limiter = rate_limiter
+        self._remaining = os.fstat(f.fileno()).st_size - f.tell()
+
+    def __len__(self):
+        return self._remaining
+
+    def read(self, size=-1):
+        data = self._f.read(size)
+        self._remaining -= len(data)
+        self._rate_limiter.consume(len(data))
+        return data
+
+def push_zip(session, repo_key, zip_file, delete_first=False, rate_limiter=None):
+    """Upload zip_file into the repository. If a workers.RateLimiter is given, the upload
+       is throttled by it (it can be shared to cap the combined rate of several uploads).
+    """
+    with open(zip_file, 'rb') as f:
         delete_param = ''
         if delete_first:
             delete_param = '?delete=true'
@@ -36,7 +56,9 @@ def push_zip(session, repo_key, zip_file, delete_first=False):
         url = COMPRESSED_CONTENT_PATH.format(key=repo_key, delete=delete_param)
         if session.debug is True:
             print "POSTing: %s" % url
-        session.post(url, f, expect_status=201)
+
+        body = f if rate_limiter is None else _ThrottledReader(f, rate_limiter)
+        session.post(url, body, expect_status=201)
 
 def repo_exists(session, repo_key):
     return session.exists( NAMED_REPO_PATH.format(key=repo_key) )
@@ -53,7 +75,7 @@ def load(session, key, ignore_missing=True):
 def load_all(session, name_pattern=None):
     response, xml = session.get(REPOS_PATH)
     
-    doc = etree.fromstring(xml)
+    doc = objectify.fromstring(xml)
     name_re = None
     if name_pattern is not None:
         name_re = re.compile(name_pattern)
@@ -84,14 +106,14 @@ def load_all(session, name_pattern=None):
             else:
                 rid = rid[0]
             
+            # Move the item into its own <repository/> document, rather than serializing and
+            # re-parsing it.
             child.tag = 'data'
-            r = etree.Element('repository')
-            r.insert(0,child)
-            child = r
+            r = objectify.Element('repository')
+            r.append(child)
             
-            doc = objectify.fromstring(etree.tostring(child))
             # repos.append(Repository(rid, name)._set_xml_obj(doc))
-            repos.append(Repository(doc))
+            repos.append(Repository(r))
             
             if session.debug is True:
                 print "+ %s" % name
@@ -138,6 +160,7 @@ class Repository(object):
             self.data.providerRole='org.sonatype.nexus.proxy.repository.Repository'
             self.data.checksumPolicy = CHECKSUM_POLICIES.warn
             self.data.repoPolicy = REPO_POLICIES.release
+            self._dirty = set()
 
     def __str__(self):
         return "Repository: %s" % self.data.id
@@ -146,23 +169,24 @@ class Repository(object):
         return self.__str__();
     
     def _set_xml_string(self, xml):
-        self.xml = objectify.fromstring(xml)
-        self.data = self.xml.data
-        self.new = False
-        
-        self._backup_xml = self.render()
-        return self
+        return self._set_xml_obj(objectify.fromstring(xml))
     
     def _set_xml_obj(self, xml_obj):
         self.xml = xml_obj
         self.data = self.xml.data
         self.new = False
         
-        self._backup_xml = self.render()
+        # Names of the settings changed since loading; rendering waits until save().
+        self._dirty = set()
         return self
+    
+    def changes(self):
+        """Return the sorted names of the settings changed since this repository was loaded or saved."""
+        return sorted(self._dirty)
         
     def set_hosted(self, storage_location=None):
         self.data.repoType = REPO_TYPES.hosted
+        self._dirty.add('repoType')
         
         if hasattr(self.data, 'remoteStorage'):
             self.data.remove(self.data.remoteStorage)
@@ -173,6 +197,7 @@ class Repository(object):
                 value = "file:" + value
             
             self.data.overrideLocalStorageUrl = value
+            self._dirty.add('overrideLocalStorageUrl')
 
         return self
     
@@ -182,6 +207,7 @@ class Repository(object):
             
         self.set('remoteStorage/remoteStorageUrl', url)
         self.data.repoType = REPO_TYPES.remote
+        self._dirty.add('repoType')
         
         if hasattr(self.data, 'overrideLocalStorageUrl'):
             self.data.remove(self.data.overrideLocalStorageUrl)
@@ -190,18 +216,22 @@ class Repository(object):
     
     def set_exposed(self, exposed):
         self.data.exposed = exposed
+        self._dirty.add('exposed')
         return self
     
     def set_browseable(self, browse):
         self.data.browseable = browse
+        self._dirty.add('browseable')
         return self
     
     def set_indexable(self, index):
         self.data.indexable = index
+        self._dirty.add('indexable')
         return self
     
     def set_download_remote_indexes(self, download):
         self.data.downloadRemoteIndexes = download
+        self._dirty.add('downloadRemoteIndexes')
         return self
     
     def set_write_policy(self, policy):
@@ -209,6 +239,7 @@ class Repository(object):
             raise Exception("Invalid writePolicy: %s" % policy)
         
         self.data.writePolicy = policy
+        self._dirty.add('writePolicy')
         return self
     
     def set_repo_policy(self, policy):
@@ -216,6 +247,7 @@ class Repository(object):
             raise Exception("Invalid repoPolicy: %s" % policy)
         
         self.data.repoPolicy = policy
+        self._dirty.add('repoPolicy')
         return self
     
     def set_checksum_policy(self, policy):
@@ -223,10 +255,12 @@ class Repository(object):
             raise Exception("Invalid checksumPolicy: %s" % policy)
         
         self.data.checksumPolicy = policy
+        self._dirty.add('checksumPolicy')
         return self
     
     def set_nfc_ttl(self, ttl=1440):
         self.data.notFoundCacheTTL = str(ttl)
+        self._dirty.add('notFoundCacheTTL')
         return self
     
     def set(self, path, value=None):
@@ -244,6 +278,7 @@ class Repository(object):
         if value is not None:
             element._setText(value)
         
+        self._dirty.add(path.strip('/').split('/')[0])
         return self
     
     def render(self, pretty_print=True):
@@ -276,23 +311,23 @@ class Repository(object):
            If storage_base is used, then the override storage location will be specified
            to direct Nexus to use a custom location for storing artifacts.
         """
-        xml = self.render()
-        if hasattr(self, '_backup_xml') and xml == self._backup_xml:
+        if not self.new and not self._dirty:
             if session.debug:
                 print "No changes to repository: %s. Skipping save." % self.data.id
             return self
         
+        xml = self.render()
         if self.new:
             if session.debug:
                 print "Saving to: %s\n\n%s\n\n" % (REPOS_PATH, xml)
                 
-            _response, xml = session.post(REPOS_PATH, self.render())
+            _response, xml = session.post(REPOS_PATH, xml)
         else:
             path = NAMED_REPO_PATH.format(key=self.data.id)
             if session.debug:
-                print "Saving to: %s\n\n%s\n\n" % (path, xml)
+                print "Saving to: %s (changed: %s)\n\n%s\n\n" % (path, ', '.join(self.changes()), xml)
                 
-            _response, xml = session.put(path, self.render())
+            _response, xml = session.put(path, xml)
         
         self._set_xml_string(xml)
         return self
@@ -15,10 +15,13 @@
 
 import os
 import sys
+import time
 import requests
+from rcm_nexus.workers import imap_unordered
 import shutil
 import getpass
 import base64
+import zlib
 
 class Enum(object):
     def __init__(self, **kwargs):
@@ -44,15 +47,33 @@ class Enum(object):
 def python_boolean(value):
     return True if str(value) in ('True', 'true') else False
 
+DEFAULT_POOL_SIZE = 10
+
+# Request bodies smaller than this aren't worth compressing.
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 6
+
 class Session(object):
 #     USER_AGENT = 'curl/7.19.7 (x86_64-redhat-linux-gnu) libcurl/7.19.7 NSS/3.14.3.0 zlib/1.2.3 libidn/1.18 libssh2/1.4.2'
     
-    def __init__(self, config, debug=False):
+    def __init__(self, config, debug=False, recorder=None, pool_size=DEFAULT_POOL_SIZE):
         """Initialize the session, containing the environment config and default HTTP headers.
            Set default headers to accept = application/xml and content-type = application/xml
+           If a metrics.Recorder is given, every request is recorded to it.
+
+           Connections are kept alive and pooled (up to pool_size per host), so a Session
+           can be shared by several threads issuing requests concurrently.
         """
         self.config = config
         self.debug = debug
+        self.recorder = recorder
+        self.pool_size = pool_size
+        self.gzip_requests = getattr(config, 'gzip_requests', False)
+
+        self._http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self._http.mount('http://', adapter)
+        self._http.mount('https://', adapter)
 
         if config.username is not None:
             self.auth = requests.auth.HTTPBasicAuth(config.username, config.get_password())
@@ -61,12 +82,14 @@ class Session(object):
 
         self.headers = {
             'Accept': 'application/xml',
+            'Accept-Encoding': 'gzip',
             'Content-Type': 'application/xml',
 #             'User-Agent': Session.USER_AGENT,
         }
 
     def close(self):
-        """Currently a no-op"""
+        """Close any pooled connections."""
+        self._http.close()
     
     def _combine_headers(self, headers=None, existing_headers=None):
         """In the event headers are supplied with a method call, merge those with the default
@@ -84,6 +107,71 @@ class Session(object):
             
         return result
     
+    def _request_size(self, body):
+        if body is None or self.recorder is None:
+            return 0
+        return requests.utils.super_len(body)
+
+    def _encode_body(self, body, headers):
+        """If gzip_requests is set, gzip a large in-memory request body. Return the body
+           to send, its headers and the number of bytes saved.
+        """
+        if not self.gzip_requests or not isinstance(body, basestring) or len(body) < GZIP_MIN_SIZE \
+                or 'Content-Encoding' in headers:
+            return (body, headers, 0)
+
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compressed = compressor.compress(body) + compressor.flush()
+        if len(compressed) >= len(body):
+            return (body, headers, 0)
+
+        headers = dict(headers)
+        headers['Content-Encoding'] = 'gzip'
+        return (compressed, headers, len(body) - len(compressed))
+
+    def _send(self, method, path, uri, body, headers):
+        """Send a request with a body, gzipped if possible. A server that rejects the gzipped
+           body (415 Unsupported Media Type) is sent it again as-is, and gzip_requests is
+           turned off for the rest of the session.
+        """
+        (data, h, saved) = self._encode_body(body, headers)
+        bytes_out = self._request_size(data)
+        started = time.time()
+        response = self._http.request(method, uri, data=data, headers=h, verify=self.config.ssl_verify, auth=self.auth)
+        self._record(method, path, bytes_out, response, started, saved)
+
+        if saved and response.status_code == 415:
+            if self.debug:
+                print "%s %s: gzipped body rejected, sending it uncompressed" % (method, path)
+            self.gzip_requests = False
+            bytes_out = self._request_size(body)
+            started = time.time()
+            response = self._http.request(method, uri, data=body, headers=headers, verify=self.config.ssl_verify, auth=self.auth)
+            self._record(method, path, bytes_out, response, started)
+        return response
+
+    def _record(self, method, path, bytes_out, response, started, bytes_saved=0):
+        """Record a completed request with the metrics recorder, if there is one. Response
+           sizes are as received: for a gzipped response, the compressed size.
+        """
+        if self.recorder is not None:
+            bytes_in = size = len(response.content)
+            if response.headers.get('Content-Encoding', '').lower() == 'gzip':
+                try:
+                    bytes_in = response.raw.tell()
+                except (AttributeError, IOError):
+                    bytes_in = int(response.headers.get('Content-Length', size))
+            self.recorder.record_request(method, path, response.status_code, bytes_out, bytes_in,
+                                         time.time() - started, bytes_saved=bytes_saved + size - bytes_in)
+
+    def _expected(self, response, expect_status):
+        """expect_status may be a single status, or a tuple of acceptable ones (e.g. (200, 304))."""
+        if isinstance(expect_status, tuple):
+            return response.status_code in expect_status
+        return response.status_code == expect_status
+
     def exists(self, path, fail=True):
         response,_content = self.head(path, ignore_404=True, fail=False)
         
@@ -99,6 +187,23 @@ class Session(object):
                 print msg
             return False
         
+    def exists_many(self, paths, max_workers=None, stop_on_missing=False):
+        """Check whether each of paths exists, with HEAD requests issued on up to max_workers
+           threads (default: the connection pool size). Yield (path, exists) pairs as the
+           checks complete. If stop_on_missing is True, stop after the first missing path.
+           An unexpected response status raises an Exception.
+        """
+        results = imap_unordered(self.exists, paths, max_workers or self.pool_size)
+        try:
+            for (path, exists, error) in results:
+                if error is not None:
+                    raise error[0], error[1], error[2]
+                yield (path, exists)
+                if stop_on_missing and not exists:
+                    break
+        finally:
+            results.close()
+
     def head(self, path, headers=None, expect_status=200, ignore_404=False, fail=True):
         uri = self.config.url + path
         
@@ -109,12 +214,14 @@ class Session(object):
         if self.debug:
             print "HEAD %s\n%s" % (uri,h)
             
-        response = requests.head(uri, headers=h, verify=self.config.ssl_verify, auth=self.auth)
+        started = time.time()
+        response = self._http.head(uri, headers=h, verify=self.config.ssl_verify, auth=self.auth)
+        self._record('HEAD', path, 0, response, started)
         
         if self.debug:
             print "Response data:\n %s\n" % response
             
-        if response.status_code == expect_status:
+        if self._expected(response, expect_status):
             return (response,response.text)
         elif ignore_404 and response.status_code == 404:
             return (response,response.text)
@@ -128,7 +235,7 @@ class Session(object):
         
     def get(self, path, headers=None, expect_status=200, ignore_404=False, fail=True):
         """Issue a GET request to the Nexus server, on the given path. Expect a response status of 200, 
-           unless specified by expect_status. Fail if 404 response is given, unless ignore_404 is specified.
+           unless specified by expect_status (a status, or a tuple of statuses). Fail if 404 response is given, unless ignore_404 is specified.
            Fail any unexpected, non-404 response, unless fail is specified differently.
            
            Return requests.Response
@@ -139,12 +246,14 @@ class Session(object):
         if self.debug:
             print "GET %s\n%s" % (uri,h)
             
-        response = requests.get(uri, headers=h, verify=self.config.ssl_verify, auth=self.auth)
+        started = time.time()
+        response = self._http.get(uri, headers=h, verify=self.config.ssl_verify, auth=self.auth)
+        self._record('GET', path, 0, response, started)
         
         if self.debug:
             print "Response data:\n %s\n\nBody:\n%s" % (response, response.text)
             
-        if response.status_code == expect_status:
+        if self._expected(response, expect_status):
             return (response,response.text)
         elif ignore_404 and response.status_code == 404:
             return (response,response.text)
@@ -170,12 +279,14 @@ class Session(object):
         if self.debug:
             print "DELETE %s\n%s" % (uri,h)
             
-        response = requests.delete(uri, headers=h, verify=self.config.ssl_verify, auth=self.auth)
+        started = time.time()
+        response = self._http.delete(uri, headers=h, verify=self.config.ssl_verify, auth=self.auth)
+        self._record('DELETE', path, 0, response, started)
         
         if self.debug:
             print "Response data:\n %s\n" % response
             
-        if response.status_code == expect_status:
+        if self._expected(response, expect_status):
             return (response,response.text)
         elif ignore_404 and response.status_code == 404:
             return (response,response.text)
@@ -201,12 +312,12 @@ class Session(object):
             print "POST %s\n%s" % (uri,h)
             print "Request body:\n", body
             
-        response = requests.post(uri, data=body, headers=h, verify=self.config.ssl_verify, auth=self.auth)
+        response = self._send('POST', path, uri, body, h)
         
         if self.debug:
             print "Response data:\n %s\n\nBody:\n%s\n" % (response, response.text)
             
-        if response.status_code == expect_status:
+        if self._expected(response, expect_status):
             return (response,response.text)
         elif ignore_404 and response.status_code == 404:
             return (response,response.text)
@@ -232,12 +343,12 @@ class Session(object):
             print "PUT %s\n%s" % (uri,h)
             print "Request body:\n", body
             
-        response = requests.put(uri, data=body, headers=h, verify=self.config.ssl_verify, auth=self.auth)
+        response = self._send('PUT', path, uri, body, h)
         
         if self.debug:
             print "Response data:\n %s\n\nBody:\n%s\n" % (response, response.text)
             
-        if response.status_code == expect_status:
+        if self._expected(response, expect_status):
             return (response,response.text)
         elif ignore_404 and response.status_code == 404:
             return (response,response.text)
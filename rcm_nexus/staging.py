@@ -1,40 +1,210 @@
 from lxml import (objectify,etree)
+from xml.sax.saxutils import escape
 import rcm_nexus.repo as repo
+import json
+import time
+import re
 
 STAGE_START_FORMAT = '/service/local/staging/profiles/{profile_id}/start'
 STAGE_FINISH_FORMAT = '/service/local/staging/profiles/{profile_id}/finish'
+STAGED_REPO_FORMAT = '/service/local/staging/repository/{repo_id}'
+STAGED_REPO_ACTIVITY_FORMAT = STAGED_REPO_FORMAT + '/activity'
+PROFILE_REPOS_PATH = '/service/local/staging/profile_repositories'
+PROFILE_REPOS_FORMAT = PROFILE_REPOS_PATH + '/{profile_id}'
 
-def _get_staging_description(product, version, is_ga):
-    return "%s, ver %s (to %s)" % (product, version, "GA" if is_ga else "Early-Access") 
+# Content fingerprints (see archive.fingerprint()) are recorded at the end of the staging description.
+FINGERPRINT_FORMAT = ' [content: %s]'
+FINGERPRINT_RE = re.compile(r' \[content: ([0-9a-f]+)\]$')
 
-def start_staging_repo(session, config, product, version, is_ga):
+# Staging repositories whose content is complete and verified, and so can be reused by a dedup push.
+REUSABLE_STATES = ('closed', 'released')
+
+CLOSE_TIMEOUT = 600
+POLL_INITIAL_DELAY = 1.0
+POLL_MAX_DELAY = 30.0
+POLL_BACKOFF = 1.5
+
+# Activity events that mean the close was rejected, and the property holding the reason.
+CLOSE_FAILURE_EVENTS = {
+    'ruleFailed': 'failureMessage',
+    'repositoryCloseFailed': 'cause',
+}
+
+XML_FORMAT = 'xml'
+JSON_FORMAT = 'json'
+
+# promoteRequest bodies are tiny and fixed in shape, so they're rendered from a string
+# template instead of building (and pretty-printing) an element tree on every call.
+PROMOTE_REQUEST_XML = "<?xml version='1.0' encoding='UTF-8'?>\n<promoteRequest><data>%s</data></promoteRequest>"
+PROMOTE_REQUEST_FIELD_XML = "<%(name)s>%(value)s</%(name)s>"
+JSON_HEADERS = {'Accept': 'application/json', 'Content-Type': 'application/json'}
+
+STAGED_REPO_ID_XPATH = etree.XPath('/promoteRequest/data/stagedRepositoryId/text()')
+
+class StagingFailure(Exception):
+    """Raised when a staging repository fails to close. failures lists the reasons
+       Nexus reported (e.g. staging rule failure messages).
+    """
+    def __init__(self, repo_id, failures):
+        Exception.__init__(self, "Staging repository %s failed to close:\n  %s" % (repo_id, '\n  '.join(failures)))
+        self.repo_id = repo_id
+        self.failures = failures
+
+def _get_staging_description(product, version, is_ga, fingerprint=None):
+    description = "%s, ver %s (to %s)" % (product, version, "GA" if is_ga else "Early-Access")
+    if fingerprint is not None:
+        description += FINGERPRINT_FORMAT % fingerprint
+    return description
+
+def encode_promote_request(description, repo_id=None, fmt=XML_FORMAT):
+    """Render a promoteRequest body carrying the description and, optionally, the staged
+       repository id, as compact XML or (fmt='json') JSON.
+    """
+    fields = [('description', description)]
+    if repo_id is not None:
+        fields.append(('stagedRepositoryId', repo_id))
+
+    if fmt == JSON_FORMAT:
+        return json.dumps({'data': dict(fields)})
+
+    data = ''.join(PROMOTE_REQUEST_FIELD_XML % {'name': name, 'value': escape(value)} for (name, value) in fields)
+    xml = PROMOTE_REQUEST_XML % data
+    if isinstance(xml, unicode):
+        xml = xml.encode('utf-8')
+    return xml
+
+def decode_staged_repo_id(text, fmt=XML_FORMAT):
+    """Extract the stagedRepositoryId from a promoteRequest response body."""
+    if fmt == JSON_FORMAT:
+        return json.loads(text)['data']['stagedRepositoryId']
+
+    repo_id = STAGED_REPO_ID_XPATH(_parse_xml(text))
+    return repo_id[0]
+
+def _parse_xml(text):
+    # lxml refuses unicode input that carries an encoding declaration.
+    return etree.fromstring(text.encode('utf-8') if isinstance(text, unicode) else text)
+
+def _post_promote_request(session, config, path, description, repo_id=None):
+    fmt = config.staging_format
+    headers = JSON_HEADERS if fmt == JSON_FORMAT else None
+    return session.post(path, encode_promote_request(description, repo_id, fmt), headers=headers)
+
+def start_staging_repo(session, config, product, version, is_ga, fingerprint=None):
     profile_id = config.get_profile_id( product, is_ga )
 
     path = STAGE_START_FORMAT.format(profile_id=profile_id)
-    request_data = etree.Element('promoteRequest')
-    data = etree.SubElement( request_data, 'data')
-    etree.SubElement(data, 'description').text=_get_staging_description(product, version, is_ga)
-
-    xml = etree.tostring( request_data, xml_declaration=True, pretty_print=True, encoding='UTF-8')
-    (response,text) = session.post(path, xml)
+    description = _get_staging_description(product, version, is_ga, fingerprint)
+    (response,text) = _post_promote_request(session, config, path, description)
 
     # TODO: Error handling!
 
-    repo_id = etree.fromstring(text).xpath('/promoteRequest/data/stagedRepositoryId/text()')
-    return repo_id[0]
+    return decode_staged_repo_id(text, config.staging_format)
 
-def finish_staging_repo(session, config, repo_id, product, version, is_ga):
+def finish_staging_repo(session, config, repo_id, product, version, is_ga, fingerprint=None):
     profile_id = config.get_profile_id( product, is_ga )
 
     path = STAGE_FINISH_FORMAT.format(profile_id=profile_id)
-    request_data = etree.Element('promoteRequest')
-    data = etree.SubElement( request_data, 'data')
-    etree.SubElement(data, 'description').text=_get_staging_description(product, version, is_ga)
-    etree.SubElement(data, 'stagedRepositoryId').text=repo_id
-
-    xml = etree.tostring( request_data, xml_declaration=True, pretty_print=True, encoding='UTF-8')
-    (response,text) = session.post(path, xml)
+    description = _get_staging_description(product, version, is_ga, fingerprint)
+    (response,text) = _post_promote_request(session, config, path, description, repo_id)
 
     # TODO: Error handling!
-    # FIXME: Handle verification failure!
+    # NOTE: Nexus closes the repository asynchronously; use wait_for_close() to
+    # find out whether it passed verification.
+
+def list_staged_repos(session, profile_id=None):
+    """Return {repository id: (type, created timestamp in ms, description)} for the staging
+       repositories of profile_id, or of every staging profile if profile_id is None. The
+       created timestamp is None if Nexus didn't report one.
+    """
+    path = PROFILE_REPOS_PATH if profile_id is None else PROFILE_REPOS_FORMAT.format(profile_id=profile_id)
+    response, text = session.get(path)
+    doc = _parse_xml(text)
+
+    staged = {}
+    for item in doc.iter('stagingProfileRepository'):
+        created = item.findtext('createdTimestamp')
+        staged[item.findtext('repositoryId')] = (item.findtext('type'), int(created) if created else None,
+                                                 item.findtext('description') or '')
+    return staged
+
+def find_staged_repo(session, config, product, is_ga, fingerprint):
+    """Return the id of the most recently created closed (or released) staging repository in
+       the product's staging profile whose description carries the given content fingerprint,
+       or None if there isn't one.
+    """
+    profile_id = config.get_profile_id( product, is_ga )
+
+    candidates = []
+    for (repo_id, (repo_type, created, description)) in list_staged_repos(session, profile_id).iteritems():
+        if repo_type not in REUSABLE_STATES:
+            continue
+        match = FINGERPRINT_RE.search(description)
+        if match and match.group(1) == fingerprint:
+            candidates.append((created, repo_id))
+
+    if not candidates:
+        return None
+    return max(candidates)[1]
+
+def get_staging_state(session, repo_id):
+    """Return (type, transitioning) for the staging repository, e.g. ('open', True)."""
+    response, text = session.get(STAGED_REPO_FORMAT.format(repo_id=repo_id))
+    doc = _parse_xml(text)
+    repo_type = doc.findtext('type')
+    transitioning = doc.findtext('transitioning') == 'true'
+    return (repo_type, transitioning)
+
+def get_close_failures(session, repo_id):
+    """Return the failure reasons recorded in the most recent 'close' activity of the staging
+       repository, or an empty list if the close didn't fail (or hasn't happened yet).
+    """
+    response, text = session.get(STAGED_REPO_ACTIVITY_FORMAT.format(repo_id=repo_id))
+    doc = _parse_xml(text)
+
+    activities = [a for a in doc.iter('stagingActivity') if a.findtext('name') == 'close']
+    if not activities:
+        return []
+
+    failures = []
+    for event in activities[-1].iter('stagingActivityEvent'):
+        prop_name = CLOSE_FAILURE_EVENTS.get(event.findtext('name'))
+        if prop_name is None:
+            continue
+        reasons = [p.findtext('value') for p in event.iter('stagingProperty') if p.findtext('name') == prop_name]
+        failures.extend(reasons or [event.findtext('name')])
+    return failures
+
+def wait_for_close(session, repo_id, timeout=CLOSE_TIMEOUT, initial_delay=POLL_INITIAL_DELAY,
+                   max_delay=POLL_MAX_DELAY, backoff=POLL_BACKOFF, sleep=time.sleep):
+    """Poll the staging repository after finish_staging_repo() until Nexus has closed it.
+       The delay between polls starts at initial_delay and grows by backoff up to max_delay,
+       so quick closes are noticed quickly without hammering the server on slow ones.
+
+       Return the number of seconds the close took. Raise StagingFailure if Nexus rejected
+       the close (e.g. a staging rule failed), or Exception on timeout.
+    """
+    start = time.time()
+    delay = initial_delay
+    while True:
+        (repo_type, transitioning) = get_staging_state(session, repo_id)
+        if session.debug:
+            print "Staging repository %s: %s%s" % (repo_id, repo_type, ' (transitioning)' if transitioning else '')
+
+        if not transitioning:
+            if repo_type in ('closed', 'released'):
+                return time.time() - start
+
+            # A failed close leaves the repository open; an open repository with no failed
+            # close activity just hasn't started closing yet.
+            failures = get_close_failures(session, repo_id)
+            if failures:
+                raise StagingFailure(repo_id, failures)
+
+        remaining = timeout - (time.time() - start)
+        if remaining <= 0:
+            raise Exception("Timed out after %ds waiting for staging repository %s to close" % (timeout, repo_id))
+
+        sleep(min(delay, remaining))
+        delay = min(delay * backoff, max_delay)
 
@@ -0,0 +1,133 @@
+# Copyright (c) 2014 Red Hat, Inc..
+# All rights reserved. This program and the accompanying materials
+# are made available under the terms of the GNU Public License v3.0
+# which accompanies this distribution, and is available at
+# http://www.gnu.org/licenses/gpl.html
+#
+# Minimal thread-pool helpers for running Nexus requests concurrently. These
+# are plain threads (the work is I/O bound), with no dependency on the
+# 'futures' backport.
+
+import sys
+import threading
+import time
+import Queue
+
+DEFAULT_MAX_WORKERS = 8
+
+_DONE = object()
+
+def imap_unordered(func, items, max_workers=DEFAULT_MAX_WORKERS):
+    """Call func(item) for each item on up to max_workers threads, yielding
+       (item, result, error) tuples as calls complete. error is None on success,
+       or the exc_info tuple of the exception func raised.
+
+       Closing the generator early (e.g. breaking out of the loop) stops
+       handing out further items, and waits for calls already running to finish,
+       so none is still making requests after the caller has moved on.
+    """
+    items = iter(items)
+    results = Queue.Queue()
+    lock = threading.Lock()
+    stopped = threading.Event()
+
+    def next_item():
+        with lock:
+            if stopped.is_set():
+                return _DONE
+            return next(items, _DONE)
+
+    def work():
+        try:
+            while True:
+                item = next_item()
+                if item is _DONE:
+                    break
+                try:
+                    results.put((item, func(item), None))
+                except Exception:
+                    results.put((item, None, sys.exc_info()))
+        finally:
+            results.put(_DONE)
+
+    threads = [threading.Thread(target=work) for i in range(max(1, max_workers))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+
+    running = len(threads)
+    try:
+        while running > 0:
+            result = results.get()
+            if result is _DONE:
+                running -= 1
+            else:
+                yield result
+    finally:
+        stopped.set()
+        for t in threads:
+            t.join()
+
+def imap(func, items, max_workers=DEFAULT_MAX_WORKERS, window=None):
+    """Like imap_unordered(), but yield (item, result, error) tuples in the order of items.
+       At most window calls (default: twice max_workers) are in progress or waiting to be
+       yielded at any time, so a slow consumer doesn't cause results to pile up in memory.
+    """
+    window = window or 2 * max(1, max_workers)
+    slots = threading.Semaphore(window)
+    closing = threading.Event()
+
+    def numbered():
+        for numbered_item in enumerate(items):
+            slots.acquire()
+            if closing.is_set():
+                return
+            yield numbered_item
+
+    pending = {}
+    next_index = 0
+    results = imap_unordered(lambda n: func(n[1]), numbered(), max_workers)
+    try:
+        for ((i, item), result, error) in results:
+            pending[i] = (item, result, error)
+            while next_index in pending:
+                yield pending.pop(next_index)
+                slots.release()
+                next_index += 1
+    finally:
+        # Unblock any worker still waiting for a slot, so it can see the stop and exit, before
+        # waiting for the workers.
+        closing.set()
+        for i in range(window):
+            slots.release()
+        results.close()
+
+
+class RateLimiter(object):
+    """Token bucket shared by any number of threads, e.g. to cap the combined upload
+       rate of concurrent pushes. rate is in units (bytes) per second; burst is the
+       most that can be consumed at once without waiting (default: one second's worth).
+    """
+
+    def __init__(self, rate, burst=None, clock=time.time, sleep=time.sleep):
+        self.rate = float(rate)
+        self.burst = float(burst or rate)
+        self._tokens = self.burst
+        self._clock = clock
+        self._sleep = sleep
+        self._updated = clock()
+        self._lock = threading.Lock()
+
+    def consume(self, amount):
+        """Block until amount units may be consumed. Amounts larger than the burst are
+           allowed; they simply leave the bucket in debt for the next caller.
+        """
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= amount
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+
+        if wait > 0:
+            self._sleep(wait)
@@ -25,6 +25,8 @@ test_deps=[
 extras = {
   'test':test_deps,
   'build':['tox'],
+  'keyring':['keyring'],
+  'scandir':['scandir'],
   'ci':['coverage']
 }
 
@@ -63,6 +65,11 @@ setup(
         'nexus-push = rcm_nexus:push',
         'nexus-rollback = rcm_nexus:rollback',
         'nexus-init = rcm_nexus:init',
+        'nexus-bulk-push = rcm_nexus:bulk_push',
+        'nexus-diff = rcm_nexus:diff',
+        'nexus-reorder = rcm_nexus:reorder',
+        'nexus-groups = rcm_nexus:group_index',
+        'nexus-prune = rcm_nexus:prune',
       ],
     }
 )
@@ -1,4 +1,9 @@
 import rcm_nexus
+# rcm_nexus no longer imports its submodules eagerly; tests refer to them as rcm_nexus.<module>.
+import rcm_nexus.session
+import rcm_nexus.repo
+import rcm_nexus.group
+import rcm_nexus.staging
 import traceback
 import os
 import tempfile
@@ -35,8 +40,11 @@ class NexupBaseTest(unittest.TestCase):
         os.environ.pop(config.RCM_NEXUS_YAML, None)
         os.environ.pop('XDG_CONFIG_HOME', None)
         os.environ.pop('XDG_CONFIG_DIRS', None)
+        os.environ.pop('XDG_CACHE_HOME', None)
 
     def tearDown(self):
+        config.clear_password_cache()
+        config.clear_yaml_cache()
         shutil.rmtree(self.tempdir, ignore_errors=True)
         os.environ = self.old_environ
 
@@ -61,7 +69,8 @@ class NexupBaseTest(unittest.TestCase):
     def write_dir(self, srcdir, paths, content=None):
         for fname in paths:
             path = os.path.join(srcdir, fname)
-            os.makedirs(os.path.dirname(path))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
             with open(path, 'w') as f:
                 if content is None:
                     for i in range(randint(1,10)):
@@ -4,6 +4,7 @@ import tempfile
 import os
 from random import randint
 import zipfile
+import hashlib
 
 class ArchiveZipest(NexupBaseTest):
 
@@ -88,3 +89,160 @@ class ArchiveZipest(NexupBaseTest):
 			for info in zf.infolist():
 				print "%s contains: %s" % (z, info.filename)
 				self.assertEqual(info.filename in paths, True)
+
+	def test_fingerprint(self):
+		self.load_words()
+
+		paths = ['path/one.txt', 'path/to/two.txt', 'path/to/stuff/three.txt']
+		maven_paths = ["maven-repository/%s" % path for path in paths]
+
+		srcdir = tempfile.mkdtemp()
+		self.write_dir(srcdir, maven_paths)
+
+		digests = {}
+		zips = archive.create_partitioned_zips_from_dir(srcdir, tempfile.mkdtemp(), digests=digests)
+		self.assertEqual(sorted(digests.keys()), sorted(paths))
+
+		# Partitioning doesn't change the fingerprint...
+		split_digests = {}
+		archive.create_partitioned_zips_from_dir(srcdir, tempfile.mkdtemp(), max_count=1, digests=split_digests)
+		self.assertEqual(archive.fingerprint(split_digests), archive.fingerprint(digests))
+
+		# ...nor does repackaging the same content as a zip...
+		zip_digests = {}
+		archive.create_partitioned_zips_from_zip(zips[0], tempfile.mkdtemp(), digests=zip_digests)
+		self.assertEqual(archive.fingerprint(zip_digests), archive.fingerprint(digests))
+
+		# ...but changing any content does.
+		with open(os.path.join(srcdir, maven_paths[0]), 'a') as f:
+			f.write('changed')
+		changed_digests = {}
+		archive.create_partitioned_zips_from_dir(srcdir, tempfile.mkdtemp(), digests=changed_digests)
+		self.assertNotEqual(archive.fingerprint(changed_digests), archive.fingerprint(digests))
+
+	def test_scan_tree(self):
+		self.load_words()
+
+		paths = ['path/one.txt', 'path/to/two.txt', 'path/to/stuff/three.txt', 'other/four.txt']
+
+		srcdir = tempfile.mkdtemp()
+		self.write_dir(srcdir, paths)
+		os.symlink(os.path.join(srcdir, 'path'), os.path.join(srcdir, 'linked'))
+
+		expected = sorted((path, os.path.getsize(os.path.join(srcdir, path)), os.path.getmtime(os.path.join(srcdir, path))) for path in paths)
+		self.assertEqual(archive.scan_tree(srcdir), expected)
+		self.assertEqual(archive.scan_tree(srcdir, max_workers=1), expected)
+
+		# Without scandir, fall back to listdir + lstat.
+		scandir = archive.scandir
+		archive.scandir = None
+		try:
+			self.assertEqual(archive.scan_tree(srcdir), expected)
+		finally:
+			archive.scandir = scandir
+
+	def test_default_excludes(self):
+		self.load_words()
+
+		paths = ['org/foo/1.0/foo-1.0.pom', 'org/foo/1.0/foo-1.0.jar']
+		junk = ['org/foo/1.0/_remote.repositories', 'org/foo/1.0/foo-1.0.jar.lastUpdated',
+				'org/foo/maven-metadata-local.xml', 'org/foo/resolver-status.properties']
+
+		srcdir = tempfile.mkdtemp()
+		self.write_dir(srcdir, paths + junk)
+		junk_bytes = sum(os.path.getsize(os.path.join(srcdir, path)) for path in junk)
+
+		path_filter = archive.PathFilter()
+		zips = archive.create_partitioned_zips_from_dir(srcdir, tempfile.mkdtemp(), path_filter=path_filter)
+		self.assertEqual(len(zips), 1)
+		self.assertEqual(sorted(zipfile.ZipFile(zips[0]).namelist()), sorted(paths))
+		self.assertEqual(path_filter.skipped_files, len(junk))
+		self.assertEqual(path_filter.skipped_bytes, junk_bytes)
+
+		path_filter = archive.PathFilter(default_excludes=False)
+		zips = archive.create_partitioned_zips_from_dir(srcdir, tempfile.mkdtemp(), path_filter=path_filter)
+		self.assertEqual(len(zipfile.ZipFile(zips[0]).namelist()), len(paths + junk))
+		self.assertEqual(path_filter.skipped_files, 0)
+
+	def test_path_filter_patterns(self):
+		path_filter = archive.PathFilter(includes=['org/*', 're:^com/example/'], excludes=['*.jar', 'org/internal/*'])
+		self.assertEqual(path_filter.accept('org/foo/1.0/foo-1.0.pom'), True)
+		self.assertEqual(path_filter.accept('com/example/bar/1.0/bar-1.0.pom'), True)
+		self.assertEqual(path_filter.accept('org/foo/1.0/foo-1.0.jar', 10), False)
+		self.assertEqual(path_filter.accept('org/internal/x/1.0/x-1.0.pom', 20), False)
+		self.assertEqual(path_filter.accept('net/baz/1.0/baz-1.0.pom', 30), False)
+		self.assertEqual(path_filter.accept('org/foo/1.0/_remote.repositories', 40), False)
+		self.assertEqual(path_filter.skipped_files, 4)
+		self.assertEqual(path_filter.skipped_bytes, 100)
+
+	def test_path_filter_globs_anchored(self):
+		# Path globs match from the start of the path, not anywhere in it.
+		path_filter = archive.PathFilter(includes=['org/*'])
+		self.assertEqual(path_filter.accept('org/foo/1.0/foo-1.0.pom'), True)
+		self.assertEqual(path_filter.accept('com/myorg/foo/1.0/foo-1.0.pom'), False)
+
+		path_filter = archive.PathFilter(excludes=['org/internal/*'])
+		self.assertEqual(path_filter.accept('org/internal/x/1.0/x-1.0.pom'), False)
+		self.assertEqual(path_filter.accept('com/acme/org/internal/x/1.0/x-1.0.pom'), True)
+
+	def test_checksum_sidecars(self):
+		self.load_words()
+
+		paths = ['org/foo/1.0/foo-1.0.pom', 'org/foo/1.0/foo-1.0.jar', 'org/foo/1.0/foo-1.0.jar.sha1', 'org/foo/2.0/foo-2.0.pom']
+
+		srcdir = tempfile.mkdtemp()
+		self.write_dir(srcdir, paths)
+
+		# Each version directory, with its generated sidecars, is one part.
+		outdir = tempfile.mkdtemp()
+		zips = archive.create_partitioned_zips_from_dir(srcdir, outdir, max_count=6, checksums=['sha1', 'md5'])
+
+		parts = [sorted(zipfile.ZipFile(z).namelist()) for z in zips]
+		self.assertEqual(parts, [
+			['org/foo/1.0/foo-1.0.jar', 'org/foo/1.0/foo-1.0.jar.md5', 'org/foo/1.0/foo-1.0.jar.sha1',
+			 'org/foo/1.0/foo-1.0.pom', 'org/foo/1.0/foo-1.0.pom.md5', 'org/foo/1.0/foo-1.0.pom.sha1'],
+			['org/foo/2.0/foo-2.0.pom', 'org/foo/2.0/foo-2.0.pom.md5', 'org/foo/2.0/foo-2.0.pom.sha1'],
+		])
+
+		zf = zipfile.ZipFile(zips[0])
+		pom = zf.read('org/foo/1.0/foo-1.0.pom')
+		self.assertEqual(zf.read('org/foo/1.0/foo-1.0.pom.sha1'), hashlib.sha1(pom).hexdigest())
+		self.assertEqual(zf.read('org/foo/1.0/foo-1.0.pom.md5'), hashlib.md5(pom).hexdigest())
+
+		# The existing .sha1 file is kept, not regenerated.
+		with open(os.path.join(srcdir, 'org/foo/1.0/foo-1.0.jar.sha1')) as f:
+			self.assertEqual(zf.read('org/foo/1.0/foo-1.0.jar.sha1'), f.read())
+
+	def test_gav_units(self):
+		self.load_words()
+
+		gavs = ['org/foo/%d.0' % i for i in range(6)]
+		paths = []
+		for gav in gavs:
+			paths.extend(["%s/foo.pom" % gav, "%s/foo.jar" % gav, "%s/foo.jar.sha1" % gav])
+
+		srcdir = tempfile.mkdtemp()
+		self.write_dir(srcdir, paths)
+
+		# Greedy filling would split GAVs at every 4th file.
+		zips = archive.create_partitioned_zips_from_dir(srcdir, tempfile.mkdtemp(), max_count=4)
+		self.assertEqual(len(zips), 6)
+		for z in zips:
+			names = zipfile.ZipFile(z).namelist()
+			self.assertEqual(len(set(name.rsplit('/', 1)[0] for name in names)), 1)
+			self.assertEqual(len(names), 3)
+
+		# Balanced: 6 GAVs into 2 parts of 3 GAVs each, not 8 + 1.
+		zips = archive.create_partitioned_zips_from_dir(srcdir, tempfile.mkdtemp(), max_count=9)
+		self.assertEqual([len(zipfile.ZipFile(z).namelist()) for z in zips], [9, 9])
+
+	def test_plan_parts(self):
+		# Largest first, into the least-loaded part that fits.
+		self.assertEqual(archive.plan_parts([(1, 50), (1, 40), (1, 30), (1, 20), (1, 10)], max_size=81),
+						 [[0, 3, 4], [1, 2]])
+
+		# Oversized units get parts of their own.
+		self.assertEqual(archive.plan_parts([(1, 10), (1, 500), (3, 10)], max_count=2, max_size=100),
+						 [[0], [1], [2]])
+
+		self.assertEqual(archive.plan_parts([]), [])
@@ -4,6 +4,7 @@ import tempfile
 import os
 from random import randint
 import zipfile
+import hashlib
 
 class ArchiveZipest(NexupBaseTest):
 
@@ -92,3 +93,133 @@ class ArchiveZipest(NexupBaseTest):
 			for info in zf.infolist():
 				print "%s contains: %s" % (z, info.filename)
 				self.assertEqual(info.filename in paths, True)
+
+	def test_mmap_small(self):
+		self.load_words()
+
+		paths = ['path/one.txt', 'path/to/two.txt', 'path/to/stuff/three.txt']
+
+		(_f,src_zip) = tempfile.mkstemp(suffix='.zip')
+
+		self.write_zip(src_zip, paths)
+
+		outdir = tempfile.mkdtemp()
+		zips = archive.create_partitioned_zips_from_zip(src_zip, outdir, use_mmap=True)
+		self.assertEqual(len(zips), 1)
+
+		src = zipfile.ZipFile(src_zip)
+		zf = zipfile.ZipFile(zips[0])
+		for info in zf.infolist():
+			print "%s contains: %s" % (zips[0], info.filename)
+			self.assertEqual(info.filename in paths, True)
+			self.assertEqual(zf.read(info.filename), src.read(info.filename))
+
+	def test_mmap_deflated(self):
+		paths = ['path/one.txt', 'path/to/two.txt', 'path/to/stuff/three.txt']
+		src = "This is a test of the system " * 100
+
+		(_f,src_zip) = tempfile.mkstemp(suffix='.zip')
+
+		zf = zipfile.ZipFile(src_zip, mode='w', compression=zipfile.ZIP_DEFLATED)
+		for path in paths:
+			zf.writestr(path, src)
+		zf.close()
+
+		outdir = tempfile.mkdtemp()
+		zips = archive.create_partitioned_zips_from_zip(src_zip, outdir, use_mmap=True, max_size=2*len(src) + 1)
+		self.assertEqual(len(zips), 2)
+
+		for z in zips:
+			zf = zipfile.ZipFile(z)
+			for info in zf.infolist():
+				print "%s contains: %s" % (z, info.filename)
+				self.assertEqual(info.filename in paths, True)
+				self.assertEqual(zf.read(info.filename), src)
+
+	def test_mmap_deflated_chunks(self):
+		# Incompressible enough to span many inflate chunks.
+		src = ''.join(hashlib.sha1(str(i)).hexdigest() for i in range(2000))
+
+		(_f,src_zip) = tempfile.mkstemp(suffix='.zip')
+		zf = zipfile.ZipFile(src_zip, mode='w', compression=zipfile.ZIP_DEFLATED)
+		zf.writestr('path/big.txt', src)
+		zf.close()
+
+		chunk = archive.MAPPED_INFLATE_CHUNK
+		archive.MAPPED_INFLATE_CHUNK = 1000
+		try:
+			zips = archive.create_partitioned_zips_from_zip(src_zip, tempfile.mkdtemp(), use_mmap=True)
+		finally:
+			archive.MAPPED_INFLATE_CHUNK = chunk
+
+		zf = zipfile.ZipFile(zips[0])
+		self.assertEqual(zf.read('path/big.txt'), src)
+
+	def test_path_filter(self):
+		self.load_words()
+
+		paths = ['maven-repository/org/foo/1.0/foo-1.0.pom', 'maven-repository/org/foo/1.0/_remote.repositories']
+
+		(_f,src_zip) = tempfile.mkstemp(suffix='.zip')
+
+		self.write_zip(src_zip, paths)
+
+		for use_mmap in (False, True):
+			path_filter = archive.PathFilter(excludes=['org/foo/*/*.sha1'])
+			zips = archive.create_partitioned_zips_from_zip(src_zip, tempfile.mkdtemp(), use_mmap=use_mmap, path_filter=path_filter)
+			self.assertEqual(zipfile.ZipFile(zips[0]).namelist(), ['org/foo/1.0/foo-1.0.pom'])
+			self.assertEqual(path_filter.skipped_files, 1)
+
+	def test_checksum_sidecars(self):
+		self.load_words()
+
+		paths = ['org/foo/1.0/foo-1.0.pom', 'org/foo/1.0/foo-1.0.jar']
+
+		(_f,src_zip) = tempfile.mkstemp(suffix='.zip')
+
+		self.write_zip(src_zip, paths)
+
+		for use_mmap in (False, True):
+			digests = {}
+			zips = archive.create_partitioned_zips_from_zip(src_zip, tempfile.mkdtemp(), use_mmap=use_mmap, digests=digests,
+															checksums=archive.CHECKSUM_ALGORITHMS)
+			zf = zipfile.ZipFile(zips[0])
+			self.assertEqual(len(zf.namelist()), len(paths) * 5)
+			for path in paths:
+				self.assertEqual(zf.read(path + '.sha512'), hashlib.sha512(zf.read(path)).hexdigest())
+				self.assertEqual(digests[path], hashlib.sha1(zf.read(path)).hexdigest())
+
+	def test_fingerprint_directory_entries(self):
+		paths = ['org/foo/1.0/foo-1.0.pom', 'org/foo/1.0/foo-1.0.jar']
+
+		srcdir = tempfile.mkdtemp()
+		self.write_dir(srcdir, paths, 'content')
+		digests = {}
+		archive.create_partitioned_zips_from_dir(srcdir, tempfile.mkdtemp(), digests=digests)
+		expected = archive.fingerprint(digests)
+
+		# The same files, with and without the directory entries zip -r writes.
+		for names in (paths, ['org/', 'org/foo/', 'org/foo/1.0/'] + paths):
+			(_f,src_zip) = tempfile.mkstemp(suffix='.zip')
+			zf = zipfile.ZipFile(src_zip, mode='w')
+			for name in names:
+				zf.writestr(name, '' if name.endswith('/') else 'content')
+			zf.close()
+
+			for use_mmap in (False, True):
+				digests = {}
+				archive.create_partitioned_zips_from_zip(src_zip, tempfile.mkdtemp(), use_mmap=use_mmap, digests=digests)
+				self.assertEqual(archive.fingerprint(digests), expected)
+
+	def test_checksum_sidecars_directory_entries(self):
+		# As written by zip -r: an entry for every directory, before its files.
+		paths = ['org/', 'org/foo/', 'org/foo/1.0/', 'org/foo/1.0/foo-1.0.pom']
+
+		(_f,src_zip) = tempfile.mkstemp(suffix='.zip')
+
+		self.write_zip(src_zip, paths, '')
+
+		for use_mmap in (False, True):
+			zips = archive.create_partitioned_zips_from_zip(src_zip, tempfile.mkdtemp(), use_mmap=use_mmap, checksums=['sha1'])
+			names = zipfile.ZipFile(zips[0]).namelist()
+			self.assertEqual([name for name in names if name.endswith('.sha1')], ['org/foo/1.0/foo-1.0.pom.sha1'])
@@ -4,7 +4,9 @@ from __future__ import unicode_literals
 from base import NexupBaseTest
 from unittest import TestCase
 from rcm_nexus import config
+import mock
 import os
+import types
 import yaml
 
 class TestConfigLoad(NexupBaseTest):
@@ -145,6 +147,118 @@ class TestConfigLoad(NexupBaseTest):
         self.assertEqual(nxconfig.username, username)
         self.assertEqual(nxconfig.get_password(), password)
 
+    def test_oracle_password_resolved_once(self):
+        data={
+            'test': {
+                config.URL: 'http://nowhere.com/nexus',
+                config.USERNAME: 'myuser',
+                config.PASSWORD: "@oracle:eval:echo mypassword"
+            }
+        }
+        rc = self.write_config(data)
+        nxconfig = config.load('test')
+
+        with mock.patch.object(config, 'oracle_eval', return_value='mypassword') as oracle:
+            self.assertEqual(nxconfig.get_password(), 'mypassword')
+            self.assertEqual(config.load('test').get_password(), 'mypassword')
+            self.assertEqual(oracle.call_count, 1)
+
+    def test_oracle_password_keyring_cache(self):
+        data={
+            'test': {
+                config.URL: 'http://nowhere.com/nexus',
+                config.USERNAME: 'myuser',
+                config.PASSWORD: "@oracle:eval:echo mypassword",
+                config.PASSWORD_CACHE_TTL: 300,
+            }
+        }
+        rc = self.write_config(data)
+        nxconfig = config.load('test')
+        self.assertEqual(nxconfig.password_cache_ttl, 300)
+
+        stored = {}
+        keyring = mock.Mock()
+        keyring.get_password.side_effect = lambda service, entry: stored.get((service, entry))
+        keyring.set_password.side_effect = lambda service, entry, value: stored.__setitem__((service, entry), value)
+
+        with mock.patch.dict('sys.modules', {'keyring': keyring}):
+            with mock.patch.object(config, 'oracle_eval', return_value='mypassword') as oracle:
+                self.assertEqual(nxconfig.get_password(), 'mypassword')
+
+                # Simulate a second invocation: nothing memoized in-process.
+                config.clear_password_cache()
+                self.assertEqual(nxconfig.get_password(), 'mypassword')
+                self.assertEqual(oracle.call_count, 1)
+
+        self.assertEqual(len(stored), 1)
+        self.assertEqual('mypassword' in stored.keys()[0][1], False)
+
+    def test_oracle_password_keyring_errors(self):
+        data={
+            'test': {
+                config.URL: 'http://nowhere.com/nexus',
+                config.USERNAME: 'myuser',
+                config.PASSWORD: "@oracle:eval:echo mypassword",
+                config.PASSWORD_CACHE_TTL: 300,
+            }
+        }
+        rc = self.write_config(data)
+        nxconfig = config.load('test', debug=True)
+
+        # A keyring backend that is present but unusable, e.g. locked or with no backend configured.
+        errors = types.ModuleType(str('keyring.errors'))
+        errors.KeyringError = type(str('KeyringError'), (Exception,), {})
+        errors.NoKeyringError = type(str('NoKeyringError'), (errors.KeyringError, RuntimeError), {})
+        keyring = types.ModuleType(str('keyring'))
+        keyring.errors = errors
+        keyring.get_password = mock.Mock(side_effect=errors.NoKeyringError('No recommended backend'))
+        keyring.set_password = mock.Mock(side_effect=errors.KeyringError('Keyring is locked'))
+
+        with mock.patch.dict('sys.modules', {'keyring': keyring, 'keyring.errors': errors}):
+            with mock.patch.object(config, 'oracle_eval', return_value='mypassword') as oracle:
+                self.assertEqual(nxconfig.get_password(), 'mypassword')
+                self.assertEqual(nxconfig.get_password(), 'mypassword')
+                self.assertEqual(oracle.call_count, 1)
+
+        self.assertEqual(keyring.get_password.call_count, 1)
+        self.assertEqual(keyring.set_password.call_count, 1)
+
+    def test_parsed_config_cache(self):
+        data={
+            'test': {
+                config.URL: 'http://nowhere.com/nexus',
+            }
+        }
+        profile_map = {
+            'test':{
+                'eap': {
+                    config.GA_PROFILE: '0123456789',
+                    config.EA_PROFILE: '9876543210'
+                }
+            }
+        }
+        rc = self.write_config(data, profile_map)
+        config.load('test')
+        self.assertEqual(len(os.listdir(os.path.join(config.get_cache_dir(), 'config'))), 2)
+
+        # A fresh process would only have the on-disk cache.
+        config.clear_yaml_cache()
+        with mock.patch.object(config, '_parse_yaml') as parse:
+            nxconfig = config.load('test', cli_overrides={config.USERNAME: 'override'})
+            self.assertEqual(parse.call_count, 0)
+        self.assertEqual(nxconfig.get_profile_id('eap', is_ga=True), '0123456789')
+        self.assertEqual(nxconfig.username, 'override')
+        self.assertEqual(config.load('test').username, None)
+
+    def test_parsed_config_cache_invalidated(self):
+        url='http://nowhere.com/nexus'
+        rc = self.write_config({'test': {config.URL: url}})
+        self.assertEqual(config.load('test').url, url)
+
+        url='http://somewhere.else.com/nexus'
+        rc = self.write_config({'test': {config.URL: url}})
+        self.assertEqual(config.load('test').url, url)
+
 
 class TestOracleEval(TestCase):
 
@@ -0,0 +1,89 @@
+from base import NexupBaseTest
+from rcm_nexus import (content, session, archive)
+import responses
+import hashlib
+import tempfile
+
+ITEM_XML = """
+    <content-item>
+      <relativePath>/%(path)s</relativePath>
+      <text>%(text)s</text>
+      <leaf>%(leaf)s</leaf>
+      <lastModified>2017-01-01 00:00:00.0 UTC</lastModified>
+      <sizeOnDisk>%(size)d</sizeOnDisk>
+    </content-item>"""
+
+class TestContent(NexupBaseTest):
+
+    def _add_dir(self, conf, key, path, items):
+        body = "<content><data>%s</data></content>" % ''.join(
+            ITEM_XML % {'path': item_path, 'text': item_path.rstrip('/').rsplit('/', 1)[-1], 'leaf': str(size >= 0).lower(), 'size': size}
+            for (item_path, size) in items)
+        responses.add(responses.GET, conf.url + content.content_path(key, path), body=body, status=200)
+
+    def _add_tree(self, conf, key):
+        self._add_dir(conf, key, '', [('org/', -1)])
+        self._add_dir(conf, key, 'org/', [('org/foo/', -1), ('org/bar/', -1)])
+        self._add_dir(conf, key, 'org/foo/', [('org/foo/foo.pom', 10), ('org/foo/foo.pom.sha1', 40), ('org/foo/foo.jar', 5)])
+        self._add_dir(conf, key, 'org/bar/', [('org/bar/bar.pom', 7)])
+
+    @responses.activate
+    def test_list_content(self):
+        conf = self.create_and_load_conf()
+        self._add_tree(conf, 'releases')
+
+        sess = session.Session(conf)
+        files = content.list_content(sess, 'releases')
+        self.assertEqual(sorted(files.keys()), ['org/bar/bar.pom', 'org/foo/foo.jar', 'org/foo/foo.pom', 'org/foo/foo.pom.sha1'])
+        self.assertEqual(files['org/foo/foo.pom'][0], 10)
+        self.assertEqual(len(responses.calls), 4)
+
+    @responses.activate
+    def test_fetch_checksums_and_cache(self):
+        conf = self.create_and_load_conf()
+        self._add_tree(conf, 'releases')
+        sha1 = hashlib.sha1('pom').hexdigest()
+        responses.add(responses.GET, conf.url + content.content_path('releases', 'org/foo/foo.pom.sha1'),
+                      body="%s  foo.pom\n" % sha1, status=200)
+
+        sess = session.Session(conf)
+        listing = content.load_listing(sess, 'releases')
+        files = listing['files']
+
+        # Only paths with a remote .sha1 file are fetched.
+        self.assertEqual(content.fetch_checksums(sess, 'releases', files, ['org/foo/foo.pom', 'org/foo/foo.jar']), 1)
+        self.assertEqual(files['org/foo/foo.pom'][2], sha1)
+        self.assertEqual(files['org/foo/foo.jar'][2], None)
+        content.save_listing(sess, 'releases', listing)
+
+        calls = len(responses.calls)
+        cached = content.load_listing(sess, 'releases')
+        self.assertEqual(len(responses.calls), calls)
+        self.assertEqual(cached['files']['org/foo/foo.pom'][2], sha1)
+
+        # A refreshed listing keeps checksums of unchanged files.
+        refreshed = content.load_listing(sess, 'releases', refresh=True)
+        self.assertEqual(len(responses.calls), calls + 4)
+        self.assertEqual(refreshed['files']['org/foo/foo.pom'][2], sha1)
+
+    def test_diff_content(self):
+        local = {
+            'org/foo/foo.pom': (3, hashlib.sha1('pom').hexdigest()),
+            'org/foo/foo.pom.sha1': (40, 'ignored'),
+            'org/foo/foo.jar': (6, hashlib.sha1('newjar').hexdigest()),
+            'org/baz/baz.pom': (3, hashlib.sha1('baz').hexdigest()),
+        }
+        remote = {
+            'org/foo/foo.pom': [3, 'then', hashlib.sha1('pom').hexdigest()],
+            'org/foo/foo.jar': [5, 'then', None],
+            'org/bar/bar.pom': [7, 'then', None],
+        }
+        self.assertEqual(content.diff_content(local, remote),
+                         (['org/baz/baz.pom'], ['org/bar/bar.pom'], ['org/foo/foo.jar']))
+
+    def test_digest_content(self):
+        srcdir = tempfile.mkdtemp()
+        self.write_dir(srcdir, ['maven-repository/org/foo/foo.pom', 'maven-repository/org/foo/_remote.repositories'], content='pom')
+
+        local = archive.digest_content(srcdir, archive.PathFilter())
+        self.assertEqual(local, {'org/foo/foo.pom': (3, hashlib.sha1('pom').hexdigest())})
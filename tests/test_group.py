@@ -1,10 +1,12 @@
 from base import (TEST_INPUT_DIR, NexupBaseTest)
 import rcm_nexus
+import rcm_nexus.command
 import responses
 import os
 import yaml
 import traceback
 import tempfile
+from lxml import objectify
 
 PUBLIC_GROUP_TESTDATA=os.path.join(TEST_INPUT_DIR, 'public-group.xml')
 
@@ -135,3 +137,189 @@ class TestGroup(NexupBaseTest):
 			self.assertEqual(rendered_lines[i] in body_lines, True)
 
 
+
+	@responses.activate
+	def test_save_unchanged(self):
+		conf = self.create_and_load_conf()
+		key='public'
+		path = rcm_nexus.group.NAMED_GROUP_PATH.format(key=key)
+		with open(PUBLIC_GROUP_TESTDATA) as f:
+			body=f.read()
+
+		responses.add(responses.GET, conf.url + path, body=body, status=200)
+
+		sess = rcm_nexus.session.Session(conf)
+		group = rcm_nexus.group.load(sess, key)
+
+		# Re-adding an existing member is not a change.
+		group.append_member(sess, 'central').save(sess)
+		self.assertEqual(len(responses.calls), 1)
+
+	@responses.activate
+	def test_save_no_reload(self):
+		conf = self.create_and_load_conf()
+		key='public'
+		path = rcm_nexus.group.NAMED_GROUP_PATH.format(key=key)
+		with open(PUBLIC_GROUP_TESTDATA) as f:
+			body=f.read()
+
+		responses.add(responses.GET, conf.url + path, body=body, status=200)
+		responses.add(responses.PUT, conf.url + path, body='not xml', status=200)
+
+		sess = rcm_nexus.session.Session(conf)
+		group = rcm_nexus.group.load(sess, key)
+		xml = group.xml
+		group.remove_member(sess, 'central').save(sess, reload=False)
+
+		self.assertEqual(len(responses.calls), 2)
+		self.assertEqual('\n' in responses.calls[1].request.body.strip(), False)
+		self.assertEqual(group.xml is xml, True)
+		self.assertEqual(len(group.members()), 3)
+
+		# Saved; nothing more to send.
+		group.save(sess)
+		self.assertEqual(len(responses.calls), 2)
+
+	@responses.activate
+	def test_snapshot_restore(self):
+		conf = self.create_and_load_conf()
+		key='public'
+		path = rcm_nexus.group.NAMED_GROUP_PATH.format(key=key)
+		with open(PUBLIC_GROUP_TESTDATA) as f:
+			body=f.read()
+
+		responses.add(responses.GET, conf.url + path, body=body, status=200)
+		responses.add(responses.PUT, conf.url + path, body=body, status=200)
+
+		sess = rcm_nexus.session.Session(conf)
+		group = rcm_nexus.group.load(sess, key)
+		members = group.member_list()
+		self.assertEqual([m[0] for m in members], ['releases', 'snapshots', 'thirdparty', 'central'])
+
+		snapshot_path = os.path.join(self.tempdir, 'snapshots', 'test.json')
+		rcm_nexus.group.save_snapshot(snapshot_path, 'test', {key: members})
+		snapshot = rcm_nexus.group.load_snapshot(snapshot_path)
+		self.assertEqual(snapshot['environment'], 'test')
+
+		# Unchanged since the snapshot: nothing to save.
+		self.assertEqual(rcm_nexus.group.restore_snapshot(sess, snapshot), [(key, False)])
+		self.assertEqual(len(responses.calls), 2)
+
+		snapshot['groups'][key] = list(reversed(snapshot['groups'][key]))
+		self.assertEqual(rcm_nexus.group.restore_snapshot(sess, snapshot), [(key, True)])
+		self.assertEqual(len(responses.calls), 4)
+
+		restored = rcm_nexus.group.Group(objectify.fromstring(responses.calls[3].request.body))
+		self.assertEqual(restored.member_list(), list(reversed(members)))
+
+	def test_snapshot_retention(self):
+		snapshot_dir = os.path.join(self.tempdir, 'snapshots')
+		os.makedirs(snapshot_dir)
+		names = ['test-20260101T00000%d-eap-100%d.json' % (i, i) for i in range(4)] + ['test-eu-20260101T000000-eap-1000.json', 'notes.txt']
+		for name in names:
+			open(os.path.join(snapshot_dir, name), 'w').close()
+
+		path = os.path.join(snapshot_dir, 'test-20260101T000009-eap-1009.json')
+		rcm_nexus.group.save_snapshot(path, 'test', {}, keep=2)
+
+		# Only this environment's snapshots are pruned, oldest first.
+		self.assertEqual(sorted(os.listdir(snapshot_dir)), ['notes.txt', 'test-20260101T000003-eap-1003.json',
+			'test-20260101T000009-eap-1009.json', 'test-eu-20260101T000000-eap-1000.json'])
+
+	def test_snapshot_path_unique(self):
+		paths = [rcm_nexus.group.snapshot_path('test', 'reorder') for i in range(3)]
+		self.assertEqual(len(set(paths)), 3)
+		self.assertEqual(sorted(paths), paths)
+
+		# ... and pruned like any other snapshot.
+		for path in paths:
+			rcm_nexus.group.save_snapshot(path, 'test', {}, keep=2)
+		self.assertEqual(sorted(os.listdir(os.path.dirname(paths[0]))), [os.path.basename(path) for path in paths[1:]])
+
+	@responses.activate
+	def test_rollback_restore(self):
+		conf = self.create_and_load_conf()
+		key='public'
+		path = rcm_nexus.group.NAMED_GROUP_PATH.format(key=key)
+		with open(PUBLIC_GROUP_TESTDATA) as f:
+			body=f.read()
+
+		responses.add(responses.GET, conf.url + path, body=body, status=200)
+		responses.add(responses.PUT, conf.url + path, body=body, status=200)
+
+		group = rcm_nexus.group.Group(objectify.fromstring(body))
+		members = list(reversed(group.member_list()))
+		snapshot_path = rcm_nexus.group.snapshot_path('test', 'eap-1001')
+		rcm_nexus.group.save_snapshot(snapshot_path, 'test', {key: members})
+
+		rcm_nexus.command.rollback.main(['--restore', snapshot_path], standalone_mode=False)
+
+		self.assertEqual([c.request.method for c in responses.calls], ['GET', 'PUT'])
+		restored = rcm_nexus.group.Group(objectify.fromstring(responses.calls[1].request.body))
+		self.assertEqual(restored.member_list(), members)
+
+	@responses.activate
+	def test_rollback_release_groups_only(self):
+		conf = self.create_and_load_conf()
+		with open(PUBLIC_GROUP_TESTDATA) as f:
+			body=f.read()
+
+		# Both groups contain 'releases'; only the release group may be changed.
+		responses.add(responses.GET, conf.url + rcm_nexus.group.GROUPS_PATH, status=200,
+		              body='<repo-groups><data><repo-groups-item><id>public</id></repo-groups-item>'
+		                   '<repo-groups-item><id>product-ga</id></repo-groups-item></data></repo-groups>')
+		for key in ('public', 'product-ga'):
+			path = rcm_nexus.group.NAMED_GROUP_PATH.format(key=key)
+			responses.add(responses.GET, conf.url + path, body=body.replace('public', key), status=200)
+			responses.add(responses.PUT, conf.url + path, body=body.replace('public', key), status=200)
+
+		rcm_nexus.command.rollback.main(['releases', '-e', 'test'], standalone_mode=False)
+
+		puts = [c.request.url for c in responses.calls if c.request.method == 'PUT']
+		self.assertEqual(puts, [conf.url + rcm_nexus.group.NAMED_GROUP_PATH.format(key='product-ga')])
+
+	def test_reorder_members(self):
+		with open(PUBLIC_GROUP_TESTDATA) as f:
+			group = rcm_nexus.group.Group(objectify.fromstring(f.read()))
+
+		self.assertEqual(group.reorder_members({}), False)
+		self.assertEqual(group.changes(), [])
+
+		# Scored members first; the rest keep their order.
+		self.assertEqual(group.reorder_members({'central': 10, 'thirdparty': 20}), True)
+		self.assertEqual([m[0] for m in group.member_list()], ['thirdparty', 'central', 'releases', 'snapshots'])
+		self.assertEqual(group.changes(), ['repositories'])
+		self.assertEqual(group.reorder_members({'central': 10, 'thirdparty': 20}), False)
+
+	@responses.activate
+	def test_load_index(self):
+		conf = self.create_and_load_conf()
+		with open(PUBLIC_GROUP_TESTDATA) as f:
+			body=f.read()
+		other = body.replace('<id>public</id>', '<id>other</id>').replace('<id>thirdparty</id>', '<id>extra</id>')
+
+		groups = {'public': body, 'other': other}
+		def callbk(req):
+			key = req.url.rsplit('/', 1)[1]
+			etag = '"%s-1"' % key
+			if req.headers.get('If-None-Match') == etag:
+				return (304, {'ETag': etag}, '')
+			return (200, {'ETag': etag}, groups[key])
+
+		listing = '<repo-groups><data>%s</data></repo-groups>' % ''.join(
+			'<repo-groups-item><id>%s</id></repo-groups-item>' % key for key in sorted(groups))
+		responses.add(responses.GET, conf.url + rcm_nexus.group.GROUPS_PATH, body=listing, status=200)
+		for key in groups:
+			responses.add_callback(responses.GET, conf.url + rcm_nexus.group.NAMED_GROUP_PATH.format(key=key), callback=callbk)
+
+		sess = rcm_nexus.session.Session(conf)
+		index = rcm_nexus.group.load_index(sess, max_workers=2)
+		self.assertEqual(index['central'], ['other', 'public'])
+		self.assertEqual(index['thirdparty'], ['public'])
+		self.assertEqual(index['extra'], ['other'])
+		self.assertEqual(len(responses.calls), 3)
+
+		# Revalidated from the cache: no group is downloaded again.
+		self.assertEqual(rcm_nexus.group.load_index(sess, max_workers=2), index)
+		self.assertEqual(len(responses.calls), 6)
+		self.assertEqual(sorted(c.response.status_code for c in responses.calls[3:]), [200, 304, 304])
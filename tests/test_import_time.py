@@ -0,0 +1,48 @@
+from unittest import TestCase
+import os
+import subprocess
+import sys
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Third-party packages that should only be loaded by the code paths that need them.
+HEAVY_MODULES = ['lxml', 'requests', 'yaml']
+
+def imported_modules(statement):
+    """Run statement in a fresh interpreter and return the set of modules it imported.
+       Uses -X importtime where the interpreter supports it (3.7+), and sys.modules otherwise.
+    """
+    if sys.version_info >= (3, 7):
+        p = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', statement],
+                             cwd=PROJECT_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        _out, err = p.communicate()
+        modules = set()
+        for line in err.decode('utf-8').splitlines():
+            if line.startswith('import time:') and '|' in line:
+                modules.add(line.rsplit('|', 1)[1].strip())
+    else:
+        p = subprocess.Popen([sys.executable, '-c', statement + "\nimport sys\nprint('\\n'.join(sys.modules))"],
+                             cwd=PROJECT_DIR, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, _err = p.communicate()
+        modules = set(out.decode('utf-8').splitlines())
+
+    if p.returncode != 0:
+        raise Exception("Failed to run: %s" % statement)
+    return modules
+
+class TestImportTime(TestCase):
+
+    def assertNotLoaded(self, statement):
+        modules = imported_modules(statement)
+        for heavy in HEAVY_MODULES:
+            loaded = [m for m in modules if m == heavy or m.startswith(heavy + '.')]
+            self.assertEqual(loaded, [], "'%s' imported %s" % (statement, heavy))
+
+    def test_import_package(self):
+        self.assertNotLoaded('import rcm_nexus')
+
+    def test_push_help(self):
+        self.assertNotLoaded("import rcm_nexus\nrcm_nexus.push.main(['--help'], standalone_mode=False)")
+
+    def test_rollback_help(self):
+        self.assertNotLoaded("import rcm_nexus\nrcm_nexus.rollback.main(['--help'], standalone_mode=False)")
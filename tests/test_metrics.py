@@ -0,0 +1,217 @@
+from base import (NexupBaseTest, TEST_INPUT_DIR)
+from rcm_nexus import (command, config, group, metrics, session)
+import responses
+import os
+import json
+import re
+import zlib
+from StringIO import StringIO
+
+class TestMetrics(NexupBaseTest):
+
+    def test_path_template(self):
+        self.assertEqual(metrics.path_template('/service/local/staging/profiles/0123/start'),
+                         '/service/local/staging/profiles/{profile_id}/start')
+        self.assertEqual(metrics.path_template('/service/local/repositories/foo-1001/content-compressed?delete=true'),
+                         '/service/local/repositories/{key}/content-compressed')
+        self.assertEqual(metrics.path_template('/service/local/repo_groups/public'),
+                         '/service/local/repo_groups/{key}')
+        self.assertEqual(metrics.path_template('/service/local/repositories'), '/service/local/repositories')
+        self.assertEqual(metrics.path_template('/service/local/repositories/foo-1001/content/org/foo/1.0/foo-1.0.pom'),
+                         '/service/local/repositories/{key}/content/{path}')
+        self.assertEqual(metrics.path_template('/service/local/repo_groups/public/content/org/foo/'),
+                         '/service/local/repo_groups/{key}/content/{path}')
+        self.assertEqual(metrics.path_template('/service/local/staging/repository/foo-1001'),
+                         '/service/local/staging/repository/{repo_id}')
+        self.assertEqual(metrics.path_template('/service/local/staging/repository/foo-1001/activity'),
+                         '/service/local/staging/repository/{repo_id}/activity')
+        self.assertEqual(metrics.path_template('/service/local/staging/profile_repositories/0123'),
+                         '/service/local/staging/profile_repositories/{profile_id}')
+        self.assertEqual(metrics.path_template('/service/local/staging/profile_repositories'),
+                         '/service/local/staging/profile_repositories')
+
+    @responses.activate
+    def test_session_records_requests(self):
+        conf = self.create_and_load_conf()
+        path = '/service/local/repositories/central'
+
+        responses.add(responses.PUT, conf.url + path, body='Updated', status=200)
+
+        recorder = metrics.Recorder()
+        sess = session.Session(conf, recorder=recorder)
+        sess.put(path, 'Test request')
+
+        events = recorder.requests()
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['method'], 'PUT')
+        self.assertEqual(events[0]['path'], '/service/local/repositories/{key}')
+        self.assertEqual(events[0]['status'], 200)
+        self.assertEqual(events[0]['bytes_out'], len('Test request'))
+        self.assertEqual(events[0]['bytes_in'], len('Updated'))
+
+    @responses.activate
+    def test_gzip_response_saved(self):
+        conf = self.create_and_load_conf()
+        path = '/service/local/repositories'
+        body = '<repositories>%s</repositories>' % ('<repository><id>foo</id></repository>' * 100)
+        compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        compressed = compressor.compress(body) + compressor.flush()
+
+        responses.add(responses.GET, conf.url + path, body=compressed, status=200,
+                      adding_headers={'Content-Encoding': 'gzip'})
+
+        recorder = metrics.Recorder()
+        sess = session.Session(conf, recorder=recorder)
+        _response, text = sess.get(path)
+
+        self.assertEqual(text, body)
+        self.assertEqual(responses.calls[0].request.headers['Accept-Encoding'], 'gzip')
+        events = recorder.requests()
+        self.assertEqual(events[0]['bytes_in'], len(compressed))
+        self.assertEqual(events[0]['bytes_saved'], len(body) - len(compressed))
+
+    def test_span_failure(self):
+        recorder = metrics.Recorder()
+        try:
+            with recorder.span('upload', parts=2):
+                raise ValueError('Test error')
+        except ValueError:
+            pass
+
+        spans = recorder.spans()
+        self.assertEqual(len(spans), 1)
+        self.assertEqual(spans[0]['name'], 'upload')
+        self.assertEqual(spans[0]['ok'], False)
+        self.assertEqual(spans[0]['parts'], 2)
+
+    def test_sinks(self):
+        jsonl_path = os.path.join(self.tempdir, 'metrics.jsonl')
+        prom_path = os.path.join(self.tempdir, 'rcm_nexus.prom')
+        stream = StringIO()
+
+        sinks = metrics.sinks_from_specs(['jsonl:%s' % jsonl_path, 'prom:%s' % prom_path])
+        sinks.append(metrics.StderrSummarySink(stream))
+        recorder = metrics.Recorder(sinks)
+        with recorder.span('start'):
+            recorder.record_request('POST', '/service/local/staging/profiles/0123/start', 201, 100, 200, 0.5)
+        recorder.flush()
+
+        with open(jsonl_path) as f:
+            events = [json.loads(line) for line in f]
+        self.assertEqual([e['event'] for e in events], [metrics.REQUEST_EVENT, metrics.SPAN_EVENT])
+
+        with open(prom_path) as f:
+            prom = f.read()
+        self.assertTrue('rcm_nexus_http_requests_total{method="POST",path="/service/local/staging/profiles/{profile_id}/start",status="201"} 1' in prom)
+        self.assertTrue('rcm_nexus_http_sent_bytes_total{method="POST",path="/service/local/staging/profiles/{profile_id}/start"} 100' in prom)
+        self.assertTrue('rcm_nexus_phase_seconds{phase="start",environment="",repo=""}' in prom)
+
+        self.assertTrue('start' in stream.getvalue())
+
+    def test_prom_phases_per_environment(self):
+        prom_path = os.path.join(self.tempdir, 'rcm_nexus.prom')
+        recorder = metrics.Recorder(metrics.sinks_from_specs(['prom:%s' % prom_path]))
+
+        # As recorded by a push to two environments.
+        with recorder.span('zip', repo='/tmp/repo'):
+            pass
+        for environment in ('prod', 'stage'):
+            for phase in ('start', 'upload', 'finish', 'group_update'):
+                with recorder.span(phase, environment=environment):
+                    pass
+        with recorder.span('upload', environment='prod'):
+            pass
+        recorder.flush()
+
+        with open(prom_path) as f:
+            samples = [line.rsplit(' ', 1)[0] for line in f.read().splitlines() if not line.startswith('#')]
+        self.assertEqual(len(samples), len(set(samples)))
+
+        phases = [s for s in samples if s.startswith('rcm_nexus_phase_seconds{')]
+        self.assertEqual(len(phases), 9)
+        self.assertTrue('rcm_nexus_phase_seconds{phase="upload",environment="stage",repo=""}' in phases)
+        self.assertTrue('rcm_nexus_phase_runs_total{phase="upload",environment="prod"}' in samples)
+
+    def add_push_responses(self, environments):
+        conf = dict((env, {config.URL: 'http://%s.example.com/nexus' % env}) for env in environments)
+        profiles = dict((env, {'eap': {config.GA_PROFILE: '0123456789', config.EA_PROFILE: '9876543210'}}) for env in environments)
+        self.write_config(conf, profiles)
+
+        with open(os.path.join(TEST_INPUT_DIR, 'public-group.xml')) as f:
+            group_xml = f.read().replace('public', 'product-earlyaccess')
+        with open(os.path.join(TEST_INPUT_DIR, 'central-repo.xml')) as f:
+            repo_xml = f.read()
+
+        base = r'http://\w+\.example\.com/nexus/service/local'
+        responses.add(responses.POST, re.compile(base + '/staging/profiles/9876543210/start'), status=201,
+                      body='<promoteRequest><data><stagedRepositoryId>eap-1001</stagedRepositoryId></data></promoteRequest>')
+        responses.add(responses.POST, re.compile(base + '/staging/profiles/9876543210/finish'), status=201)
+        responses.add(responses.POST, re.compile(base + '/repositories/eap-1001/content-compressed.*'), status=201)
+        responses.add(responses.GET, re.compile(base + '/repositories/eap-1001'), body=repo_xml, status=200)
+        responses.add(responses.GET, re.compile(base + '/repo_groups/product-earlyaccess'), body=group_xml, status=200)
+        responses.add(responses.PUT, re.compile(base + '/repo_groups/product-earlyaccess'), body=group_xml, status=200)
+
+    def read_samples(self, prom_path):
+        with open(prom_path) as f:
+            return [line.rsplit(' ', 1)[0] for line in f.read().splitlines() if not line.startswith('#')]
+
+    @responses.activate
+    def test_prom_push_two_environments(self):
+        environments = ('prod', 'stage')
+        self.add_push_responses(environments)
+
+        repo = os.path.join(self.tempdir, 'maven-repository')
+        self.write_dir(repo, ['org/foo/bar/1.0/bar-1.0.pom', 'org/foo/bar/1.0/bar-1.0.jar'], 'content')
+        prom_path = os.path.join(self.tempdir, 'rcm_nexus.prom')
+        command.push.main([repo, '-e', 'prod', '-e', 'stage', '-p', 'eap', '-v', '1.0', '--no-wait',
+                           '--metrics', 'prom:%s' % prom_path], standalone_mode=False)
+
+        samples = self.read_samples(prom_path)
+        self.assertEqual(len(samples), len(set(samples)))
+        for env in environments:
+            self.assertTrue('rcm_nexus_phase_seconds{phase="upload",environment="%s",repo="%s"}' % (env, repo) in samples)
+
+    @responses.activate
+    def test_prom_bulk_push(self):
+        self.add_push_responses(['prod'])
+
+        repos = [os.path.join(self.tempdir, name) for name in ('repo-a', 'repo-b')]
+        for repo in repos:
+            self.write_dir(repo, ['org/foo/bar/1.0/bar-1.0.pom'], 'content')
+        manifest = os.path.join(self.tempdir, 'manifest.json')
+        with open(manifest, 'w') as f:
+            json.dump([{'repo': repo, 'product': 'eap', 'version': '1.0', 'environment': 'prod'} for repo in repos], f)
+        prom_path = os.path.join(self.tempdir, 'rcm_nexus.prom')
+        command.bulk_push.main([manifest, '--no-wait', '--metrics', 'prom:%s' % prom_path], standalone_mode=False)
+
+        samples = self.read_samples(prom_path)
+        self.assertEqual(len(samples), len(set(samples)))
+        for repo in repos:
+            for phase in ('zip', 'upload'):
+                self.assertTrue('rcm_nexus_phase_seconds{phase="%s",environment="prod",repo="%s"}' % (phase, repo) in samples)
+        with open(prom_path) as f:
+            self.assertTrue('rcm_nexus_phase_runs_total{phase="upload",environment="prod"} 2\n' in f.read())
+
+    @responses.activate
+    def test_bulk_push_snapshot(self):
+        self.add_push_responses(['prod'])
+
+        repos = [os.path.join(self.tempdir, name) for name in ('repo-a', 'repo-b')]
+        for repo in repos:
+            self.write_dir(repo, ['org/foo/bar/1.0/bar-1.0.pom'], 'content')
+        manifest = os.path.join(self.tempdir, 'manifest.json')
+        with open(manifest, 'w') as f:
+            json.dump([{'repo': repo, 'product': 'eap', 'version': '1.0', 'environment': 'prod'} for repo in repos], f)
+        command.bulk_push.main([manifest, '--no-wait'], standalone_mode=False)
+
+        # One snapshot for the whole manifest, not one per entry.
+        snapshot_dir = os.path.join(config.get_cache_dir(), group.SNAPSHOT_DIR)
+        snapshots = os.listdir(snapshot_dir)
+        self.assertEqual(len(snapshots), 1)
+        snapshot = group.load_snapshot(os.path.join(snapshot_dir, snapshots[0]))
+        self.assertEqual(snapshot['environment'], 'prod')
+        self.assertEqual([m[0] for m in snapshot['groups']['product-earlyaccess']], ['releases', 'snapshots', 'thirdparty', 'central'])
+
+    def test_invalid_sink(self):
+        self.assertRaises(Exception, metrics.sink_from_spec, 'csv:/tmp/out.csv')
+        self.assertRaises(Exception, metrics.sink_from_spec, 'jsonl')
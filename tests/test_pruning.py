@@ -0,0 +1,75 @@
+from base import (TEST_INPUT_DIR, NexupBaseTest)
+from rcm_nexus import (group, pruning, repo, session, staging)
+import responses
+import os
+
+DAY_MS = pruning.DAY * 1000
+NOW = 100 * pruning.DAY
+
+STAGED_ITEM = """
+    <stagingProfileRepository>
+      <repositoryId>%s</repositoryId>
+      <type>closed</type>
+      <description>test</description>
+      %s
+    </stagingProfileRepository>"""
+
+class TestPruning(NexupBaseTest):
+
+	def add_responses(self, conf, created=None):
+		created = created or {'apache-snapshots': 10 * DAY_MS, 'central-m1': 95 * DAY_MS, 'releases': 10 * DAY_MS}
+		staged = ''.join(STAGED_ITEM % (repo_id, '' if timestamp is None else '<createdTimestamp>%d</createdTimestamp>' % timestamp)
+		                 for (repo_id, timestamp) in sorted(created.items()))
+		responses.add(responses.GET, conf.url + staging.PROFILE_REPOS_PATH, status=200,
+		              body='<stagingRepositories><data>%s</data></stagingRepositories>' % staged)
+
+		with open(os.path.join(TEST_INPUT_DIR, 'public-group.xml')) as f:
+			responses.add(responses.GET, conf.url + group.NAMED_GROUP_PATH.format(key='public'), body=f.read(), status=200)
+		responses.add(responses.GET, conf.url + group.GROUPS_PATH, status=200,
+		              body='<repo-groups><data><repo-groups-item><id>public</id></repo-groups-item></data></repo-groups>')
+
+		with open(os.path.join(TEST_INPUT_DIR, 'all-repos.xml')) as f:
+			responses.add(responses.GET, conf.url + repo.REPOS_PATH, body=f.read(), status=200)
+
+	@responses.activate
+	def test_find_orphans(self):
+		conf = self.create_and_load_conf()
+		self.add_responses(conf)
+		sess = session.Session(conf)
+
+		# Not staging repositories (central, ...) and group members (releases) are never orphans.
+		orphans = pruning.find_orphans(sess, 30, now=NOW)
+		self.assertEqual([o[0] for o in orphans], ['apache-snapshots'])
+		self.assertEqual(orphans[0][2], 10 * pruning.DAY)
+
+		orphans = pruning.find_orphans(sess, 1, now=NOW)
+		self.assertEqual([o[0] for o in orphans], ['apache-snapshots', 'central-m1'])
+
+		orphans = pruning.find_orphans(sess, 1, name_pattern='Central', now=NOW)
+		self.assertEqual([o[0] for o in orphans], ['central-m1'])
+
+	@responses.activate
+	def test_find_orphans_unknown_created(self):
+		conf = self.create_and_load_conf()
+		self.add_responses(conf, {'apache-snapshots': 10 * DAY_MS, 'central-m1': None})
+		sess = session.Session(conf)
+
+		# Never pruned on a guess at its age.
+		self.assertEqual(staging.list_staged_repos(sess)['central-m1'][1], None)
+		orphans = pruning.find_orphans(sess, 1, now=NOW)
+		self.assertEqual([o[0] for o in orphans], ['apache-snapshots'])
+
+	@responses.activate
+	def test_delete_repos(self):
+		conf = self.create_and_load_conf()
+		for repo_id in ('foo-1001', 'foo-1002'):
+			responses.add(responses.DELETE, conf.url + repo.NAMED_REPO_PATH.format(key=repo_id), status=204)
+		responses.add(responses.DELETE, conf.url + repo.NAMED_REPO_PATH.format(key='foo-1003'), status=500)
+
+		sess = session.Session(conf)
+		results = dict(pruning.delete_repos(sess, ['foo-1001', 'foo-1002', 'foo-1003'], 2, rate=None))
+
+		self.assertEqual(results['foo-1001'], None)
+		self.assertEqual(results['foo-1002'], None)
+		self.assertNotEqual(results['foo-1003'], None)
+		self.assertEqual(len(responses.calls), 3)
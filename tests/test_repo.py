@@ -50,6 +50,28 @@ class TestRepo(NexupBaseTest):
 		rcm_nexus.repo.push_zip(sess, key, src_zip)
 		self.assertEqual(len(responses.calls), 1)
 
+	def test_throttled_reader(self):
+		self.load_words()
+
+		(_f,src_zip) = tempfile.mkstemp(suffix='.zip')
+		self.write_zip(src_zip, ['path/one.txt', 'path/to/two.txt', 'path/to/stuff/three.txt'])
+		size = os.path.getsize(src_zip)
+
+		class CountingLimiter(object):
+			consumed = 0
+			def consume(self, amount):
+				self.consumed += amount
+
+		limiter = CountingLimiter()
+		with open(src_zip, 'rb') as f:
+			reader = rcm_nexus.repo._ThrottledReader(f, limiter)
+			self.assertEqual(len(reader), size)
+			while reader.read(100):
+				pass
+			self.assertEqual(len(reader), 0)
+
+		self.assertEqual(limiter.consumed, size)
+
 	@responses.activate
 	def test_exists(self):
 		conf = self.create_and_load_conf()
@@ -117,6 +139,32 @@ class TestRepo(NexupBaseTest):
 		repo.save(sess)
 		self.assertEqual(len(responses.calls), 2)
 
+	@responses.activate
+	def test_save_changes_only(self):
+		conf = self.create_and_load_conf()
+		key='central'
+		central_path = rcm_nexus.repo.NAMED_REPO_PATH.format(key=key)
+
+		with open(os.path.join(TEST_INPUT_DIR, 'central-repo.xml')) as f:
+			body=f.read()
+
+		responses.add(responses.GET, conf.url + central_path, body=body, status=200)
+		responses.add(responses.PUT, conf.url + central_path, body=body, status=200)
+
+		sess = rcm_nexus.session.Session(conf)
+		repo = rcm_nexus.repo.load(sess, key)
+		self.assertEqual(repo.changes(), [])
+
+		repo.save(sess)
+		self.assertEqual(len(responses.calls), 1)
+
+		repo.set_exposed(False).set_write_policy(rcm_nexus.repo.WRITE_POLICIES.read_only)
+		self.assertEqual(repo.changes(), ['exposed', 'writePolicy'])
+
+		repo.save(sess)
+		self.assertEqual(len(responses.calls), 2)
+		self.assertEqual(repo.changes(), [])
+
 	@responses.activate
 	def test_load_central(self):
 		conf = self.create_and_load_conf()
@@ -235,6 +283,7 @@ class TestRepo(NexupBaseTest):
 
 		print "Loaded all repositories: %s" % repos
 		self.assertEqual(len(repos), 6)
+		self.assertEqual([r.changes() for r in repos], [[]] * 6)
 		self.assertEqual(len(responses.calls), 1)
 
 
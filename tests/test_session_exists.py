@@ -62,3 +62,39 @@ class TestSessionExists(NexupBaseTest):
 		finally:
 			self.assertEqual(len(responses.calls), 1)
 
+
+	@responses.activate
+	def test_exists_many(self):
+		conf = self.create_and_load_conf()
+		paths = ['/foo/%d' % i for i in range(20)]
+
+		for path in paths:
+			responses.add(responses.HEAD, conf.url + path, status=404 if path == '/foo/7' else 200)
+
+		sess = rcm_nexus.session.Session(conf)
+		results = dict(sess.exists_many(paths, max_workers=4))
+		self.assertEqual(results, dict((path, path != '/foo/7') for path in paths))
+		self.assertEqual(len(responses.calls), len(paths))
+
+	@responses.activate
+	def test_exists_many_stop_on_missing(self):
+		conf = self.create_and_load_conf()
+		paths = ['/foo/%d' % i for i in range(20)]
+
+		for path in paths:
+			responses.add(responses.HEAD, conf.url + path, status=404 if path == '/foo/3' else 200)
+
+		sess = rcm_nexus.session.Session(conf)
+		results = list(sess.exists_many(paths, max_workers=1, stop_on_missing=True))
+		self.assertEqual(results[-1], ('/foo/3', False))
+		self.assertEqual(len(results), 4)
+		self.assertEqual(len(responses.calls) < len(paths), True)
+
+	@responses.activate
+	def test_exists_many_error(self):
+		conf = self.create_and_load_conf()
+
+		responses.add(responses.HEAD, conf.url + '/foo/bar', status=500, body="Test error")
+
+		sess = rcm_nexus.session.Session(conf)
+		self.assertRaises(Exception, list, sess.exists_many(['/foo/bar']))
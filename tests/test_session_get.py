@@ -38,6 +38,19 @@ class TestSessionGet(NexupBaseTest):
 		self.assertEqual(int(resp.headers['content-length']), 12)
 		self.assertEqual(resp.headers['content-type'], 'application/json')
 
+	@responses.activate
+	def test_expect_status_tuple(self):
+		conf = self.create_and_load_conf()
+		path = '/foo/bar'
+
+		responses.add(responses.GET, conf.url + path, status=304)
+
+		sess = rcm_nexus.session.Session(conf)
+		resp,_content=sess.get(path, headers={'If-None-Match': '"abc"'}, expect_status=(200, 304))
+		self.assertEqual(resp.status_code, 304)
+
+		self.assertRaises(Exception, sess.get, path, expect_status=(200, 203))
+
 	@responses.activate
 	def test_ignore_404(self):
 		conf = self.create_and_load_conf()
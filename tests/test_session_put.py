@@ -1,10 +1,11 @@
 
-from base import NexupBaseTest
+from base import (NexupBaseTest, TEST_BASEURL)
 import rcm_nexus
 import responses
 import os
 import yaml
 import traceback
+import zlib
 
 class TestSessionPut(NexupBaseTest):
 	
@@ -123,3 +124,43 @@ class TestSessionPut(NexupBaseTest):
 		self.assertEqual(resp.headers.get('my-header'), 'foo')
 		self.assertEqual(content, response_src)
 
+
+	@responses.activate
+	def test_gzip_body(self):
+		conf = self.create_and_load_conf({'test':{rcm_nexus.config.URL: TEST_BASEURL, rcm_nexus.config.GZIP_REQUESTS: True}})
+		path = '/foo/bar'
+		request_src = "<repo-group>%s</repo-group>" % ("<repo><id>foo</id></repo>" * 200)
+
+		responses.add(responses.PUT, conf.url + path, body="Request successful", status=200)
+
+		sess = rcm_nexus.session.Session(conf)
+		sess.put(path, request_src)
+		# Small bodies are sent as-is.
+		sess.put(path, "Test request")
+
+		self.assertEqual(len(responses.calls), 2)
+		request = responses.calls[0].request
+		self.assertEqual(request.headers['Content-Encoding'], 'gzip')
+		self.assertEqual(zlib.decompress(request.body, 16 + zlib.MAX_WBITS), request_src)
+		self.assertEqual('Content-Encoding' in responses.calls[1].request.headers, False)
+
+	@responses.activate
+	def test_gzip_body_rejected(self):
+		conf = self.create_and_load_conf({'test':{rcm_nexus.config.URL: TEST_BASEURL, rcm_nexus.config.GZIP_REQUESTS: True}})
+		path = '/foo/bar'
+		request_src = "<repo-group>%s</repo-group>" % ("<repo><id>foo</id></repo>" * 200)
+
+		def callbk(req):
+			if 'Content-Encoding' in req.headers:
+				return (415, {}, '')
+			return (200, {}, "Request successful")
+
+		responses.add_callback(responses.PUT, conf.url + path, callback=callbk)
+
+		sess = rcm_nexus.session.Session(conf)
+		resp,content=sess.put(path, request_src)
+
+		self.assertEqual(resp.status_code, 200)
+		self.assertEqual(len(responses.calls), 2)
+		self.assertEqual(responses.calls[1].request.body, request_src)
+		self.assertEqual(sess.gzip_requests, False)
@@ -5,6 +5,8 @@ import os
 import yaml
 import traceback
 import tempfile
+import json
+from lxml import etree
 
 class TestGroup(NexupBaseTest):
 
@@ -84,3 +86,218 @@ class TestGroup(NexupBaseTest):
         staging.finish_staging_repo(sess, conf, repo_id, 'eap', '1.1.1', is_ga=True)
 
         self.assertEqual(len(responses.calls), 1)
+
+    def _staged_repo_xml(self, repo_type, transitioning):
+        return """
+        <stagingProfileRepository>
+          <repositoryId>xyz-1001</repositoryId>
+          <type>%s</type>
+          <transitioning>%s</transitioning>
+        </stagingProfileRepository>
+        """ % (repo_type, str(transitioning).lower())
+
+    @responses.activate
+    def test_wait_for_close_success(self):
+        conf = self.create_and_load_conf()
+        repo_id = 'xyz-1001'
+        url = conf.url + staging.STAGED_REPO_FORMAT.format(repo_id=repo_id)
+
+        responses.add(responses.GET, url, body=self._staged_repo_xml('open', True), status=200)
+        responses.add(responses.GET, url, body=self._staged_repo_xml('open', True), status=200)
+        responses.add(responses.GET, url, body=self._staged_repo_xml('closed', False), status=200)
+
+        delays = []
+        sess = session.Session(conf)
+        staging.wait_for_close(sess, repo_id, initial_delay=1, backoff=2, max_delay=3, sleep=delays.append)
+
+        self.assertEqual(delays, [1, 2])
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_wait_for_close_rule_failure(self):
+        conf = self.create_and_load_conf()
+        repo_id = 'xyz-1001'
+        url = conf.url + staging.STAGED_REPO_FORMAT.format(repo_id=repo_id)
+        activity_xml = """
+        <list>
+          <stagingActivity>
+            <name>close</name>
+            <events>
+              <stagingActivityEvent>
+                <name>ruleEvaluate</name>
+              </stagingActivityEvent>
+              <stagingActivityEvent>
+                <name>ruleFailed</name>
+                <properties>
+                  <stagingProperty>
+                    <name>typeId</name>
+                    <value>signature-staging</value>
+                  </stagingProperty>
+                  <stagingProperty>
+                    <name>failureMessage</name>
+                    <value>Missing Signature: foo-1.0.jar.asc</value>
+                  </stagingProperty>
+                </properties>
+              </stagingActivityEvent>
+              <stagingActivityEvent>
+                <name>repositoryCloseFailed</name>
+                <properties>
+                  <stagingProperty>
+                    <name>cause</name>
+                    <value>Staging rules failed</value>
+                  </stagingProperty>
+                </properties>
+              </stagingActivityEvent>
+            </events>
+          </stagingActivity>
+        </list>
+        """
+
+        responses.add(responses.GET, url, body=self._staged_repo_xml('open', False), status=200)
+        responses.add(responses.GET, conf.url + staging.STAGED_REPO_ACTIVITY_FORMAT.format(repo_id=repo_id), body=activity_xml, status=200)
+
+        sess = session.Session(conf)
+        try:
+            staging.wait_for_close(sess, repo_id, sleep=lambda d: None)
+            self.fail('should have failed with StagingFailure')
+        except staging.StagingFailure as e:
+            self.assertEqual(e.failures, ['Missing Signature: foo-1.0.jar.asc', 'Staging rules failed'])
+
+    @responses.activate
+    def test_wait_for_close_not_started(self):
+        conf = self.create_and_load_conf()
+        repo_id = 'xyz-1001'
+        url = conf.url + staging.STAGED_REPO_FORMAT.format(repo_id=repo_id)
+
+        responses.add(responses.GET, url, body=self._staged_repo_xml('open', False), status=200)
+        responses.add(responses.GET, url, body=self._staged_repo_xml('closed', False), status=200)
+        responses.add(responses.GET, conf.url + staging.STAGED_REPO_ACTIVITY_FORMAT.format(repo_id=repo_id), body='<list/>', status=200)
+
+        sess = session.Session(conf)
+        staging.wait_for_close(sess, repo_id, sleep=lambda d: None)
+        self.assertEqual(len(responses.calls), 3)
+
+    @responses.activate
+    def test_wait_for_close_declared_encoding(self):
+        conf = self.create_and_load_conf()
+        repo_id = 'xyz-1001'
+        url = conf.url + staging.STAGED_REPO_FORMAT.format(repo_id=repo_id)
+        declaration = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+        responses.add(responses.GET, url, body=declaration + self._staged_repo_xml('open', False), status=200)
+        responses.add(responses.GET, url, body=declaration + self._staged_repo_xml('closed', False), status=200)
+        responses.add(responses.GET, conf.url + staging.STAGED_REPO_ACTIVITY_FORMAT.format(repo_id=repo_id),
+                      body=declaration + '<list/>', status=200)
+
+        sess = session.Session(conf)
+        self.assertEqual(staging.get_staging_state(sess, repo_id), ('open', False))
+        self.assertEqual(staging.get_close_failures(sess, repo_id), [])
+        self.assertEqual(staging.get_staging_state(sess, repo_id), ('closed', False))
+
+    @responses.activate
+    def test_wait_for_close_timeout(self):
+        conf = self.create_and_load_conf()
+        repo_id = 'xyz-1001'
+        url = conf.url + staging.STAGED_REPO_FORMAT.format(repo_id=repo_id)
+
+        responses.add(responses.GET, url, body=self._staged_repo_xml('open', True), status=200)
+
+        sess = session.Session(conf)
+        self.assertRaises(Exception, staging.wait_for_close, sess, repo_id, timeout=0, sleep=lambda d: None)
+
+    def test_encode_promote_request(self):
+        xml = staging.encode_promote_request('eap, ver 1.0 <GA> & more', 'xyz-1001')
+        self.assertEqual('\n' in xml.split('\n', 1)[1], False)
+
+        doc = etree.fromstring(xml)
+        self.assertEqual(doc.findtext('data/description'), 'eap, ver 1.0 <GA> & more')
+        self.assertEqual(doc.findtext('data/stagedRepositoryId'), 'xyz-1001')
+
+        data = json.loads(staging.encode_promote_request('eap, ver 1.0', fmt=staging.JSON_FORMAT))
+        self.assertEqual(data, {'data': {'description': 'eap, ver 1.0'}})
+
+    def test_decode_staged_repo_id(self):
+        xml = u"""<?xml version="1.0" encoding="UTF-8"?>
+        <promoteRequest><data><stagedRepositoryId>xyz-1001</stagedRepositoryId></data></promoteRequest>"""
+        self.assertEqual(staging.decode_staged_repo_id(xml), 'xyz-1001')
+
+        text = '{"data": {"stagedRepositoryId": "xyz-1001", "description": "Unused"}}'
+        self.assertEqual(staging.decode_staged_repo_id(text, staging.JSON_FORMAT), 'xyz-1001')
+
+    @responses.activate
+    def test_start_staging_repo_json(self):
+        data={
+            'test': {
+                config.URL: 'http://nowhere.com/nexus',
+                config.STAGING_FORMAT: 'json',
+            }
+        }
+        profile_map = {
+            'test':{
+                'eap': {
+                    config.GA_PROFILE: '0123456789',
+                    config.EA_PROFILE: '9876543210'
+                }
+            }
+        }
+        rc = self.write_config(data, profile_map)
+        conf = config.load('test')
+        path = staging.STAGE_START_FORMAT.format(profile_id='0123456789')
+
+        responses.add(responses.POST, conf.url + path, body='{"data": {"stagedRepositoryId": "xyz-1001"}}', status=201)
+
+        sess = session.Session(conf)
+        repo_id = staging.start_staging_repo(sess, conf, 'eap', '1.1.1', is_ga=True)
+
+        self.assertEqual(repo_id, 'xyz-1001')
+        self.assertEqual(responses.calls[0].request.headers['Content-Type'], 'application/json')
+        self.assertEqual(json.loads(responses.calls[0].request.body)['data']['description'], 'eap, ver 1.1.1 (to GA)')
+
+    @responses.activate
+    def test_find_staged_repo(self):
+        data={
+            'test': {
+                config.URL: 'http://nowhere.com/nexus',
+            }
+        }
+        profile_map = {
+            'test':{
+                'eap': {
+                    config.GA_PROFILE: '0123456789',
+                    config.EA_PROFILE: '9876543210'
+                }
+            }
+        }
+        rc = self.write_config(data, profile_map)
+        conf = config.load('test')
+        path = staging.PROFILE_REPOS_FORMAT.format(profile_id='0123456789')
+
+        fingerprint = 'abc123'
+        description = staging._get_staging_description('eap', '1.1.1', True, fingerprint)
+        self.assertEqual(description, 'eap, ver 1.1.1 (to GA) [content: abc123]')
+
+        item = """
+            <stagingProfileRepository>
+              <repositoryId>%s</repositoryId>
+              <type>%s</type>
+              <description>%s</description>
+              <createdTimestamp>%d</createdTimestamp>
+            </stagingProfileRepository>"""
+        response_xml = "<stagingRepositories><data>%s</data></stagingRepositories>" % ''.join([
+            item % ('xyz-1001', 'closed', description, 1000),
+            item % ('xyz-1002', 'released', description, 2000),
+            item % ('xyz-1003', 'open', description, 3000),
+            item % ('xyz-1004', 'closed', staging._get_staging_description('eap', '1.1.1', True, 'def456'), 4000),
+            item % ('xyz-1005', 'closed', staging._get_staging_description('eap', '1.1.1', True), 5000),
+        ])
+        responses.add(responses.GET, conf.url + path, body=response_xml, status=200)
+
+        sess = session.Session(conf)
+        self.assertEqual(staging.find_staged_repo(sess, conf, 'eap', True, fingerprint), 'xyz-1002')
+        self.assertEqual(staging.find_staged_repo(sess, conf, 'eap', True, 'fed789'), None)
+
+        # Without a profile, every profile's staging repositories are listed.
+        responses.add(responses.GET, conf.url + staging.PROFILE_REPOS_PATH, body=response_xml, status=200)
+        staged = staging.list_staged_repos(sess)
+        self.assertEqual(sorted(staged.keys()), ['xyz-1001', 'xyz-1002', 'xyz-1003', 'xyz-1004', 'xyz-1005'])
+        self.assertEqual(staged['xyz-1003'], ('open', 3000, description))
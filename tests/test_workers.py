@@ -0,0 +1,113 @@
+from unittest import TestCase
+from rcm_nexus import workers
+import threading
+import time
+
+class TestWorkers(TestCase):
+
+    def test_all_results(self):
+        results = dict((item, result) for (item, result, error) in workers.imap_unordered(lambda x: x * 2, range(20), 4))
+        self.assertEqual(results, dict((i, i * 2) for i in range(20)))
+
+    def test_errors_are_returned(self):
+        def func(x):
+            if x == 3:
+                raise ValueError('Test error')
+            return x
+
+        errors = [(item, error) for (item, result, error) in workers.imap_unordered(func, range(5), 2) if error is not None]
+        self.assertEqual(len(errors), 1)
+        self.assertEqual(errors[0][0], 3)
+        self.assertEqual(errors[0][1][0], ValueError)
+
+    def test_bounded_concurrency(self):
+        lock = threading.Lock()
+        state = {'running': 0, 'peak': 0}
+
+        def func(x):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.01)
+            with lock:
+                state['running'] -= 1
+
+        list(workers.imap_unordered(func, range(20), 3))
+        self.assertEqual(state['peak'] <= 3, True)
+
+    def test_early_close(self):
+        started = []
+
+        def func(x):
+            started.append(x)
+            time.sleep(0.01)
+            return x
+
+        gen = workers.imap_unordered(func, range(100), 2)
+        next(gen)
+        gen.close()
+        self.assertEqual(len(started) < 100, True)
+
+        # Nothing is still running once the generator is closed.
+        count = len(started)
+        time.sleep(0.05)
+        self.assertEqual(len(started), count)
+
+    def test_early_close_ordered(self):
+        started = []
+
+        def func(x):
+            started.append(x)
+            time.sleep(0.01)
+            return x
+
+        gen = workers.imap(func, range(100), 2, window=4)
+        next(gen)
+        gen.close()
+        count = len(started)
+        time.sleep(0.05)
+        self.assertEqual(len(started), count)
+        self.assertEqual(count < 100, True)
+
+    def test_rate_limiter(self):
+        state = {'now': 0.0, 'slept': 0.0}
+
+        def sleep(seconds):
+            state['slept'] += seconds
+            state['now'] += seconds
+
+        limiter = workers.RateLimiter(100, clock=lambda: state['now'], sleep=sleep)
+
+        # The first second's worth is available at once, then consumers wait their turn.
+        limiter.consume(100)
+        self.assertEqual(state['slept'], 0)
+        limiter.consume(50)
+        self.assertAlmostEqual(state['slept'], 0.5)
+
+        # Oversized reads go into debt, which the next caller pays off.
+        limiter.consume(300)
+        self.assertAlmostEqual(state['slept'], 3.5)
+
+    def test_imap_ordered(self):
+        def func(x):
+            time.sleep(0.001 * (x % 3))
+            return x * 2
+
+        results = [(item, result) for (item, result, error) in workers.imap(func, range(30), 4)]
+        self.assertEqual(results, [(i, i * 2) for i in range(30)])
+
+    def test_imap_window(self):
+        lock = threading.Lock()
+        state = {'started': 0, 'consumed': 0, 'peak': 0}
+
+        def func(x):
+            with lock:
+                state['started'] += 1
+                state['peak'] = max(state['peak'], state['started'] - state['consumed'])
+            return x
+
+        for (item, result, error) in workers.imap(func, range(50), 2, window=3):
+            time.sleep(0.002)
+            with lock:
+                state['consumed'] += 1
+        self.assertEqual(state['peak'] <= 3, True)